@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+from core.db_connection import get_connection_manager
+
+logger = logging.getLogger("ai_cache")
+
+def default_cache_path() -> str:
+    """AI结果缓存数据库的默认路径，与 rss_news.db 位于同一目录"""
+    return os.path.join(Path(__file__).parent.parent, "data", "ai_cache.db")
+
+# ai_cache.db 中保存的AI结果：评估缓存、简报缓存和本地分类器的训练数据（AI过滤结论）
+AI_CACHE_TABLES = ("evaluation_cache", "summary_cache", "filter_verdicts")
+
+def clear_ai_caches(db_path: Optional[str] = None) -> int:
+    """清空 ai_cache.db 中的评估缓存、简报缓存和过滤结论
+
+    Args:
+        db_path: 缓存数据库路径，默认为 data/ai_cache.db
+
+    Returns:
+        删除的条目数
+    """
+    db_path = db_path or default_cache_path()
+    if not os.path.exists(db_path):
+        return 0
+    conn = get_connection_manager(db_path).get_connection()
+    removed = 0
+    with conn:
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        for table in AI_CACHE_TABLES:
+            if table in existing:
+                removed += conn.execute(f"DELETE FROM {table}").rowcount
+    logger.info(f"已清空AI结果缓存: {removed} 条")
+    return removed
+
+def hash_text(*parts: Any) -> str:
+    """计算若干文本片段的哈希，用于构造缓存键"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part if part is not None else "").encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+def content_hash(content: Dict[str, Any]) -> str:
+    """计算提示词中使用的内容（标题、摘要、全文）的哈希"""
+    return hash_text(content.get("title", ""), content.get("summary", ""), content.get("content", ""))
+
+class EvaluationCache:
+    """内容评估结果的持久化缓存
+
+    缓存键由规范化的文章ID、内容哈希和标签哈希组成，同一篇文章在标签相同的任务中
+    或在重复运行时直接复用评估结果，无需再次调用AI。时效性评级会随时间变化，
+    因此缓存条目在TTL过期后失效并被清理。
+    """
+
+    def __init__(self, db_path: Optional[str] = None, ttl_hours: float = 24):
+        """初始化评估缓存
+
+        Args:
+            db_path: 缓存数据库路径，默认为 data/ai_cache.db
+            ttl_hours: 缓存条目的有效期（小时）
+        """
+        self.db_path = db_path or default_cache_path()
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.ttl_seconds = max(0.0, float(ttl_hours)) * 3600
+        self._connections = get_connection_manager(self.db_path)
+        self._create_tables()
+        self.purge_expired()
+
+    def _create_tables(self):
+        conn = self._connections.get_connection()
+        with conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS evaluation_cache (
+                cache_key TEXT PRIMARY KEY,
+                article_id TEXT,
+                evaluation TEXT,        -- 评估结果JSON
+                created_at REAL         -- 写入时间（Unix时间戳）
+            )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_evaluation_cache_created ON evaluation_cache(created_at)")
+
+    def make_key(self, content: Dict[str, Any], model: str = "") -> str:
+        """根据文章ID、内容哈希、标签和模型构造缓存键
+
+        Args:
+            content: 新闻内容，包含 article_id、feed_labels 和 negative_labels
+            model: 进行评估的模型，换用模型后不复用旧结果
+
+        Returns:
+            缓存键
+        """
+        article_id = content.get("article_id") or content.get("link", "")
+        labels_hash = hash_text(
+            json.dumps(sorted(content.get("feed_labels", []) or []), ensure_ascii=False),
+            json.dumps(sorted(content.get("negative_labels", []) or []), ensure_ascii=False)
+        )
+        return hash_text(article_id, content_hash(content), labels_hash, model)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取未过期的评估结果
+
+        Returns:
+            评估结果字典，未命中或已过期时返回None
+        """
+        try:
+            conn = self._connections.get_connection()
+            row = conn.execute(
+                "SELECT evaluation FROM evaluation_cache WHERE cache_key = ? AND created_at >= ?",
+                (key, time.time() - self.ttl_seconds)
+            ).fetchone()
+            return json.loads(row[0]) if row else None
+        except Exception as e:
+            logger.warning(f"读取评估缓存失败: {e}")
+            return None
+
+    def put(self, key: str, evaluation: Dict[str, Any], article_id: str = ""):
+        """保存评估结果"""
+        try:
+            conn = self._connections.get_connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO evaluation_cache (cache_key, article_id, evaluation, created_at) VALUES (?, ?, ?, ?)",
+                    (key, article_id, json.dumps(evaluation, ensure_ascii=False), time.time())
+                )
+        except Exception as e:
+            logger.warning(f"写入评估缓存失败: {e}")
+
+    def purge_expired(self) -> int:
+        """删除过期的缓存条目
+
+        Returns:
+            删除的条目数
+        """
+        try:
+            conn = self._connections.get_connection()
+            with conn:
+                cursor = conn.execute("DELETE FROM evaluation_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            if cursor.rowcount:
+                logger.info(f"已清理 {cursor.rowcount} 条过期的评估缓存")
+            return cursor.rowcount
+        except Exception as e:
+            logger.warning(f"清理评估缓存失败: {e}")
+            return 0
+
+    def clear(self):
+        """清空评估缓存"""
+        conn = self._connections.get_connection()
+        with conn:
+            conn.execute("DELETE FROM evaluation_cache")
+
+    def close(self):
+        """关闭缓存数据库连接"""
+        self._connections.close_all()
+
+class SummaryCache:
+    """新闻简报的持久化缓存
+
+    缓存键由内容哈希、输出语言、简报风格和模型组成，同一篇转载新闻被多个任务保留时
+    只生成一次简报。缓存按最近使用时间淘汰，条目数超过上限时删除最久未使用的条目。
+    """
+
+    def __init__(self, db_path: Optional[str] = None, max_entries: int = 5000):
+        """初始化简报缓存
+
+        Args:
+            db_path: 缓存数据库路径，默认为 data/ai_cache.db
+            max_entries: 最多保存的简报数
+        """
+        self.db_path = db_path or default_cache_path()
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.max_entries = max(1, int(max_entries))
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        self._connections = get_connection_manager(self.db_path)
+        self._create_tables()
+
+    def _create_tables(self):
+        conn = self._connections.get_connection()
+        with conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS summary_cache (
+                cache_key TEXT PRIMARY KEY,
+                title TEXT,             -- 简化或翻译后的标题
+                news_brief TEXT,
+                summary_method TEXT,
+                created_at REAL,
+                last_used REAL          -- 最近一次命中时间，用于LRU淘汰
+            )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_summary_cache_last_used ON summary_cache(last_used)")
+
+    def make_key(self, content: Dict[str, Any], language: str, style: str, model: str = "") -> str:
+        """根据内容哈希、语言、简报风格和模型构造缓存键"""
+        return hash_text(content_hash(content), language, style, model)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取缓存的简报并更新其最近使用时间
+
+        Returns:
+            包含 title、news_brief 和 summary_method 的字典，未命中时返回None
+        """
+        try:
+            conn = self._connections.get_connection()
+            row = conn.execute(
+                "SELECT title, news_brief, summary_method FROM summary_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._count(hit=False)
+                return None
+            with conn:
+                conn.execute("UPDATE summary_cache SET last_used = ? WHERE cache_key = ?", (time.time(), key))
+            self._count(hit=True)
+            return {"title": row[0], "news_brief": row[1], "summary_method": row[2]}
+        except Exception as e:
+            logger.warning(f"读取简报缓存失败: {e}")
+            self._count(hit=False)
+            return None
+
+    def _count(self, hit: bool):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, key: str, title: str, news_brief: str, summary_method: str):
+        """保存简报，超过条目上限时淘汰最久未使用的条目"""
+        try:
+            now = time.time()
+            conn = self._connections.get_connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO summary_cache (cache_key, title, news_brief, summary_method, created_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, title, news_brief, summary_method, now, now)
+                )
+                count = conn.execute("SELECT COUNT(*) FROM summary_cache").fetchone()[0]
+                if count > self.max_entries:
+                    conn.execute(
+                        "DELETE FROM summary_cache WHERE cache_key IN "
+                        "(SELECT cache_key FROM summary_cache ORDER BY last_used ASC LIMIT ?)",
+                        (count - self.max_entries,)
+                    )
+        except Exception as e:
+            logger.warning(f"写入简报缓存失败: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存命中统计
+
+        Returns:
+            包含 hits、misses 和 hit_rate 的字典
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def clear(self):
+        """清空简报缓存"""
+        conn = self._connections.get_connection()
+        with conn:
+            conn.execute("DELETE FROM summary_cache")
+
+    def close(self):
+        """关闭缓存数据库连接"""
+        self._connections.close_all()
@@ -1,9 +1,19 @@
 import logging
 import json
+import re
 import requests
 import time
+import threading
+from contextlib import contextmanager
 from typing import Dict, Any, Optional, List, Tuple
 from enum import Enum
+from ai_processor.provider_client import get_provider_client, get_request_timeout, endpoint_of
+from ai_processor.json_stream import JsonStreamScanner
+from ai_processor.call_metrics import (RunMetrics, estimate_tokens, PURPOSE_OTHER, PURPOSE_EVALUATE, PURPOSE_EVALUATE_BATCH,
+                                       PURPOSE_CORRECT, PURPOSE_SUMMARIZE, PURPOSE_TITLE)
+from ai_processor.retry_policy import (get_retry_settings, get_circuit_breaker, parse_retry_after, backoff_delay,
+                                       RETRYABLE_STATUS_CODES)
+from ai_processor.endpoint_pool import get_ollama_hosts, get_endpoint_pool
 
 # 配置日志
 logger = logging.getLogger("ai_utils")
@@ -18,6 +28,179 @@ class AiException(Exception):
     """表示AI服务错误的异常"""
     pass
 
+class ProviderHttpError(AiException):
+    """提供商返回了错误的HTTP状态码"""
+    
+    def __init__(self, message: str, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after  # 服务端要求的等待时间（秒）
+    
+    @property
+    def retryable(self) -> bool:
+        return self.status_code in RETRYABLE_STATUS_CODES or self.status_code >= 500
+
+class CircuitOpenError(AiException):
+    """提供商处于熔断状态，调用未发出即失败"""
+    pass
+
+class StructuredOutputUnsupported(AiException):
+    """提供商或模型拒绝了请求中的结构化输出参数"""
+    pass
+
+OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
+SILICONFLOW_API_URL = "https://api.siliconflow.cn/v1/chat/completions"
+
+# 结构化输出模式：json_schema 按JSON Schema约束生成，json_object 只保证输出合法的JSON对象，
+# off 不约束输出（依靠解析和修正提示词），auto 按提供商和模型自动选择
+STRUCTURED_OUTPUT_MODES = ("auto", "json_schema", "json_object", "off")
+
+# 错误响应提到这些参数时才认为是结构化输出不被支持，其他400/422错误（如超出上下文长度）按普通请求错误处理
+STRUCTURED_REJECTION_PATTERN = re.compile(r"response_format|json_schema|\bformat\b", re.IGNORECASE)
+
+# 支持 response_format 为 json_schema 的OpenAI模型前缀，其他OpenAI模型使用 json_object
+OPENAI_JSON_SCHEMA_MODELS = ("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4")
+
+# 没有为某个用途配置模型路由时，依次使用这些用途的路由
+ROUTE_FALLBACK_PURPOSES = {
+    PURPOSE_EVALUATE_BATCH: PURPOSE_EVALUATE,
+    PURPOSE_CORRECT: PURPOSE_EVALUATE,
+    PURPOSE_TITLE: PURPOSE_SUMMARIZE
+}
+
+# 各提供商的默认并发上限：本地Ollama一次只处理一个请求，托管API可以并行处理
+DEFAULT_CONCURRENCY_LIMITS = {
+    AiProvider.OLLAMA.value: 1,
+    AiProvider.OPENAI.value: 8,
+    AiProvider.SILICONFLOW.value: 4
+}
+
+# 各提供商的默认每分钟请求数上限，0表示不限制
+DEFAULT_RATE_LIMITS_RPM = {
+    AiProvider.OLLAMA.value: 0,
+    AiProvider.OPENAI.value: 300,
+    AiProvider.SILICONFLOW.value: 120
+}
+
+# Ollama模型预热的默认设置，可在 ai_settings.warmup 中覆盖
+DEFAULT_WARMUP_SETTINGS = {
+    "enabled": True,
+    "lead_minutes": 5,          # 在任务计划运行前多少分钟加载模型
+    "keep_alive_minutes": 15    # 每次请求后模型保持加载的时间，覆盖任务运行中各请求的间隔
+}
+
+def get_warmup_settings(ai_settings: Dict[str, Any]) -> Dict[str, Any]:
+    """从 ai_settings 中读取模型预热设置，缺失的项使用默认值"""
+    settings = dict(DEFAULT_WARMUP_SETTINGS)
+    settings.update(ai_settings.get("warmup", {}) or {})
+    return settings
+
+def uses_ollama(ai_settings: Dict[str, Any]) -> bool:
+    """默认提供商或任一模型路由是否使用Ollama（需要预热模型）"""
+    provider = ai_settings.get("provider", "ollama")
+    if provider == AiProvider.OLLAMA:
+        return True
+    return any(entry.get("provider", provider) == AiProvider.OLLAMA
+               for entries in (ai_settings.get("model_routes") or {}).values() for entry in entries or [])
+
+class TokenBucket:
+    """令牌桶限速器，令牌以固定速率补充，允许不超过桶容量的突发请求"""
+
+    def __init__(self, rate_per_minute: float, capacity: int = 1):
+        """初始化令牌桶
+
+        Args:
+            rate_per_minute: 每分钟补充的令牌数，0或负数表示不限速
+            capacity: 桶容量，即允许的最大突发请求数
+        """
+        self.rate = max(0.0, float(rate_per_minute)) / 60.0
+        self.capacity = max(1, int(capacity))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取出一个令牌，没有可用令牌时阻塞等待"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_time = (1 - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+class ProviderLimiter:
+    """单个AI提供商的并发上限和请求速率限制，由同一进程中的所有AiService共享"""
+
+    def __init__(self, concurrency: int, rate_per_minute: float):
+        self.concurrency = max(1, int(concurrency))
+        self.rate_per_minute = max(0.0, float(rate_per_minute))
+        self._semaphore = threading.BoundedSemaphore(self.concurrency)
+        self._bucket = TokenBucket(self.rate_per_minute, self.concurrency)
+        self._resume_at = 0.0  # 服务端要求暂停时，所有请求等待到此时刻
+
+    def pause(self, seconds: float):
+        """按服务端的限流响应暂停该提供商的所有请求"""
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    @contextmanager
+    def slot(self):
+        """占用一个并发名额并取得一个令牌，退出时释放名额"""
+        with self._semaphore:
+            wait_time = self._resume_at - time.monotonic()
+            if wait_time > 0:
+                time.sleep(wait_time)
+            self._bucket.acquire()
+            yield
+
+_provider_limiters: Dict[str, ProviderLimiter] = {}
+_provider_limiters_lock = threading.Lock()
+
+def get_provider_limits(ai_settings: Dict[str, Any], provider: str) -> Tuple[int, float]:
+    """读取提供商的并发上限和每分钟请求数上限，缺失时使用默认值
+
+    Args:
+        ai_settings: 配置中的 ai_settings
+        provider: 提供商名称
+
+    Returns:
+        (并发上限, 每分钟请求数上限)
+    """
+    concurrency = (ai_settings.get("concurrency_limits") or {}).get(provider, DEFAULT_CONCURRENCY_LIMITS.get(provider, 1))
+    rate = (ai_settings.get("rate_limits_rpm") or {}).get(provider, DEFAULT_RATE_LIMITS_RPM.get(provider, 0))
+    return max(1, int(concurrency)), max(0.0, float(rate))
+
+def get_limit_scope(provider: str, ai_settings: Dict[str, Any], endpoint_pool=None) -> str:
+    """限流器和熔断器的共享范围：托管API按提供商共享，Ollama按主机或端点池共享
+
+    Args:
+        provider: 提供商名称
+        ai_settings: 服务使用的 ai_settings
+        endpoint_pool: 服务使用的端点池，没有时为None
+
+    Returns:
+        如 "openai"、"ollama@http://localhost:11434"
+    """
+    if provider != AiProvider.OLLAMA:
+        return provider
+    if endpoint_pool:
+        return f"{provider}@" + ",".join(endpoint.url for endpoint in endpoint_pool.endpoints)
+    return f"{provider}@{ai_settings.get('ollama_host', 'http://localhost:11434').rstrip('/')}"
+
+def get_provider_limiter(scope: str, concurrency: int, rate_per_minute: float) -> ProviderLimiter:
+    """获取同一范围（见 get_limit_scope）共享的限流器，设置发生变化时重新创建"""
+    with _provider_limiters_lock:
+        limiter = _provider_limiters.get(scope)
+        if limiter is None or limiter.concurrency != concurrency or limiter.rate_per_minute != rate_per_minute:
+            limiter = ProviderLimiter(concurrency, rate_per_minute)
+            _provider_limiters[scope] = limiter
+        return limiter
+
 class AiService:
     """AI服务抽象类，提供统一的接口调用AI模型"""
     
@@ -36,10 +219,46 @@ class AiService:
         self.provider = self.ai_settings.get("provider", "ollama")
         self.connection_errors = 0  # 连接错误计数
         
+        # 同一服务端的所有调用共享并发上限和请求速率限制：托管API按提供商，Ollama按主机或端点池
+        self.concurrency_limit, self.rate_limit_rpm = get_provider_limits(self.ai_settings, self.provider)
+        # 配置了多个Ollama主机时请求在端点池中分配，每个主机使用上面的并发上限，总并发为各主机之和
+        self.endpoint_pool = None
         if self.provider == AiProvider.OLLAMA:
-            self.ollama_host = self.ai_settings.get("ollama_host", "http://localhost:11434")
+            hosts = get_ollama_hosts(self.ai_settings)
+            if len(hosts) > 1:
+                self.endpoint_pool = get_endpoint_pool(hosts, self.concurrency_limit)
+                self.concurrency_limit = self.endpoint_pool.total_concurrency
+        self.limit_scope = get_limit_scope(self.provider, self.ai_settings, self.endpoint_pool)
+        self.limiter = get_provider_limiter(self.limit_scope, self.concurrency_limit, self.rate_limit_rpm)
+        
+        # 重试退避设置和与限流器同一范围共享的熔断器，指定其他主机的路由不会影响默认服务
+        self.retry_settings = get_retry_settings(self.ai_settings)
+        self.circuit_breaker = get_circuit_breaker(self.limit_scope, self.retry_settings)
+        
+        # 所有AiService共享同一个保持连接的HTTP客户端
+        self.client = get_provider_client()
+        self.request_timeout = get_request_timeout(self.ai_settings, self.provider)
+        
+        # 流式模式：逐步接收响应，可以在收到完整JSON后提前结束，并记录首个token的延迟
+        self.streaming = bool(self.ai_settings.get("streaming", False))
+        self.stream_stats = {"calls": 0, "early_stops": 0, "total_ttft": 0.0, "total_time": 0.0}
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        
+        # 本次任务运行的调用计量，由调度器在每次运行前设置，内容过滤和简报生成共用
+        self.metrics: Optional[RunMetrics] = None
+        
+        if self.provider == AiProvider.OLLAMA:
+            if self.endpoint_pool:
+                self.ollama_host = self.endpoint_pool.endpoints[0].url
+            else:
+                self.ollama_host = self.ai_settings.get("ollama_host", "http://localhost:11434")
             self.ollama_model = self.ai_settings.get("ollama_model", "llama2")
             
+            # 请求时要求Ollama在一段时间内保持模型加载，避免任务运行中途卸载模型
+            self.warmup_settings = get_warmup_settings(self.ai_settings)
+            self.keep_alive = f"{int(self.warmup_settings['keep_alive_minutes'])}m" if self.warmup_settings["enabled"] else None
+            
             # 检查Ollama是否可用
             if not self._check_ollama_availability():
                 raise AiException(f"Ollama在{self.ollama_host}不可用，请确保Ollama服务已启动")
@@ -58,27 +277,254 @@ class AiService:
             # 检查OpenAI是否可用
             if not self.openai_key:
                 raise AiException("未提供OpenAI API密钥，请在设置中添加有效的API密钥")
+        
+        self.structured_output = self._resolve_structured_output()
+        
+        # 按调用用途路由到不同的提供商和模型，每个用途的最后一个备选为上面的默认模型
+        self.routes: Dict[str, List["AiService"]] = self._build_routes()
+    
+    def _build_routes(self) -> Dict[str, List["AiService"]]:
+        """根据 ai_settings.model_routes 为每个用途创建按顺序尝试的AI服务
+        
+        model_routes 的格式为 {用途: [{"provider": ..., "model": ..., "host": ...}, ...]}，
+        host 只用于Ollama。无法初始化的路由（如缺少API密钥、Ollama不可用）被跳过。
+        """
+        routes: Dict[str, List[AiService]] = {}
+        services: Dict[Tuple[str, str, str], AiService] = {}
+        for purpose, entries in (self.ai_settings.get("model_routes") or {}).items():
+            targets = []
+            for entry in entries or []:
+                provider = entry.get("provider", self.provider)
+                model = entry.get("model") or self.ai_settings.get(f"{provider}_model", "")
+                host = entry.get("host", "")
+                key = (provider, model, host)
+                if key not in services:
+                    if (provider, model) == (self.provider, self.model) and (not host or host == getattr(self, "ollama_host", "")):
+                        services[key] = self
+                    else:
+                        try:
+                            services[key] = self._route_service(provider, model, host)
+                        except AiException as e:
+                            logger.warning(f"无法初始化 {purpose} 路由 {provider}:{model}，已跳过: {str(e)}")
+                            continue
+                if services[key] not in targets:
+                    targets.append(services[key])
+            if self not in targets:
+                targets.append(self)
+            routes[purpose] = targets
+            logger.info(f"模型路由 {purpose}: {' -> '.join(f'{service.provider}:{service.model}' for service in targets)}")
+        return routes
+    
+    def _route_service(self, provider: str, model: str, host: str = "") -> "AiService":
+        """创建路由使用的AI服务，除提供商和模型外沿用当前的AI设置"""
+        ai_settings = dict(self.ai_settings, provider=provider, model_routes={})
+        ai_settings[f"{provider}_model"] = model
+        if host:
+            # 指定主机的路由不使用端点池
+            ai_settings["ollama_host"] = host
+            ai_settings["ollama_hosts"] = []
+        global_settings = dict(self.config.get("global_settings", {}), ai_settings=ai_settings)
+        return AiService(dict(self.config, global_settings=global_settings))
+    
+    def route_for(self, purpose: str) -> List["AiService"]:
+        """用途对应的按顺序尝试的AI服务，没有配置路由时只有当前服务"""
+        while purpose not in self.routes and purpose in ROUTE_FALLBACK_PURPOSES:
+            purpose = ROUTE_FALLBACK_PURPOSES[purpose]
+        return self.routes.get(purpose) or [self]
+    
+    def model_id(self, purpose: str = PURPOSE_OTHER) -> str:
+        """用途首选的提供商和模型，如 "ollama:qwen2.5:3b"，用于缓存键"""
+        service = self.route_for(purpose)[0]
+        return f"{service.provider}:{service.model}"
+    
+    def concurrency_limit_for(self, purpose: str) -> int:
+        """用途首选提供商的并发上限"""
+        return self.route_for(purpose)[0].concurrency_limit
+    
+    def circuit_open(self, purpose: str) -> bool:
+        """用途的所有备选提供商是否都处于熔断状态"""
+        return all(service.circuit_breaker.state == service.circuit_breaker.OPEN for service in self.route_for(purpose))
+    
+    def circuit_retry_in(self, purpose: str) -> float:
+        """用途的备选提供商中最早允许试探请求的秒数"""
+        return min(service.circuit_breaker.retry_in() for service in self.route_for(purpose))
+    
+    def _resolve_structured_output(self) -> str:
+        """确定当前提供商和模型使用的结构化输出模式
+        
+        Returns:
+            "json_schema"、"json_object" 或 "off"
+        """
+        mode = str(self.ai_settings.get("structured_output", "auto")).lower()
+        if mode not in STRUCTURED_OUTPUT_MODES:
+            logger.warning(f"未知的结构化输出模式 {mode}，将自动选择")
+            mode = "auto"
+        if mode != "auto":
+            return mode
+        if self.provider == AiProvider.OLLAMA:
+            return "json_schema"  # Ollama 0.5 起 format 参数接受JSON Schema
+        if self.provider == AiProvider.OPENAI:
+            return "json_schema" if self.openai_model.startswith(OPENAI_JSON_SCHEMA_MODELS) else "json_object"
+        return "json_object"
+    
+    def _constrained_schema(self, json_schema: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """当前模式下能够用于约束输出的JSON Schema，不能约束时返回None
+        
+        OpenAI兼容接口的 response_format 和 Ollama 的 "json" 格式只能输出JSON对象，
+        要求返回数组的请求只有Ollama的JSON Schema模式才能约束。
+        """
+        if json_schema is None or self.structured_output == "off":
+            return None
+        if json_schema.get("type") == "array" and not (self.provider == AiProvider.OLLAMA and self.structured_output == "json_schema"):
+            return None
+        return json_schema
+    
+    def _apply_output_format(self, payload: Dict[str, Any], json_schema: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """在请求体中加入结构化输出参数"""
+        if json_schema is None:
+            return payload
+        if self.provider == AiProvider.OLLAMA:
+            payload["format"] = json_schema if self.structured_output == "json_schema" else "json"
+        elif self.structured_output == "json_schema":
+            payload["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "structured_response", "schema": json_schema, "strict": True}
+            }
+        else:
+            payload["response_format"] = {"type": "json_object"}
+        return payload
+    
+    def _check_structured_rejection(self, response: requests.Response, json_schema: Optional[Dict[str, Any]]):
+        """带结构化输出参数的请求因该参数被拒绝（400/422，错误信息提到结构化输出参数）时抛出 StructuredOutputUnsupported"""
+        if json_schema is not None and response.status_code in (400, 422) and STRUCTURED_REJECTION_PATTERN.search(response.text or ""):
+            raise StructuredOutputUnsupported(f"{self.provider} 拒绝了结构化输出参数: {response.status_code}, {response.text[:200]}")
     
     def _check_ollama_availability(self) -> bool:
-        """检查Ollama服务是否可用
+        """检查Ollama服务是否可用，最近的请求结果未过期时不再探测
+        
+        使用端点池时探测所有主机并移出不可用的主机，至少一个主机可用即可。
         
         Returns:
             布尔值表示是否可用
         """
+        if self.endpoint_pool:
+            return self.endpoint_pool.check_health(self.client)
+        return self.client.check_health(f"{self.ollama_host}/api/tags")
+    
+    def health(self) -> Dict[str, Any]:
+        """当前提供商端点的健康状态，使用端点池时包括每个主机的负载"""
+        health = self.client.health(endpoint_of(self._endpoint_url())).to_dict()
+        if self.endpoint_pool:
+            health["endpoints"] = self.endpoint_pool.report()
+        return health
+    
+    def _endpoint_url(self) -> str:
+        if self.provider == AiProvider.OLLAMA:
+            return self.ollama_host
+        elif self.provider == AiProvider.SILICONFLOW:
+            return SILICONFLOW_API_URL
+        return OPENAI_API_URL
+    
+    def warm_up(self) -> int:
+        """预先加载Ollama模型，使任务的第一个请求不必等待模型加载
+        
+        向本服务和模型路由使用的每个Ollama模型发送空提示词的请求（只加载模型，不生成内容），
+        使用端点池时预热每个主机。模型保持加载到任务开始后 keep_alive_minutes 分钟，
+        之后由任务中的请求继续保持。其他提供商不需要预热。
+        
+        Returns:
+            成功预热的主机和模型组合数
+        """
+        services = {id(service): service for targets in self.routes.values() for service in targets}
+        services.setdefault(id(self), self)
+        warmed = 0
+        for service in services.values():
+            if service.provider != AiProvider.OLLAMA or not service.keep_alive:
+                continue
+            settings = service.warmup_settings
+            keep_alive = f"{int(settings['lead_minutes'] + settings['keep_alive_minutes'])}m"
+            hosts = [endpoint.url for endpoint in service.endpoint_pool.endpoints] if service.endpoint_pool else [service.ollama_host]
+            for host in hosts:
+                start_time = time.monotonic()
+                try:
+                    response = service._post(f"{host}/api/generate",
+                                             json={"model": service.ollama_model, "prompt": "", "keep_alive": keep_alive})
+                    if response.status_code != 200:
+                        raise service._http_error("Ollama", response)
+                    warmed += 1
+                    logger.info(f"已预热 {host} 上的模型 {service.ollama_model}，耗时 {time.monotonic() - start_time:.1f}秒，"
+                                f"保持加载 {keep_alive}")
+                except Exception as e:
+                    logger.warning(f"预热 {host} 上的模型 {service.ollama_model} 失败: {str(e)}")
+        return warmed
+    
+    @contextmanager
+    def _endpoint_slot(self):
+        """使用端点池时为本次请求分配一个Ollama主机，请求结束后归还
+        
+        服务不可达或返回可重试的错误时记为该主机的失败，连续失败的主机被暂时移出，
+        重试会优先分配到其他主机。
+        """
+        if not self.endpoint_pool:
+            yield
+            return
+        endpoint = self.endpoint_pool.acquire()
+        self._local.ollama_host = endpoint.url
         try:
-            # 尝试ping Ollama，5秒超时
-            response = requests.get(f"{self.ollama_host}/api/tags", timeout=5)
-            return response.status_code == 200
+            yield
         except Exception as e:
-            logger.warning(f"无法连接到Ollama: {str(e)}")
-            return False
+            host_failure = not isinstance(e, (ProviderHttpError, StructuredOutputUnsupported)) or \
+                (isinstance(e, ProviderHttpError) and e.retryable)
+            self.endpoint_pool.release(endpoint, failed=host_failure, error=str(e))
+            raise
+        else:
+            self.endpoint_pool.release(endpoint)
+        finally:
+            self._local.ollama_host = None
     
-    def call_ai(self, prompt: str, max_retries=1) -> str:
-        """调用AI模型获取响应
+    def _ollama_url(self) -> str:
+        """当前请求使用的Ollama主机"""
+        return getattr(self._local, "ollama_host", None) or self.ollama_host
+    
+    def _post(self, url: str, **kwargs) -> requests.Response:
+        """通过共享客户端发送请求，连接池大小与提供商并发上限一致"""
+        return self.client.post(url, timeout=self.request_timeout, pool_size=self.concurrency_limit, **kwargs)
+    
+    def call_ai(self, prompt: str, max_retries=1, stop_on_json: Optional[str] = None,
+                json_schema: Optional[Dict[str, Any]] = None, purpose: str = PURPOSE_OTHER) -> str:
+        """按用途的模型路由调用AI模型获取响应，首选模型失败时依次改用备选模型
+        
+        参数和返回值与 call_model 相同。
+        
+        Raises:
+            AiException: 当所有备选模型都调用失败时，抛出最后一个模型的错误
+        """
+        targets = self.route_for(purpose)
+        if len(targets) == 1:
+            return targets[0].call_model(prompt, max_retries, stop_on_json, json_schema, purpose)
+        last_error = None
+        for index, service in enumerate(targets):
+            service.metrics = self.metrics
+            try:
+                return service.call_model(prompt, max_retries, stop_on_json, json_schema, purpose)
+            except AiException as e:
+                last_error = e
+                if index + 1 < len(targets):
+                    logger.warning(f"{purpose} 使用 {service.provider}:{service.model} 失败，改用 "
+                                   f"{targets[index + 1].provider}:{targets[index + 1].model}: {str(e)}")
+        raise last_error
+    
+    def call_model(self, prompt: str, max_retries=1, stop_on_json: Optional[str] = None,
+                   json_schema: Optional[Dict[str, Any]] = None, purpose: str = PURPOSE_OTHER) -> str:
+        """使用本服务的提供商和模型调用AI获取响应
         
         Args:
             prompt: 提示词
             max_retries: 最大重试次数
+            stop_on_json: 流式模式下收到完整的JSON后提前结束响应，"{" 表示对象，"[" 表示数组
+            json_schema: 期望的响应结构，提供商支持结构化输出时按此约束生成；
+                提供商拒绝该参数时本服务之后的调用不再使用结构化输出
+            purpose: 调用用途，用于按用途统计token和耗时
             
         Returns:
             AI响应文本
@@ -87,33 +533,281 @@ class AiService:
             AiException: 当AI调用失败时
         """
         # Log AI provider and model being used
-        logger.info(f"Calling AI service: provider={self.provider}, model={self.ollama_model if self.provider == AiProvider.OLLAMA else self.siliconflow_model if self.provider == AiProvider.SILICONFLOW else self.openai_model}")
+        logger.info(f"Calling AI service: provider={self.provider}, model={self.model}, purpose={purpose}")
         logger.info(f"Using prompt language hint: {'English' if 'IN ENGLISH ONLY' in prompt else 'Not specified'}")
         
+        start_time = time.monotonic()
+        self._local.usage = None
         for retry in range(max_retries + 1):
+            if not self.circuit_breaker.allow():
+                self._record_call(purpose, prompt, "", start_time, retry, False)
+                raise CircuitOpenError(f"{self.provider} 处于熔断状态，{self.circuit_breaker.retry_in():.0f} 秒后再试: "
+                                       f"{self.circuit_breaker.last_error}")
             try:
-                if self.provider == AiProvider.OLLAMA:
-                    return self._call_ollama(prompt)
-                elif self.provider == AiProvider.SILICONFLOW:
-                    return self._call_siliconflow(prompt)
-                else:
-                    return self._call_openai(prompt)
+                json_schema = self._constrained_schema(json_schema)
+                try:
+                    with self.limiter.slot(), self._endpoint_slot():
+                        result = self._dispatch(prompt, stop_on_json, json_schema)
+                except StructuredOutputUnsupported as e:
+                    # 不计入重试次数，立即以普通模式重新请求
+                    logger.warning(f"{str(e)}，之后将不使用结构化输出")
+                    self.structured_output = "off"
+                    json_schema = None
+                    with self.limiter.slot(), self._endpoint_slot():
+                        result = self._dispatch(prompt, stop_on_json, None)
+                self.circuit_breaker.record_success()
+                self._record_call(purpose, prompt, result, start_time, retry, True)
+                return result
             except Exception as e:
                 logger.error(f"调用AI失败 (尝试 {retry+1}/{max_retries+1}): {str(e)}")
                 self.connection_errors += 1
-                if retry < max_retries:
-                    time.sleep(2)  # 重试前等待2秒
+                # 请求本身有误（如401、400）说明服务可达，不计入熔断，重试也无济于事
+                retryable = not isinstance(e, ProviderHttpError) or e.retryable
+                if retryable:
+                    self.circuit_breaker.record_failure(str(e)[:200])
                 else:
+                    self.circuit_breaker.record_success()
+                delay = self._retry_delay(e, retry) if retryable and retry < max_retries else None
+                if delay is None:
+                    self._record_call(purpose, prompt, "", start_time, retry, False)
                     raise AiException(f"AI服务调用失败: {str(e)}")
+                logger.info(f"{delay:.1f} 秒后重试")
+                time.sleep(delay)
         
         # 正常情况下不会执行到这里，因为如果所有重试都失败，会在上面的异常处理中抛出异常
         raise AiException("AI服务调用失败")
     
-    def _call_ollama(self, prompt: str) -> str:
+    @property
+    def model(self) -> str:
+        """当前提供商使用的模型"""
+        return getattr(self, f"{self.provider}_model", "")
+    
+    def _record_usage(self, prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+        """保存提供商在响应中返回的token用量，供本次调用的计量使用"""
+        if prompt_tokens is not None or completion_tokens is not None:
+            self._local.usage = (prompt_tokens, completion_tokens)
+    
+    def _record_call(self, purpose: str, prompt: str, response: str, start_time: float, retries: int, success: bool):
+        """记录一次调用的计量，提供商没有返回用量时按文本长度估算token数"""
+        if self.metrics is None:
+            return
+        prompt_tokens, completion_tokens = getattr(self._local, "usage", None) or (None, None)
+        estimated = prompt_tokens is None or completion_tokens is None
+        if prompt_tokens is None:
+            prompt_tokens = estimate_tokens(prompt)
+        if completion_tokens is None:
+            completion_tokens = estimate_tokens(response) if response else 0
+        self.metrics.record_call(self.provider, self.model, purpose, prompt_tokens, completion_tokens,
+                                 estimated, time.monotonic() - start_time, retries, success)
+    
+    def record_cache_hit(self, purpose: str):
+        """记录一次由缓存代替的调用，计入用途首选的模型"""
+        if self.metrics is not None:
+            service = self.route_for(purpose)[0]
+            self.metrics.record_cache_hit(service.provider, service.model, purpose)
+    
+    def _retry_delay(self, error: Exception, retry: int) -> Optional[float]:
+        """第 retry 次失败后的等待时间，服务端要求的等待时间过长时返回None（不再重试）
+        
+        服务端通过 Retry-After 等响应头给出等待时间时以其为准（不短于退避时间），
+        并暂停该提供商的所有请求，避免其他线程继续触发限流。
+        """
+        delay = backoff_delay(retry, float(self.retry_settings.get("base_delay", 1.0)),
+                              float(self.retry_settings.get("max_delay", 30.0)))
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is None:
+            return delay
+        if retry_after > float(self.retry_settings.get("max_retry_after", 120.0)):
+            logger.warning(f"{self.provider} 要求等待 {retry_after:.0f} 秒，超过上限，不再重试")
+            return None
+        self.limiter.pause(retry_after)
+        return max(delay, retry_after)
+    
+    def circuit_state(self) -> Dict[str, Any]:
+        """当前提供商熔断器的状态"""
+        return self.circuit_breaker.to_dict()
+    
+    def _http_error(self, name: str, response: requests.Response) -> ProviderHttpError:
+        return ProviderHttpError(f"{name} API错误: {response.status_code}, {response.text}", response.status_code,
+                                 parse_retry_after(response.headers))
+    
+    def _dispatch(self, prompt: str, stop_on_json: Optional[str], json_schema: Optional[Dict[str, Any]]) -> str:
+        """按当前模式和提供商发送一次请求"""
+        kwargs = {"json_schema": json_schema} if json_schema is not None else {}
+        if self.streaming:
+            return self._call_streaming(prompt, stop_on_json, **kwargs)
+        if self.provider == AiProvider.OLLAMA:
+            return self._call_ollama(prompt, **kwargs)
+        elif self.provider == AiProvider.SILICONFLOW:
+            return self._call_siliconflow(prompt, **kwargs)
+        else:
+            return self._call_openai(prompt, **kwargs)
+    
+    @property
+    def last_call_stats(self) -> Optional[Dict[str, Any]]:
+        """当前线程最近一次流式调用的统计：ttft、total、stopped_early"""
+        return getattr(self._local, "last_call", None)
+    
+    def log_stream_stats(self):
+        """记录流式调用的统计，包括模型路由使用的其他服务"""
+        for service in {id(service): service for targets in self.routes.values() for service in targets}.values():
+            if service is not self:
+                service.log_stream_stats()
+        with self._stats_lock:
+            stats = dict(self.stream_stats)
+        if stats["calls"]:
+            logger.info(f"流式调用统计 ({self.provider}:{self.model}): {stats['calls']} 次, 平均首个token {stats['total_ttft']/stats['calls']:.2f}秒, "
+                        f"平均耗时 {stats['total_time']/stats['calls']:.2f}秒, 提前结束 {stats['early_stops']} 次")
+    
+    def _record_stream_stats(self, ttft: float, total: float, stopped_early: bool):
+        self._local.last_call = {"ttft": ttft, "total": total, "stopped_early": stopped_early}
+        with self._stats_lock:
+            self.stream_stats["calls"] += 1
+            self.stream_stats["early_stops"] += int(stopped_early)
+            self.stream_stats["total_ttft"] += ttft
+            self.stream_stats["total_time"] += total
+    
+    def _streaming_request(self, prompt: str, json_schema: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[Dict[str, str]], Dict[str, Any]]:
+        """构建流式请求的URL、请求头和请求体"""
+        if self.provider == AiProvider.OLLAMA:
+            return f"{self._ollama_url()}/api/generate", None, self._ollama_payload(prompt, True, json_schema)
+        elif self.provider == AiProvider.SILICONFLOW:
+            return SILICONFLOW_API_URL, self._bearer_headers(self.siliconflow_key), self._siliconflow_payload(prompt, True, json_schema)
+        return OPENAI_API_URL, self._bearer_headers(self.openai_key), self._openai_payload(prompt, True, json_schema)
+    
+    def _parse_stream_line(self, line: str) -> Tuple[str, bool]:
+        """解析流式响应的一行
+        
+        Ollama每行是一个JSON对象；OpenAI兼容接口使用SSE格式（"data: {...}"，以 "data: [DONE]" 结束）
+        
+        Returns:
+            (本行的文本片段, 响应是否结束)
+        """
+        if self.provider == AiProvider.OLLAMA:
+            data = json.loads(line)
+            if data.get("error"):
+                raise Exception(f"Ollama流式响应错误: {data['error']}")
+            if data.get("done"):
+                self._record_usage(data.get("prompt_eval_count"), data.get("eval_count"))
+            return data.get("response", ""), bool(data.get("done"))
+        
+        if not line.startswith("data:"):
+            return "", False
+        payload = line[5:].strip()
+        if payload == "[DONE]":
+            return "", True
+        data = json.loads(payload)
+        usage = data.get("usage") or {}
+        self._record_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        choices = data.get("choices") or []
+        if not choices:
+            return "", False
+        # 结束原因之后还有附带token用量的数据块，读到 [DONE] 为止
+        piece = (choices[0].get("delta") or {}).get("content") or ""
+        return piece, False
+    
+    def _call_streaming(self, prompt: str, stop_on_json: Optional[str] = None, json_schema: Optional[Dict[str, Any]] = None) -> str:
+        """以流式方式调用当前提供商
+        
+        Args:
+            prompt: 提示词
+            stop_on_json: 收到以该字符开始的完整JSON后立即关闭连接，不再接收后续内容
+            json_schema: 结构化输出使用的JSON Schema
+            
+        Returns:
+            响应文本；提前结束时截止到完整JSON的末尾
+            
+        Raises:
+            Exception: 当调用出错或响应为空时
+        """
+        url, headers, payload = self._streaming_request(prompt, json_schema)
+        scanner = JsonStreamScanner(stop_on_json) if stop_on_json else None
+        logger.info(f"流式调用{self.provider}{' (收到完整JSON后提前结束)' if scanner else ''}")
+        
+        start_time = time.monotonic()
+        ttft = None
+        pieces = []
+        stopped_early = False
+        response = self._post(url, headers=headers, json=payload, stream=True)
+        try:
+            self._check_structured_rejection(response, json_schema)
+            if response.status_code != 200:
+                raise self._http_error(self.provider, response)
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                piece, done = self._parse_stream_line(line.decode("utf-8"))
+                if piece:
+                    if ttft is None:
+                        ttft = time.monotonic() - start_time
+                    pieces.append(piece)
+                    if scanner is not None and scanner.feed(piece):
+                        stopped_early = True
+                        break
+                if done:
+                    break
+        finally:
+            # 提前结束时关闭连接，服务端随即停止生成
+            response.close()
+        
+        total_time = time.monotonic() - start_time
+        result = scanner.result_text() if stopped_early else "".join(pieces)
+        if not result:
+            raise Exception(f"{self.provider}返回了空响应")
+        
+        self._record_stream_stats(ttft if ttft is not None else total_time, total_time, stopped_early)
+        logger.info(f"流式响应完成: 首个token {ttft if ttft is not None else total_time:.2f}秒, 总耗时 {total_time:.2f}秒, "
+                    f"长度 {len(result)} 字符{', 收到完整JSON后提前结束' if stopped_early else ''}")
+        return result
+    
+    def _bearer_headers(self, key: str) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {key}",
+            "Content-Type": "application/json"
+        }
+    
+    def _ollama_payload(self, prompt: str, stream: bool = False, json_schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        payload = {
+            "model": self.ollama_model,
+            "prompt": prompt,
+            "stream": stream
+        }
+        if self.keep_alive:
+            payload["keep_alive"] = self.keep_alive
+        return self._apply_output_format(payload, json_schema)
+    
+    def _siliconflow_payload(self, prompt: str, stream: bool = False, json_schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return self._apply_output_format({
+            "model": self.siliconflow_model,
+            "messages": [
+                {"role": "system", "content": "你是一个专业的新闻分析和处理助手。"},
+                {"role": "user", "content": prompt}
+            ],
+            "stream": stream,
+            "temperature": 0.7,
+            "max_tokens": 2048
+        }, json_schema)
+    
+    def _openai_payload(self, prompt: str, stream: bool = False, json_schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        payload = {
+            "model": self.openai_model,
+            "messages": [
+                {"role": "system", "content": "你是一个专业的新闻分析和处理助手。"},
+                {"role": "user", "content": prompt}
+            ]
+        }
+        if stream:
+            payload["stream"] = True
+            # 最后一个数据块附带token用量
+            payload["stream_options"] = {"include_usage": True}
+        return self._apply_output_format(payload, json_schema)
+    
+    def _call_ollama(self, prompt: str, json_schema: Optional[Dict[str, Any]] = None) -> str:
         """调用Ollama API获取响应
         
         Args:
             prompt: 提示词
+            json_schema: 结构化输出使用的JSON Schema
             
         Returns:
             Ollama的响应文本
@@ -130,37 +824,35 @@ class AiService:
             #     final_prompt += "\n/no_think"
             #     logger.info("检测到Qwen模型，已在提示词末尾添加 /no_think")
 
-            response = requests.post(
-                f"{self.ollama_host}/api/generate",
-                json={
-                    "model": self.ollama_model,
-                    "prompt": final_prompt, # Use the potentially modified prompt
-                    "stream": False
-                },
-                timeout=120  # 120秒超时
+            response = self._post(
+                f"{self._ollama_url()}/api/generate",
+                json=self._ollama_payload(final_prompt, json_schema=json_schema) # Use the potentially modified prompt
             )
             
+            self._check_structured_rejection(response, json_schema)
             if response.status_code == 200:
                 data = response.json()
                 result = data.get("response", "")
                 if not result:
                     raise Exception("Ollama返回了空响应")
+                self._record_usage(data.get("prompt_eval_count"), data.get("eval_count"))
                     
                 logger.info(f"Ollama响应成功，长度: {len(result)} 字符")
                 return result
             else:
-                error_msg = f"Ollama API错误: {response.status_code}, {response.text}"
-                logger.error(error_msg)
-                raise Exception(error_msg)
+                error = self._http_error("Ollama", response)
+                logger.error(str(error))
+                raise error
         except Exception as e:
             logger.error(f"调用Ollama时出错: {str(e)}")
             raise  # 重新抛出异常
     
-    def _call_siliconflow(self, prompt: str) -> str:
+    def _call_siliconflow(self, prompt: str, json_schema: Optional[Dict[str, Any]] = None) -> str:
         """调用硅基流动 API获取响应
         
         Args:
             prompt: 提示词
+            json_schema: 结构化输出使用的JSON Schema
             
         Returns:
             硅基流动的响应文本
@@ -171,52 +863,37 @@ class AiService:
         try:
             logger.info(f"调用硅基流动 (模型: {self.siliconflow_model})")
             
-            url = "https://api.siliconflow.cn/v1/chat/completions"
-            
-            headers = {
-                "Authorization": f"Bearer {self.siliconflow_key}",
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "model": self.siliconflow_model,
-                "messages": [
-                    {"role": "system", "content": "你是一个专业的新闻分析和处理助手。"},
-                    {"role": "user", "content": prompt}
-                ],
-                "stream": False,
-                "temperature": 0.7,
-                "max_tokens": 2048
-            }
-            
-            response = requests.post(
-                url,
-                headers=headers,
-                json=payload,
-                timeout=60  # 60秒超时
+            response = self._post(
+                SILICONFLOW_API_URL,
+                headers=self._bearer_headers(self.siliconflow_key),
+                json=self._siliconflow_payload(prompt, json_schema=json_schema)
             )
             
+            self._check_structured_rejection(response, json_schema)
             if response.status_code == 200:
                 data = response.json()
                 result = data["choices"][0]["message"]["content"]
                 if not result:
                     raise Exception("硅基流动返回了空响应")
+                usage = data.get("usage") or {}
+                self._record_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"))
                     
                 logger.info(f"硅基流动响应成功，长度: {len(result)} 字符")
                 return result
             else:
-                error_msg = f"硅基流动 API错误: {response.status_code}, {response.text}"
-                logger.error(error_msg)
-                raise Exception(error_msg)
+                error = self._http_error("硅基流动", response)
+                logger.error(str(error))
+                raise error
         except Exception as e:
             logger.error(f"调用硅基流动时出错: {str(e)}")
             raise  # 重新抛出异常
     
-    def _call_openai(self, prompt: str) -> str:
+    def _call_openai(self, prompt: str, json_schema: Optional[Dict[str, Any]] = None) -> str:
         """调用OpenAI API获取响应
         
         Args:
             prompt: 提示词
+            json_schema: 结构化输出使用的JSON Schema
             
         Returns:
             OpenAI的响应文本
@@ -227,38 +904,27 @@ class AiService:
         try:
             logger.info(f"调用OpenAI (模型: {self.openai_model})")
             
-            headers = {
-                "Authorization": f"Bearer {self.openai_key}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "model": self.openai_model,
-                "messages": [
-                    {"role": "system", "content": "你是一个专业的新闻分析和处理助手。"},
-                    {"role": "user", "content": prompt}
-                ]
-            }
-            
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=30
+            response = self._post(
+                OPENAI_API_URL,
+                headers=self._bearer_headers(self.openai_key),
+                json=self._openai_payload(prompt, json_schema=json_schema)
             )
             
+            self._check_structured_rejection(response, json_schema)
             if response.status_code == 200:
                 response_data = response.json()
                 result = response_data["choices"][0]["message"]["content"]
                 if not result:
                     raise Exception("OpenAI返回了空响应")
+                usage = response_data.get("usage") or {}
+                self._record_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"))
                     
                 logger.info(f"OpenAI响应成功，长度: {len(result)} 字符")
                 return result
             else:
-                error_msg = f"OpenAI API错误: {response.status_code}, {response.text}"
-                logger.error(error_msg)
-                raise Exception(error_msg)
+                error = self._http_error("OpenAI", response)
+                logger.error(str(error))
+                raise error
         except Exception as e:
             logger.error(f"调用OpenAI时出错: {str(e)}")
             raise  # 重新抛出异常
@@ -0,0 +1,129 @@
+import re
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+# AI调用的用途标签，用于按用途统计token和耗时
+PURPOSE_EVALUATE = "evaluate"              # 单条内容评估
+PURPOSE_EVALUATE_BATCH = "evaluate_batch"  # 批量评估
+PURPOSE_CORRECT = "correct"                # 评估回答格式错误后的修正请求
+PURPOSE_SUMMARIZE = "summarize"            # 生成简报
+PURPOSE_TITLE = "title"                    # 简化过长的标题
+PURPOSE_OTHER = "other"
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数：中日韩字符按每字1个token，其他字符按每4个字符1个token"""
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count) // 4 + 1
+
+class RunMetrics:
+    """一次任务运行中所有AI调用的计量
+
+    内容过滤和简报生成的AiService共用同一个实例，每次调用记录提供商、模型、用途、
+    提示词和回答的token数（优先使用提供商返回的用量，否则本地估算）、耗时和重试次数，
+    缓存命中也按用途记录。运行结束后按用途汇总并保存到数据库。
+    """
+
+    def __init__(self, task_id: str = ""):
+        self.task_id = task_id
+        self.started_at = datetime.now().isoformat()
+        self.finished_at: Optional[str] = None
+        self.records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def record_call(self, provider: str, model: str, purpose: str, prompt_tokens: int, completion_tokens: int,
+                    estimated: bool, latency: float, retries: int, success: bool):
+        """记录一次AI调用（包括其内部的重试）"""
+        with self._lock:
+            self.records.append({
+                "provider": provider,
+                "model": model,
+                "purpose": purpose,
+                "prompt_tokens": int(prompt_tokens),
+                "completion_tokens": int(completion_tokens),
+                "estimated": estimated,
+                "latency": latency,
+                "retries": retries,
+                "success": success,
+                "cache_hit": False
+            })
+
+    def record_cache_hit(self, provider: str, model: str, purpose: str):
+        """记录一次由缓存代替的AI调用"""
+        with self._lock:
+            self.records.append({
+                "provider": provider,
+                "model": model,
+                "purpose": purpose,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "estimated": False,
+                "latency": 0.0,
+                "retries": 0,
+                "success": True,
+                "cache_hit": True
+            })
+
+    def finish(self):
+        self.finished_at = datetime.now().isoformat()
+
+    def breakdown(self) -> List[Dict[str, Any]]:
+        """按用途、提供商和模型汇总，按总耗时从高到低排列"""
+        with self._lock:
+            records = list(self.records)
+        groups: Dict[tuple, Dict[str, Any]] = {}
+        for record in records:
+            key = (record["purpose"], record["provider"], record["model"])
+            group = groups.setdefault(key, {
+                "purpose": record["purpose"],
+                "provider": record["provider"],
+                "model": record["model"],
+                "calls": 0,
+                "failed_calls": 0,
+                "cache_hits": 0,
+                "retries": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "estimated_calls": 0,
+                "total_latency": 0.0
+            })
+            if record["cache_hit"]:
+                group["cache_hits"] += 1
+                continue
+            group["calls"] += 1
+            group["failed_calls"] += int(not record["success"])
+            group["retries"] += record["retries"]
+            group["prompt_tokens"] += record["prompt_tokens"]
+            group["completion_tokens"] += record["completion_tokens"]
+            group["estimated_calls"] += int(record["estimated"])
+            group["total_latency"] += record["latency"]
+        return sorted(groups.values(), key=lambda group: group["total_latency"], reverse=True)
+
+    def summary(self) -> Dict[str, Any]:
+        """运行的总计和按用途的明细，用于调度器状态"""
+        breakdown = self.breakdown()
+        totals = {field: sum(group[field] for group in breakdown)
+                  for field in ("calls", "failed_calls", "cache_hits", "retries", "prompt_tokens", "completion_tokens")}
+        totals["total_latency"] = round(sum(group["total_latency"] for group in breakdown), 2)
+        return {
+            "task_id": self.task_id,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "totals": totals,
+            "by_purpose": [dict(group, total_latency=round(group["total_latency"], 2)) for group in breakdown]
+        }
+
+    def format_report(self) -> str:
+        """按用途列出调用次数、token和耗时的文本报告"""
+        lines = []
+        for group in self.breakdown():
+            calls = group["calls"]
+            average = group["total_latency"] / calls if calls else 0.0
+            estimated = f", 估算 {group['estimated_calls']} 次" if group["estimated_calls"] else ""
+            lines.append(f"{group['purpose']} ({group['provider']}:{group['model']}): {calls} 次调用, "
+                         f"失败 {group['failed_calls']}, 重试 {group['retries']}, 缓存命中 {group['cache_hits']}, "
+                         f"提示词 {group['prompt_tokens']} / 回答 {group['completion_tokens']} tokens{estimated}, "
+                         f"总耗时 {group['total_latency']:.1f}秒 (平均 {average:.2f}秒)")
+        return "\n".join(lines)
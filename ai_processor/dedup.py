@@ -0,0 +1,202 @@
+import hashlib
+import logging
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple
+
+from ai_processor.text_features import tokenize, shingles, article_text
+
+logger = logging.getLogger("dedup")
+
+# 近似重复检测的默认设置，可在 global_settings.dedup_settings 中覆盖
+DEFAULT_DEDUP_SETTINGS = {
+    "enabled": True,        # 是否在AI评估前合并近似重复的文章
+    "max_distance": 10,     # SimHash指纹的最大汉明距离，不超过此值的文章成为候选
+    "min_similarity": 0.5,  # 候选文章的词片段Jaccard相似度不低于此值时视为同一篇文章
+    "min_features": 8       # 文本特征少于此数时指纹不可靠，不参与去重
+}
+
+def get_dedup_settings(config: Dict[str, Any]) -> Dict[str, Any]:
+    """从配置中读取去重设置，缺失的项使用默认值"""
+    settings = dict(DEFAULT_DEDUP_SETTINGS)
+    settings.update(config.get("global_settings", {}).get("dedup_settings", {}) or {})
+    return settings
+
+FINGERPRINT_BITS = 64
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+def simhash(features: Counter) -> int:
+    """计算带权特征的64位SimHash指纹
+
+    每个特征的哈希按字节累加到 8x256 的计数表中，最后再按位汇总，
+    避免对每个特征逐位循环。
+
+    Args:
+        features: 特征到权重的映射
+
+    Returns:
+        64位指纹
+    """
+    tables = [[0] * 256 for _ in range(8)]
+    for feature, weight in features.items():
+        value = _feature_hash(feature)
+        for position in range(8):
+            tables[position][(value >> (8 * position)) & 0xFF] += weight
+
+    fingerprint = 0
+    for position, table in enumerate(tables):
+        entries = [(byte, weight) for byte, weight in enumerate(table) if weight]
+        for bit in range(8):
+            score = sum(weight if (byte >> bit) & 1 else -weight for byte, weight in entries)
+            if score > 0:
+                fingerprint |= 1 << (8 * position + bit)
+    return fingerprint
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+class SimHashIndex:
+    """SimHash指纹的内存索引
+
+    指纹被切分为 max_distance + 1 段，两个距离不超过 max_distance 的指纹
+    至少有一段完全相同（抽屉原理），因此只需比较共享某一段的候选指纹。
+    """
+
+    def __init__(self, max_distance: int = 10):
+        self.max_distance = max(0, int(max_distance))
+        self.band_count = self.max_distance + 1
+        self.band_bits = FINGERPRINT_BITS // self.band_count
+        self._bands: List[Dict[int, List[Tuple[int, Any]]]] = [{} for _ in range(self.band_count)]
+
+    def _band_values(self, fingerprint: int):
+        mask = (1 << self.band_bits) - 1
+        for band in range(self.band_count):
+            # 最后一段包含除不尽时剩余的位
+            if band == self.band_count - 1:
+                yield band, fingerprint >> (band * self.band_bits)
+            else:
+                yield band, (fingerprint >> (band * self.band_bits)) & mask
+
+    def add(self, fingerprint: int, key: Any):
+        """将指纹及其关联的键加入索引"""
+        for band, value in self._band_values(fingerprint):
+            self._bands[band].setdefault(value, []).append((fingerprint, key))
+
+    def query(self, fingerprint: int) -> List[Any]:
+        """查找距离不超过 max_distance 的已索引指纹
+
+        Returns:
+            匹配指纹关联的键，按距离从近到远排列
+        """
+        matches: Dict[int, Tuple[int, Any]] = {}
+        for band, value in self._band_values(fingerprint):
+            for candidate, key in self._bands[band].get(value, ()):
+                distance = hamming_distance(fingerprint, candidate)
+                if distance <= self.max_distance:
+                    matches[id(key)] = (distance, key)
+        return [key for _, key in sorted(matches.values(), key=lambda match: match[0])]
+
+class NearDuplicateCollapser:
+    """在AI评估前合并近似重复的文章
+
+    按出现顺序处理文章，第一篇作为代表，之后与其近似重复的文章不再单独评估，
+    而是将链接、来源和文章ID附加到代表文章上（duplicate_sources / duplicate_article_ids），
+    以便邮件中列出所有来源，并在代表文章被丢弃或发送时一并标记。
+
+    只有兴趣标签和反向标签都相同的文章才会合并：代表文章按自己RSS源的标签评估，
+    其结论对标签不同的RSS源并不适用。
+    """
+
+    def __init__(self, max_distance: int = 10, min_similarity: float = 0.5, min_features: int = 8):
+        self.min_similarity = float(min_similarity)
+        self.min_features = max(1, int(min_features))
+        self.max_distance = max_distance
+        # 每组标签（兴趣标签, 反向标签）使用单独的索引
+        self.indexes: Dict[Tuple[Tuple[str, ...], Tuple[str, ...]], SimHashIndex] = {}
+        # 代表文章的词片段集合，用于确认候选文章确实是重复稿件
+        self._feature_sets: Dict[int, frozenset] = {}
+
+    @classmethod
+    def from_settings(cls, dedup_settings: Dict[str, Any]) -> "NearDuplicateCollapser":
+        return cls(
+            dedup_settings.get("max_distance", 10),
+            dedup_settings.get("min_similarity", 0.5),
+            dedup_settings.get("min_features", 8)
+        )
+
+    @staticmethod
+    def label_key(content: Dict[str, Any]) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+        """文章所属RSS源的标签组合，只有标签组合相同的文章才会合并"""
+        return (tuple(sorted(content.get("feed_labels") or [])), tuple(sorted(content.get("negative_labels") or [])))
+
+    def _features(self, content: Dict[str, Any]) -> Counter:
+        return Counter(shingles(tokenize(article_text(content))))
+
+    def fingerprint(self, content: Dict[str, Any]) -> Optional[int]:
+        """计算文章的指纹，文本过短时返回None"""
+        features = self._features(content)
+        if len(features) < self.min_features:
+            return None
+        return simhash(features)
+
+    def add(self, content: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """处理一篇文章
+
+        Args:
+            content: 新闻内容
+
+        Returns:
+            如果是已处理文章的近似重复，返回代表文章（已附加本文的来源）；否则返回None，
+            本文成为新的代表文章
+        """
+        features = self._features(content)
+        if len(features) < self.min_features:
+            return None
+        fingerprint = simhash(features)
+        feature_set = frozenset(features)
+
+        index = self.indexes.setdefault(self.label_key(content), SimHashIndex(self.max_distance))
+        representative = None
+        for candidate in index.query(fingerprint):
+            candidate_set = self._feature_sets[id(candidate)]
+            similarity = len(feature_set & candidate_set) / len(feature_set | candidate_set)
+            if similarity >= self.min_similarity:
+                representative = candidate
+                break
+
+        if representative is None:
+            index.add(fingerprint, content)
+            self._feature_sets[id(content)] = feature_set
+            return None
+
+        representative.setdefault("duplicate_sources", []).append({
+            "title": content.get("title", ""),
+            "link": content.get("link", ""),
+            "source": content.get("source", ""),
+            "feed_url": content.get("feed_url", "")
+        })
+        if content.get("article_id"):
+            representative.setdefault("duplicate_article_ids", []).append(content["article_id"])
+        content["duplicate_of"] = representative.get("article_id")
+        logger.info(f"合并近似重复文章: {content.get('title', '无标题')} -> {representative.get('title', '无标题')}")
+        return representative
+
+    def collapse(self, contents: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """合并一组文章中的近似重复项
+
+        Args:
+            contents: 新闻内容列表
+
+        Returns:
+            代表文章列表（保持原顺序）和被合并的重复文章列表
+        """
+        unique, duplicates = [], []
+        for content in contents:
+            if self.add(content) is None:
+                unique.append(content)
+            else:
+                duplicates.append(content)
+        if duplicates:
+            logger.info(f"近似重复合并: {len(contents)} 篇文章中有 {len(duplicates)} 篇为重复，剩余 {len(unique)} 篇")
+        return unique, duplicates
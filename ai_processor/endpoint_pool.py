@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger("endpoint_pool")
+
+# 端点连续失败达到此次数后暂时移出池
+EJECT_AFTER_FAILURES = 2
+# 第一次移出的时长（秒），再次移出时翻倍，不超过上限
+EJECT_SECONDS = 30.0
+MAX_EJECT_SECONDS = 300.0
+
+def get_ollama_hosts(ai_settings: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """读取Ollama主机列表
+
+    ai_settings.ollama_hosts 中的每一项可以是URL字符串，也可以是包含 url、weight（权重，默认1）
+    和 concurrency（该主机的并发上限）的字典；未配置时只使用 ollama_host。
+
+    Returns:
+        包含 url、weight 和 concurrency（可能为None）的字典列表
+    """
+    hosts = []
+    for entry in ai_settings.get("ollama_hosts") or []:
+        if isinstance(entry, str):
+            entry = {"url": entry}
+        if entry.get("url"):
+            hosts.append({
+                "url": entry["url"].rstrip("/"),
+                "weight": max(0.01, float(entry.get("weight", 1))),
+                "concurrency": entry.get("concurrency")
+            })
+    if not hosts:
+        hosts.append({"url": ai_settings.get("ollama_host", "http://localhost:11434").rstrip("/"), "weight": 1.0, "concurrency": None})
+    return hosts
+
+class Endpoint:
+    """端点池中的一个推理主机"""
+
+    def __init__(self, url: str, weight: float = 1.0, concurrency: int = 1):
+        self.url = url
+        self.weight = weight
+        self.concurrency = max(1, int(concurrency))
+        self.outstanding = 0           # 正在处理的请求数
+        self.served = 0                # 已分配的请求数
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0       # 在此时刻之前不分配请求
+        self.eject_seconds = EJECT_SECONDS
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until and self.outstanding < self.concurrency
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "concurrency": self.concurrency,
+            "outstanding": self.outstanding,
+            "served": self.served,
+            "failures": self.failures,
+            "ejected": time.monotonic() < self.ejected_until
+        }
+
+class EndpointPool:
+    """多个Ollama主机组成的端点池，由同一进程中的所有AiService共享
+
+    每个请求分配给负载最低的可用主机：按 正在处理的请求数 / 权重 选择，相同时选择
+    已分配请求数 / 权重 较小的主机，因此空闲时按权重轮流分配。每个主机的并发数不超过其上限，
+    所有主机都满载时请求按到达顺序排队等待，内容过滤和简报生成的请求公平地共用所有主机。
+    连续失败的主机被暂时移出，到期后重新加入；再次失败时移出时间翻倍。
+    """
+
+    def __init__(self, hosts: List[Dict[str, Any]], default_concurrency: int = 1):
+        self.endpoints = [Endpoint(host["url"], host.get("weight", 1.0), host.get("concurrency") or default_concurrency)
+                          for host in hosts]
+        self._condition = threading.Condition()
+
+    @property
+    def total_concurrency(self) -> int:
+        return sum(endpoint.concurrency for endpoint in self.endpoints)
+
+    def check_health(self, client) -> bool:
+        """探测所有主机，移出不可用的主机，恢复可用的主机
+
+        Args:
+            client: ProviderClient 实例
+
+        Returns:
+            是否至少有一个主机可用
+        """
+        any_healthy = False
+        for endpoint in self.endpoints:
+            if client.check_health(f"{endpoint.url}/api/tags"):
+                any_healthy = True
+                with self._condition:
+                    endpoint.ejected_until = 0.0
+                    self._condition.notify_all()
+            else:
+                with self._condition:
+                    self._eject(endpoint, "健康检查失败")
+        return any_healthy
+
+    def _pick(self, now: float) -> Optional[Endpoint]:
+        candidates = [endpoint for endpoint in self.endpoints if endpoint.available(now)]
+        if all(endpoint.ejected_until > now for endpoint in self.endpoints):
+            # 所有主机都被移出时仍然发出请求，由熔断器决定是否停止调用
+            candidates = [endpoint for endpoint in self.endpoints if endpoint.outstanding < endpoint.concurrency]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda endpoint: (endpoint.outstanding / endpoint.weight, endpoint.served / endpoint.weight))
+
+    def acquire(self) -> Endpoint:
+        """分配一个主机，所有主机都满载或被移出时等待"""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                endpoint = self._pick(now)
+                if endpoint is not None:
+                    endpoint.outstanding += 1
+                    endpoint.served += 1
+                    return endpoint
+                # 等待请求完成或被移出的主机到期
+                waits = [endpoint.ejected_until - now for endpoint in self.endpoints
+                         if endpoint.ejected_until > now and endpoint.outstanding < endpoint.concurrency]
+                self._condition.wait(timeout=min(waits) if waits else None)
+
+    def release(self, endpoint: Endpoint, failed: bool = False, error: str = ""):
+        """归还主机并记录请求结果"""
+        with self._condition:
+            endpoint.outstanding -= 1
+            if failed:
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                if endpoint.consecutive_failures >= EJECT_AFTER_FAILURES:
+                    self._eject(endpoint, error)
+            else:
+                endpoint.consecutive_failures = 0
+                endpoint.eject_seconds = EJECT_SECONDS
+            self._condition.notify()
+
+    def _eject(self, endpoint: Endpoint, reason: str):
+        endpoint.ejected_until = time.monotonic() + endpoint.eject_seconds
+        logger.warning(f"Ollama主机 {endpoint.url} 暂时移出 {endpoint.eject_seconds:.0f} 秒: {reason[:200]}")
+        endpoint.eject_seconds = min(MAX_EJECT_SECONDS, endpoint.eject_seconds * 2)
+        endpoint.consecutive_failures = 0
+
+    def report(self) -> List[Dict[str, Any]]:
+        with self._condition:
+            return [endpoint.to_dict() for endpoint in self.endpoints]
+
+_endpoint_pools: Dict[Tuple, EndpointPool] = {}
+_endpoint_pools_lock = threading.Lock()
+
+def get_endpoint_pool(hosts: List[Dict[str, Any]], default_concurrency: int = 1) -> EndpointPool:
+    """获取主机列表相同的AiService共享的端点池"""
+    key = tuple((host["url"], host.get("weight", 1.0), host.get("concurrency") or default_concurrency) for host in hosts)
+    with _endpoint_pools_lock:
+        pool = _endpoint_pools.get(key)
+        if pool is None:
+            pool = EndpointPool(hosts, default_concurrency)
+            _endpoint_pools[key] = pool
+        return pool
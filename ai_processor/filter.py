@@ -1,14 +1,83 @@
 import logging
+import threading
 from typing import List, Dict, Any, Optional, Tuple
 from enum import Enum
 from datetime import datetime, timezone # Import timezone
-from ai_processor.ai_utils import AiService, AiException
+from concurrent.futures import ThreadPoolExecutor
+from ai_processor.ai_utils import AiService, AiException, CircuitOpenError
+from ai_processor.call_metrics import estimate_tokens, PURPOSE_EVALUATE, PURPOSE_EVALUATE_BATCH, PURPOSE_CORRECT
+from ai_processor.ai_cache import EvaluationCache
+from ai_processor.prompt_budget import get_prompt_budgets, fit_article
+from ai_processor.lexical_prefilter import LexicalPrefilter
+from ai_processor.verdict_classifier import VerdictStore, VerdictClassifier, REASON_CLASSIFIER_DISCARD
 import json
 import re # Import re
 
 # 配置日志
 logger = logging.getLogger("content_filter")
 
+# 内容过滤的默认设置，可在 global_settings.filter_settings 中覆盖
+DEFAULT_FILTER_SETTINGS = {
+    "concurrent_evaluation": True,  # 是否并发评估多条内容
+    "max_workers": 8,               # 并发评估的线程数上限，实际并发数不超过AI提供商的并发上限
+    "batch_evaluation": False,      # 是否将标签相同的多条内容合并到一个提示词中评估
+    "batch_size": 8,                # 每个批量提示词最多包含的内容数
+    "batch_token_budget": 6000,     # 每个批量请求（提示词和预计回答）的token预算
+    "evaluation_cache": True,       # 是否缓存评估结果，重复出现的文章不再调用AI
+    "evaluation_cache_ttl_hours": 24,  # 评估缓存的有效期（小时），时效性评级会随时间变化
+    "lexical_prefilter": False,     # 是否在AI评估前用本地词法匹配丢弃明显不相关的内容
+    "prefilter_min_score": 0.0,     # 与兴趣标签的BM25得分不超过此值的内容被丢弃，0表示只丢弃没有共同词汇的内容
+    "prefilter_negative_labels": True,  # 预过滤时是否丢弃标题中明显出现反向标签的内容
+    "record_verdicts": True,        # 是否保存AI的过滤结论，作为本地分类器的训练数据
+    "local_classifier": False,      # 是否由本地分类器直接丢弃置信度高的内容，不再调用AI
+    "classifier_confidence": 0.97,  # 本地分类器的丢弃概率不低于此值时才跳过AI
+    "classifier_min_samples": 200,  # 标签集合至少有这么多条结论时才训练本地分类器
+    "classifier_min_agreement": 0.95,  # 留出集上跳过部分与AI结论的一致率不低于此值时才启用跳过
+    "classifier_max_samples": 2000,  # 每个标签集合保留并用于训练的最近结论数
+    "combined_summary": False       # 是否在评估的同一次AI调用中生成简报（需要传入简报生成器）
+}
+
+def get_filter_settings(config: Dict[str, Any]) -> Dict[str, Any]:
+    """从配置中读取内容过滤设置，缺失的项使用默认值"""
+    settings = dict(DEFAULT_FILTER_SETTINGS)
+    settings.update(config.get("global_settings", {}).get("filter_settings", {}) or {})
+    return settings
+
+# 单条内容评估结果的JSON格式，单条评估和批量评估的提示词共用
+EVALUATION_JSON_FORMAT = """{
+  "interest_match": {
+    "is_match": true/false,
+    "matched_tags": ["标签1", "标签2"],
+    "explanation": "解释为什么匹配或不匹配"
+  },
+  "negative_match": {
+    "is_match": true/false,
+    "matched_tags": ["反向标签1", "反向标签2"],
+    "explanation": "解释为什么匹配或不匹配反向标签"
+  },
+  "importance": {
+    "rating": "极低/低/中/高/极高",
+    "explanation": "解释为什么给出这个评级"
+  },
+  "timeliness": {
+    "rating": "极低/低/中/高/极高",
+    "explanation": "解释为什么给出这个评级"
+  },
+  "interest_level": {
+    "rating": "极低/低/中/高/极高",
+    "explanation": "解释为什么给出这个评级"
+  }
+}"""
+
+# 合并评估模式下在评估结果JSON中增加的字段
+COMBINED_JSON_FORMAT = EVALUATION_JSON_FORMAT[:-2] + """,
+  "title": "翻译或简化后的标题（仅在简报要求中要求时提供）",
+  "brief": "新闻简报"
+}"""
+
+# 批量评估时每条内容的回答大致占用的token数，用于预估批次大小
+BATCH_RESPONSE_TOKENS_PER_ITEM = 250
+
 # 定义评分等级枚举类型
 class RatingLevel(str, Enum):
     VERY_LOW = "极低"
@@ -18,14 +87,65 @@ class RatingLevel(str, Enum):
     VERY_HIGH = "极高"
     UNKNOWN = "未知"
 
+def build_evaluation_schema(include_brief: bool = False) -> Dict[str, Any]:
+    """生成单条评估结果的JSON Schema，供支持结构化输出的提供商约束AI的回答
+
+    结构与 EVALUATION_JSON_FORMAT 一致，评级只允许 RatingLevel 中除"未知"以外的值。
+    所有字段均为必填且不允许额外字段，满足OpenAI严格模式的要求。
+
+    Args:
+        include_brief: 是否包含合并评估模式下的 title 和 brief 字段
+
+    Returns:
+        JSON Schema 字典
+    """
+    ratings = [level.value for level in RatingLevel if level != RatingLevel.UNKNOWN]
+
+    def strict_object(properties: Dict[str, Any]) -> Dict[str, Any]:
+        return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+    def match_schema() -> Dict[str, Any]:
+        return strict_object({
+            "is_match": {"type": "boolean"},
+            "matched_tags": {"type": "array", "items": {"type": "string"}},
+            "explanation": {"type": "string"}
+        })
+
+    def rating_schema() -> Dict[str, Any]:
+        return strict_object({
+            "rating": {"type": "string", "enum": ratings},
+            "explanation": {"type": "string"}
+        })
+
+    properties = {
+        "interest_match": match_schema(),
+        "negative_match": match_schema(),
+        "importance": rating_schema(),
+        "timeliness": rating_schema(),
+        "interest_level": rating_schema()
+    }
+    if include_brief:
+        # 严格模式要求所有字段必填，不需要翻译标题时AI可以返回空字符串
+        properties["title"] = {"type": "string"}
+        properties["brief"] = {"type": "string"}
+    return strict_object(properties)
+
+def build_batch_evaluation_schema() -> Dict[str, Any]:
+    """生成批量评估结果的JSON Schema：每个元素为带 index 字段的单条评估结果"""
+    element = build_evaluation_schema()
+    element["properties"] = {"index": {"type": "integer"}, **element["properties"]}
+    element["required"] = ["index"] + element["required"]
+    return {"type": "array", "items": element}
+
 class ContentFilter:
     """新闻内容过滤器，用于评估和过滤新闻条目"""
 
-    def __init__(self, config=None):
+    def __init__(self, config=None, summarizer=None):
         """初始化内容过滤器
         
         Args:
             config: 包含AI设置的配置字典
+            summarizer: NewsSummarizer 实例，合并评估模式下用于构建简报要求
             
         Raises:
             AiException: 当AI服务不可用时
@@ -38,7 +158,98 @@ class ContentFilter:
         self.provider = self.ai_service.provider
         self.ollama_model = getattr(self.ai_service, 'ollama_model', '')
         self.openai_model = getattr(self.ai_service, 'openai_model', '')
+        
+        self.filter_settings = get_filter_settings(self.config)
+        # 提示词中摘要和全文的token预算
+        self.prompt_budgets = get_prompt_budgets(self.config)
+        self.batch_evaluation = bool(self.filter_settings.get("batch_evaluation", False))
+        
+        # 合并评估模式：保留的内容不再单独调用AI生成简报
+        self.summarizer = summarizer
+        self.combined_summary = bool(self.filter_settings.get("combined_summary", False)) and summarizer is not None
+        if self.filter_settings.get("combined_summary", False) and summarizer is None:
+            logger.warning("合并评估模式需要简报生成器，将分别进行评估和生成简报")
+        
+        # 支持结构化输出的提供商按这些JSON Schema约束回答，其他提供商依靠解析和修正提示词
+        self.evaluation_schema = build_evaluation_schema()
+        self.combined_evaluation_schema = build_evaluation_schema(include_brief=True)
+        self.batch_evaluation_schema = build_batch_evaluation_schema()
+        self.correction_retries = 0  # 因回答格式错误而发送修正提示词的次数
+        self._stats_lock = threading.Lock()
+        
+        # 评估结果缓存，不可用时不影响过滤
+        self.evaluation_cache = None
+        if self.filter_settings.get("evaluation_cache", True):
+            try:
+                self.evaluation_cache = EvaluationCache(ttl_hours=self.filter_settings.get("evaluation_cache_ttl_hours", 24))
+            except Exception as e:
+                logger.warning(f"初始化评估缓存失败，将不使用缓存: {str(e)}")
+        
+        # AI结论存储和由其训练的本地分类器，不可用时不影响过滤
+        self.local_classifier = bool(self.filter_settings.get("local_classifier", False))
+        self.verdict_classifier = None
+        if self.filter_settings.get("record_verdicts", True) or self.local_classifier:
+            try:
+                self.verdict_classifier = VerdictClassifier.from_settings(VerdictStore(), self.filter_settings)
+            except Exception as e:
+                logger.warning(f"初始化过滤结论存储失败，将不记录结论: {str(e)}")
+        
+        # 本地词法预过滤，默认关闭：AI可能保留不匹配标签但极其重要的内容
+        self.prefilter = None
+        if self.filter_settings.get("lexical_prefilter", False):
+            self.prefilter = LexicalPrefilter(
+                min_score=self.filter_settings.get("prefilter_min_score", 0.0),
+                drop_negative_matches=self.filter_settings.get("prefilter_negative_labels", True)
+            )
+    
+    def _model_id(self) -> str:
+        """当前使用的提供商和模型，作为缓存键的一部分"""
+        return self.ai_service.model_id(PURPOSE_EVALUATE)
+    
+    def _get_cached_evaluation(self, content: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """从缓存中读取内容的评估结果，未命中时返回None"""
+        if self.evaluation_cache is None:
+            return None
+        evaluation = self.evaluation_cache.get(self.evaluation_cache.make_key(content, self._model_id()))
+        if evaluation is not None:
+            self.ai_service.record_cache_hit(PURPOSE_EVALUATE)
+        return evaluation
+    
+    def _store_evaluation(self, content: Dict[str, Any], evaluation: Dict[str, Any]):
+        """将验证通过的评估结果写入缓存"""
+        if self.evaluation_cache is None:
+            return
+        key = self.evaluation_cache.make_key(content, self._model_id())
+        self.evaluation_cache.put(key, evaluation, content.get("article_id", ""))
 
+    def _record_verdict(self, content: Dict[str, Any]):
+        """保存AI对内容的结论，供本地分类器训练"""
+        if self.verdict_classifier is not None:
+            self.verdict_classifier.record(content)
+    
+    def _classify_locally(self, content: Dict[str, Any]) -> bool:
+        """本地分类器置信地判断内容应被丢弃时，不调用AI直接标记丢弃
+        
+        Returns:
+            是否已由本地分类器丢弃
+        """
+        if self.verdict_classifier is None or not self.local_classifier:
+            return False
+        try:
+            probability = self.verdict_classifier.should_discard(content)
+        except Exception as e:
+            logger.warning(f"本地分类器出错，改用AI评估: {str(e)}")
+            return False
+        if probability is None:
+            return False
+        content.update({
+            "evaluation": {"classifier": {"discard_probability": probability}},
+            "keep": False,
+            "discard_reason": REASON_CLASSIFIER_DISCARD
+        })
+        logger.info(f"本地分类器丢弃 (概率 {probability:.3f})，跳过AI评估: {content.get('title', '无标题')}")
+        return True
+    
     def evaluate_content(self, content: Dict[str, Any], max_attempts: int = 3) -> Dict[str, Any]:
         """评估新闻内容，检查是否符合用户兴趣，并评价重要性、时效性、趣味性。
            如果AI响应格式错误，会尝试要求AI修正，最多重试 max_attempts 次。
@@ -55,20 +266,17 @@ class ContentFilter:
         feed_labels = content.get("feed_labels", [])
         
         # 确保我们获取了负向标签 - 如果content里没有，就从task里获取
-        negative_labels = content.get("negative_labels", [])
-        feed_url = content.get("feed_url")
-        task = content.get("task")
+        negative_labels = self._resolve_negative_labels(content)
         
-        # 如果没有负向标签但有任务对象和feed URL，则从任务配置中获取
-        if not negative_labels and task and feed_url and hasattr(task, 'get_feed_negative_labels'):
-            try:
-                negative_labels = task.get_feed_negative_labels(feed_url)
-                # 记录从任务配置获取的标签
-                logger.info(f"从任务配置获取负向标签: {negative_labels}")
-                # 更新内容字典以包含这些标签供后续处理使用
-                content["negative_labels"] = negative_labels
-            except Exception as e:
-                logger.error(f"尝试从任务获取负向标签时出错: {str(e)}")
+        # 相同文章、相同内容和相同标签已评估过时直接复用结果
+        cached_evaluation = self._get_cached_evaluation(content)
+        if cached_evaluation is not None:
+            logger.info(f"评估缓存命中，跳过AI调用: {title}")
+            content.update({
+                "evaluation": cached_evaluation,
+                "keep": self._should_keep_content(cached_evaluation)
+            })
+            return content
         
         published_date = content.get("published", "未知")
         
@@ -115,8 +323,9 @@ class ContentFilter:
                 # Catch any other unexpected errors during age calculation/conversion
                 logger.error(f"计算内容年龄时出错: {e}")
         
-        # 构建初始提示词
-        current_prompt = self._build_evaluation_prompt(content)
+        # 构建初始提示词，合并评估模式下同时要求生成简报
+        brief_requirements = self.summarizer.build_combined_requirements(content) if self.combined_summary else None
+        current_prompt = self._build_evaluation_prompt(content, brief_requirements)
         last_error = None
         evaluation_text = "" # Store last AI response for correction prompt
 
@@ -124,19 +333,27 @@ class ContentFilter:
             logger.info(f"--- 评估尝试 {attempt + 1}/{max_attempts} ---")
             if attempt > 0: # If retrying, use correction prompt
                 logger.info("构建修正提示词...")
-                current_prompt = self._build_correction_prompt(self._build_evaluation_prompt(content), evaluation_text, str(last_error))
+                current_prompt = self._build_correction_prompt(self._build_evaluation_prompt(content, brief_requirements), evaluation_text, str(last_error))
+                with self._stats_lock:
+                    self.correction_retries += 1
 
             logger.info(f"向AI发送提示词长度: {len(current_prompt)} 字符")
             logger.info(f"提示词前100字符: {current_prompt[:100]}...")
 
             try:
                 # 调用AI服务
-                logger.info(f"使用{self.provider}评估内容, 模型: {self.ollama_model or self.openai_model}")
-                evaluation_text = self.ai_service.call_ai(current_prompt)
+                logger.info(f"评估内容, 模型: {self.ai_service.model_id(PURPOSE_CORRECT if attempt > 0 else PURPOSE_EVALUATE)}")
+                evaluation_text = self.ai_service.call_ai(
+                    current_prompt, stop_on_json="{",
+                    json_schema=self.combined_evaluation_schema if brief_requirements else self.evaluation_schema,
+                    purpose=PURPOSE_CORRECT if attempt > 0 else PURPOSE_EVALUATE
+                )
                 logger.info(f"AI响应长度: {len(evaluation_text)} 字符")
 
                 # 解析评估结果 (可能会抛出 AiException)
                 evaluation_result = self._parse_evaluation(evaluation_text)
+                # 简报字段不属于评估结果，不写入缓存和结论存储
+                brief_data = {key: evaluation_result.pop(key) for key in ("brief", "title") if key in evaluation_result}
 
                 # 成功解析，记录结果
                 is_match = evaluation_result["interest_match"]["is_match"]
@@ -154,9 +371,17 @@ class ContentFilter:
                     "evaluation": evaluation_result,
                     "keep": self._should_keep_content(evaluation_result)
                 })
+                # 只有保留的内容需要简报，丢弃的内容直接舍弃
+                if content["keep"] and brief_data.get("brief"):
+                    content["combined_brief"] = brief_data
+                self._store_evaluation(content, evaluation_result)
                 logger.info(f"成功解析AI响应并完成评估 (尝试 {attempt + 1})")
                 return content # Success
 
+            except CircuitOpenError:
+                # 提供商熔断时不再逐条失败并丢弃内容，交由调用方中止本次任务
+                raise
+
             except AiException as e:
                 last_error = e
                 logger.warning(f"评估尝试 {attempt + 1} 失败: {str(e)}")
@@ -189,63 +414,53 @@ class ContentFilter:
         })
         return content
 
-    def _build_evaluation_prompt(self, content: Dict[str, Any]) -> str:
-        """构建用于评估内容的提示词
+    def _current_time_info(self) -> Tuple[str, str, str]:
+        """获取提示词中使用的当前日期、星期和时间"""
+        current_datetime = datetime.now()
+        current_date_str = current_datetime.strftime("%Y年%m月%d日")
+        current_time_str = current_datetime.strftime("%H:%M:%S")
+        current_weekday = ["星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"][current_datetime.weekday()]
+        return current_date_str, current_weekday, current_time_str
+    
+    def _format_news_section(self, content: Dict[str, Any], content_budget: str = "evaluate_content") -> str:
+        """格式化提示词中单条新闻的标题、发布时间、摘要和全文
         
         Args:
-            content: 新闻内容，包括feed_labels表示该RSS源特有的标签
-            
-        Returns:
-            格式化的提示词
+            content: 新闻内容
+            content_budget: 全文使用的token预算项，合并评估模式下为 combined_content
         """
-        # 构建详细的提示词，要求AI评估内容并提供结构化输出
         title = content.get("title", "")
-        summary = content.get("summary", "")
-        full_content = content.get("content", "")
-        feed_labels = content.get("feed_labels", [])
-        negative_labels = content.get("negative_labels", [])
         
-        # 获取当前日期时间信息
-        current_datetime = datetime.now()
-        current_date_str = current_datetime.strftime("%Y年%m月%d日")
-        current_time_str = current_datetime.strftime("%H:%M:%S")
-        current_weekday = ["星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"][current_datetime.weekday()]
+        # 摘要和全文超过预算时保留导语和信息量最大的句子，摘要重复全文开头时省略
+        summary, full_content = fit_article(content.get("summary", ""), content.get("content", ""), title,
+                                            self.prompt_budgets["evaluate_summary"], self.prompt_budgets[content_budget])
         
-        # 如果摘要或全文很长，进行截断
-        if len(summary) > 1000:
-            summary = summary[:1000] + "..."
-        if len(full_content) > 3000:
-            full_content = full_content[:3000] + "..."
+        # 提取内容的发布时间（如果有）进行记录
+        content_published = content.get("published", "未知")
+        published_info = f"发布时间：{content_published}" if content_published else "发布时间：未提供"
         
+        summary_line = f"摘要：{summary}\n" if summary else ""
+        return f"""标题：{title}
+{published_info}
+{summary_line}全文：{full_content}"""
+    
+    def _format_label_sections(self, feed_labels: List[str], negative_labels: List[str]) -> str:
+        """格式化提示词中的RSS源标签和反向标签"""
         # 将兴趣标签格式化为字符串 - 使用RSS源特定的标签
         interests_str = ", ".join([f'"{tag}"' for tag in feed_labels])
         
         # 将反向标签格式化为字符串
         negative_interests_str = ", ".join([f'"{tag}"' for tag in negative_labels]) if negative_labels else "无反向标签"
         
-        # 提取内容的发布时间（如果有）进行记录
-        content_published = content.get("published", "未知")
-        published_info = f"发布时间：{content_published}" if content_published else "发布时间：未提供"
-        
-        prompt_base = f"""请分析以下新闻内容，并根据给定标准进行评估：
-
-## 当前时间信息
-当前日期：{current_date_str} {current_weekday}
-当前时间：{current_time_str}
-
-## 新闻内容
-标题：{title}
-{published_info}
-摘要：{summary}
-全文：{full_content}
-
-## 该RSS源关注的标签
+        return f"""## 该RSS源关注的标签
 {interests_str}
 
 ## 该RSS源的反向标签（不希望看到的内容类型）
-{negative_interests_str}
-
-## 评估要求
+{negative_interests_str}"""
+    
+    def _format_evaluation_requirements(self, current_date_str: str) -> str:
+        """格式化提示词中的评估要求"""
+        return f"""## 评估要求
 1. 兴趣匹配：这条新闻是否符合该RSS源关注的一个或多个标签？如果有，请指明具体匹配的标签；如果不符合任何标签，请说明。
 2. 反向标签匹配：这条新闻是否符合任何反向标签？如果有，请指明具体匹配的反向标签；如果不符合任何反向标签，请说明。
 3. 重要性：这条新闻的重要性如何？（极低、低、中、高、极高）
@@ -257,37 +472,91 @@ class ContentFilter:
    - 极低：明显过时或与当前环境无关的内容
 5. 趣味性：这条新闻的趣味性如何？（极低、低、中、高、极高）
 """
+    
+    def _build_evaluation_prompt(self, content: Dict[str, Any], brief_requirements: Optional[str] = None) -> str:
+        """构建用于评估内容的提示词
+        
+        Args:
+            content: 新闻内容，包括feed_labels表示该RSS源特有的标签
+            brief_requirements: 合并评估模式下的简报要求，提供时要求在同一个JSON对象中返回简报
+            
+        Returns:
+            格式化的提示词
+        """
+        # 构建详细的提示词，要求AI评估内容并提供结构化输出
+        feed_labels = content.get("feed_labels", [])
+        negative_labels = content.get("negative_labels", [])
+        
+        # 获取当前日期时间信息
+        current_date_str, current_weekday, current_time_str = self._current_time_info()
+        
+        prompt_base = f"""请分析以下新闻内容，并根据给定标准进行评估：
+
+## 当前时间信息
+当前日期：{current_date_str} {current_weekday}
+当前时间：{current_time_str}
+
+## 新闻内容
+{self._format_news_section(content, "combined_content" if brief_requirements else "evaluate_content")}
+
+{self._format_label_sections(feed_labels, negative_labels)}
+
+{self._format_evaluation_requirements(current_date_str)}"""
+        if brief_requirements:
+            prompt_base += f"\n{brief_requirements}\n"
         prompt_json_format = f"""
 请按以下JSON格式返回评估结果：
-{{
-  "interest_match": {{
-    "is_match": true/false,
-    "matched_tags": ["标签1", "标签2"],
-    "explanation": "解释为什么匹配或不匹配"
-  }},
-  "negative_match": {{
-    "is_match": true/false,
-    "matched_tags": ["反向标签1", "反向标签2"],
-    "explanation": "解释为什么匹配或不匹配反向标签"
-  }},
-  "importance": {{
-    "rating": "极低/低/中/高/极高",
-    "explanation": "解释为什么给出这个评级"
-  }},
-  "timeliness": {{
-    "rating": "极低/低/中/高/极高",
-    "explanation": "解释为什么给出这个评级"
-  }},
-  "interest_level": {{
-    "rating": "极低/低/中/高/极高",
-    "explanation": "解释为什么给出这个评级"
-  }}
-}}
+{COMBINED_JSON_FORMAT if brief_requirements else EVALUATION_JSON_FORMAT}
 
 **请务必严格遵守此JSON格式。**请只返回JSON对象，不要包含任何其他文本或注释。
 """
         return prompt_base + prompt_json_format
+    
+    def _build_batch_evaluation_prompt(self, contents: List[Dict[str, Any]]) -> str:
+        """构建一次评估多条新闻的提示词，所有新闻共享同一组标签
+        
+        Args:
+            contents: 标签相同的新闻内容列表
+            
+        Returns:
+            要求AI以JSON数组返回每条新闻评估结果的提示词
+        """
+        feed_labels = contents[0].get("feed_labels", [])
+        negative_labels = contents[0].get("negative_labels", [])
+        current_date_str, current_weekday, current_time_str = self._current_time_info()
+        
+        news_sections = "\n\n".join(
+            f"### 新闻 {number}\n{self._format_news_section(content)}"
+            for number, content in enumerate(contents, 1)
+        )
+        
+        prompt_base = f"""请分析以下 {len(contents)} 条新闻内容，并根据给定标准分别对每条新闻进行评估：
+
+## 当前时间信息
+当前日期：{current_date_str} {current_weekday}
+当前时间：{current_time_str}
+
+## 新闻内容
+{news_sections}
+
+{self._format_label_sections(feed_labels, negative_labels)}
 
+{self._format_evaluation_requirements(current_date_str)}"""
+        
+        # 每个数组元素与单条评估的JSON格式相同，另加 index 字段对应新闻编号
+        element_format = EVALUATION_JSON_FORMAT.replace("{\n", '{\n  "index": 1,\n', 1)
+        element_format = "\n".join("  " + line for line in element_format.splitlines())
+        prompt_json_format = f"""
+请按以下JSON格式返回评估结果：一个JSON数组，每条新闻对应一个元素，按新闻编号顺序排列，并用 "index" 字段标明新闻编号（共 {len(contents)} 个元素）：
+[
+{element_format},
+  ...
+]
+
+**请务必严格遵守此JSON格式。**请只返回JSON数组，不要包含任何其他文本或注释。
+"""
+        return prompt_base + prompt_json_format
+    
     def _build_correction_prompt(self, original_request_prompt: str, failed_response: str, error_message: str) -> str:
         """构建用于请求AI修正其先前格式错误的响应的提示词。"""
         # Extract the format definition part from the original prompt
@@ -391,6 +660,23 @@ class ContentFilter:
                 # Combine original and extraction errors for clarity
                 raise AiException(f"无法解析AI响应的JSON格式: 原始错误='{str(e)}', 提取/修复错误='{str(e2)}'") from e2
 
+        return self._validate_evaluation(result)
+    
+    def _validate_evaluation(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """对解析出的单条评估结果进行严格的结构验证
+        
+        Args:
+            result: 从AI响应中解析出的评估字典
+            
+        Returns:
+            验证后的评估结果（缺少negative_match时补充默认值）
+            
+        Raises:
+            AiException: 当结构不符合要求时
+        """
+        if not isinstance(result, dict):
+            raise AiException(f"AI评估结果必须是JSON对象，但收到类型: {type(result)}")
+
         # --- Start Structure Validation ---
         required_top_level_fields = ["interest_match", "negative_match", "importance", "timeliness", "interest_level"]
         missing_top_level = [k for k in required_top_level_fields if k not in result]
@@ -558,6 +844,247 @@ class ContentFilter:
         logger.info("最终决定: 保留 - 通过所有筛选条件")
         return True
         
+    def _resolve_negative_labels(self, content: Dict[str, Any]) -> List[str]:
+        """获取内容的反向标签，内容中没有时从任务配置中获取"""
+        negative_labels = content.get("negative_labels", [])
+        feed_url = content.get("feed_url")
+        task = content.get("task")
+        
+        # 如果没有负向标签但有任务对象和feed URL，则从任务配置中获取
+        if not negative_labels and task and feed_url and hasattr(task, 'get_feed_negative_labels'):
+            try:
+                negative_labels = task.get_feed_negative_labels(feed_url)
+                content["negative_labels"] = negative_labels
+            except Exception as e:
+                logger.error(f"尝试从任务获取负向标签时出错: {str(e)}")
+        return negative_labels
+    
+    def _log_progress(self, content: Dict[str, Any], index: int, total: int):
+        """记录过滤进度"""
+        title = content.get("title", "无标题")
+        feed_labels = content.get("feed_labels", [])
+        negative_labels = content.get("negative_labels", [])
+        
+        label_info = f"标签: {feed_labels}"
+        if negative_labels:
+            label_info += f", 反向标签: {negative_labels}"
+        
+        logger.info(f"过滤进度: {index+1}/{total} - {title[:30]}{'...' if len(title) > 30 else ''} ({label_info})")
+    
+    def _log_decision(self, evaluated_content: Dict[str, Any], index: int) -> bool:
+        """记录保留或丢弃的决定
+        
+        Returns:
+            是否保留内容
+        """
+        # 根据评估结果分类 (evaluate_content adds 'keep' and 'evaluation' with potential 'error')
+        if evaluated_content.get("keep", False):
+            logger.info(f"决定: 保留内容 #{index+1}")
+            return True
+        
+        # Check if discard was due to an evaluation error recorded by evaluate_content
+        eval_data = evaluated_content.get("evaluation", {})
+        if isinstance(eval_data, dict) and "error" in eval_data:
+             logger.warning(f"决定: 丢弃内容 #{index+1} (原因: {eval_data['error']})")
+        else:
+             logger.info(f"决定: 丢弃内容 #{index+1} (原因: 过滤器规则)")
+        return False
+    
+    def filter_content(self, content: Dict[str, Any], index: int = 0, total: int = 1) -> Tuple[Dict[str, Any], bool]:
+        """评估单条新闻内容并决定是否保留
+        
+        Args:
+            content: 新闻内容，包括feed_labels表示该RSS源特有的标签
+            index: 内容在本批次中的序号（仅用于日志）
+            total: 本批次的内容总数（仅用于日志）
+            
+        Returns:
+            评估后的内容和是否保留
+        """
+        # No try-except block needed here for evaluate_content itself,
+        # as it now handles its own errors and returns a result regardless.
+        self._resolve_negative_labels(content)
+        self._log_progress(content, index, total)
+        
+        if self._classify_locally(content):
+            return content, self._log_decision(content, index)
+        
+        # 评估每个内容 (now handles retries internally and returns error state if failed)
+        evaluated_content = self.evaluate_content(content) # Pass content directly
+        self._record_verdict(evaluated_content)
+        return evaluated_content, self._log_decision(evaluated_content, index)
+    
+    def prefilter_contents(self, contents: List[Dict[str, Any]]) -> List[int]:
+        """对内容进行本地词法预过滤，被丢弃的内容标记 keep=False 和 discard_reason
+        
+        Args:
+            contents: 新闻内容列表
+            
+        Returns:
+            需要AI评估的内容下标列表；未启用预过滤时为全部下标
+        """
+        if self.prefilter is None or not contents:
+            return list(range(len(contents)))
+        for content in contents:
+            self._resolve_negative_labels(content)
+        start_time = datetime.now()
+        remaining, rejected = self.prefilter.split(contents)
+        elapsed = (datetime.now() - start_time).total_seconds()
+        logger.info(f"词法预过滤: {len(contents)} 条内容中丢弃 {len(rejected)} 条，耗时 {elapsed:.3f}秒")
+        return remaining
+    
+    def build_evaluation_batches(self, contents: List[Dict[str, Any]]) -> List[List[int]]:
+        """将内容按标签分组，并按批量大小和token预算切分成批次
+        
+        Args:
+            contents: 新闻内容列表
+            
+        Returns:
+            批次列表，每个批次是内容下标的列表；同一批次内的内容标签相同
+        """
+        batch_size = max(1, int(self.filter_settings.get("batch_size", 8)))
+        token_budget = int(self.filter_settings.get("batch_token_budget", 6000))
+        
+        # 按标签分组，保持各组首次出现的顺序
+        groups: Dict[Tuple, List[int]] = {}
+        for index, content in enumerate(contents):
+            negative_labels = self._resolve_negative_labels(content)
+            key = (tuple(content.get("feed_labels", [])), tuple(negative_labels or []))
+            groups.setdefault(key, []).append(index)
+        
+        batches = []
+        for indices in groups.values():
+            # 提示词中与内容无关的部分（说明、标签、JSON格式）在整个批次中只出现一次
+            base_tokens = estimate_tokens(self._build_batch_evaluation_prompt([{
+                "feed_labels": contents[indices[0]].get("feed_labels", []),
+                "negative_labels": contents[indices[0]].get("negative_labels", [])
+            }]))
+            batch, batch_tokens = [], base_tokens
+            for index in indices:
+                item_tokens = estimate_tokens(self._format_news_section(contents[index])) + BATCH_RESPONSE_TOKENS_PER_ITEM
+                if batch and (len(batch) >= batch_size or batch_tokens + item_tokens > token_budget):
+                    batches.append(batch)
+                    batch, batch_tokens = [], base_tokens
+                batch.append(index)
+                batch_tokens += item_tokens
+            if batch:
+                batches.append(batch)
+        return batches
+    
+    def _parse_batch_evaluation(self, response_text: str, count: int) -> List[Optional[Dict[str, Any]]]:
+        """解析批量评估的JSON数组响应，每个元素单独进行结构验证
+        
+        Args:
+            response_text: AI响应文本
+            count: 批次中的内容数
+            
+        Returns:
+            与批次内容一一对应的评估结果列表，缺失或验证失败的元素为None
+            
+        Raises:
+            AiException: 当响应中找不到可解析的JSON数组时
+        """
+        cleaned_text = self._clean_thinking_process(response_text)
+        start_idx = cleaned_text.find('[')
+        end_idx = cleaned_text.rfind(']') + 1
+        if start_idx == -1 or end_idx == 0:
+            raise AiException("从AI响应中找不到JSON数组")
+        try:
+            elements = json.loads(cleaned_text[start_idx:end_idx])
+        except json.JSONDecodeError as e:
+            raise AiException(f"解析批量评估JSON数组时出错: {str(e)}")
+        if not isinstance(elements, list):
+            raise AiException("批量评估结果不是JSON数组")
+        
+        # 优先按 index 字段对应新闻编号，没有编号且数量一致时按顺序对应
+        evaluations: List[Optional[Dict[str, Any]]] = [None] * count
+        use_position = len(elements) == count and not all(isinstance(e, dict) and "index" in e for e in elements)
+        for position, element in enumerate(elements):
+            if not isinstance(element, dict):
+                continue
+            element = dict(element)
+            number = element.pop("index", None)
+            if use_position:
+                slot = position
+            else:
+                try:
+                    slot = int(number) - 1
+                except (TypeError, ValueError):
+                    continue
+            if not 0 <= slot < count or evaluations[slot] is not None:
+                continue
+            try:
+                evaluations[slot] = self._validate_evaluation(element)
+            except AiException as e:
+                logger.warning(f"批量评估中第 {slot + 1} 条结果验证失败: {str(e)}")
+        return evaluations
+    
+    def filter_content_group(self, contents: List[Dict[str, Any]], indices: List[int], total: int) -> List[Tuple[Dict[str, Any], bool]]:
+        """用一次AI调用评估一批标签相同的内容，解析失败的内容单独回退为逐条评估
+        
+        Args:
+            contents: 标签相同的新闻内容列表
+            indices: 各内容在整个批次中的序号（仅用于日志）
+            total: 整个批次的内容总数（仅用于日志）
+            
+        Returns:
+            与contents一一对应的 (评估后的内容, 是否保留) 列表
+        """
+        if len(contents) == 1:
+            return [self.filter_content(contents[0], indices[0], total)]
+        
+        # 先从缓存中取出已有的评估结果，只把未命中的内容放入批量提示词
+        evaluations: List[Optional[Dict[str, Any]]] = [self._get_cached_evaluation(content) for content in contents]
+        pending = [i for i, evaluation in enumerate(evaluations) if evaluation is None]
+        if len(pending) < len(contents):
+            logger.info(f"评估缓存命中 {len(contents) - len(pending)}/{len(contents)} 条内容")
+        
+        # 本地分类器置信丢弃的内容不放入提示词
+        classified = {i for i in pending if self._classify_locally(contents[i])}
+        pending = [i for i in pending if i not in classified]
+        
+        # 只剩一条未命中时不必使用批量提示词，下面直接逐条评估
+        if len(pending) > 1:
+            pending_contents = [contents[i] for i in pending]
+            try:
+                prompt = self._build_batch_evaluation_prompt(pending_contents)
+                logger.info(f"批量评估 {len(pending_contents)} 条内容，提示词长度: {len(prompt)} 字符")
+                response_text = self.ai_service.call_ai(prompt, stop_on_json="[", json_schema=self.batch_evaluation_schema,
+                                                        purpose=PURPOSE_EVALUATE_BATCH)
+                logger.info(f"批量评估AI响应长度: {len(response_text)} 字符")
+                for i, evaluation in zip(pending, self._parse_batch_evaluation(response_text, len(pending_contents))):
+                    if evaluation is not None:
+                        evaluations[i] = evaluation
+                        self._store_evaluation(contents[i], evaluation)
+            except AiException as e:
+                logger.warning(f"批量评估失败，将逐条评估本批次的 {len(pending_contents)} 条内容: {str(e)}")
+        
+        results = []
+        for position, (content, index, evaluation) in enumerate(zip(contents, indices, evaluations)):
+            self._log_progress(content, index, total)
+            if position in classified:
+                evaluated_content = content
+            elif evaluation is None:
+                logger.info(f"内容 #{index+1} 没有可用的批量评估结果，改为单条评估")
+                evaluated_content = self.evaluate_content(content)
+                self._record_verdict(evaluated_content)
+            else:
+                content.update({
+                    "evaluation": evaluation,
+                    "keep": self._should_keep_content(evaluation)
+                })
+                evaluated_content = content
+                self._record_verdict(evaluated_content)
+            results.append((evaluated_content, self._log_decision(evaluated_content, index)))
+        return results
+    
+    def evaluation_worker_count(self) -> int:
+        """并发评估的线程数：不超过 max_workers 和评估所用AI提供商的并发上限，未启用并发评估时为1"""
+        if not self.filter_settings.get("concurrent_evaluation", True):
+            return 1
+        concurrency_limit = self.ai_service.concurrency_limit_for(PURPOSE_EVALUATE_BATCH if self.batch_evaluation else PURPOSE_EVALUATE)
+        return max(1, min(int(self.filter_settings.get("max_workers", 1)), concurrency_limit))
+    
     def filter_content_batch(self, contents: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
         """批量评估和过滤新闻内容
         
@@ -580,45 +1107,40 @@ class ContentFilter:
             
         logger.info(f"开始过滤 {len(contents)} 条内容，使用各个内容所属的源标签")
         
-        for index, content in enumerate(contents):
-            # No try-except block needed here for evaluate_content itself,
-            # as it now handles its own errors and returns a result regardless.
-            title = content.get("title", "无标题")
-            feed_labels = content.get("feed_labels", [])
-            
-            # 增强逻辑，确保我们有负向标签
-            negative_labels = content.get("negative_labels", [])
-            feed_url = content.get("feed_url")
-            task = content.get("task")
-            
-            # 如果没有负向标签但有任务对象和feed URL，则从任务配置中获取
-            if not negative_labels and task and feed_url and hasattr(task, 'get_feed_negative_labels'):
-                try:
-                    negative_labels = task.get_feed_negative_labels(feed_url)
-                    content["negative_labels"] = negative_labels
-                except Exception as e:
-                    logger.error(f"尝试从任务获取负向标签时出错: {str(e)}")
-            
-            label_info = f"标签: {feed_labels}"
-            if negative_labels:
-                label_info += f", 反向标签: {negative_labels}"
-            
-            logger.info(f"过滤进度: {index+1}/{len(contents)} - {title[:30]}{'...' if len(title) > 30 else ''} ({label_info})")
-            
-            # 评估每个内容 (now handles retries internally and returns error state if failed)
-            evaluated_content = self.evaluate_content(content) # Pass content directly
-            
-            # 根据评估结果分类 (evaluate_content adds 'keep' and 'evaluation' with potential 'error')
-            if evaluated_content.get("keep", False):
-                logger.info(f"决定: 保留内容 #{index+1}")
+        results: List[Optional[Tuple[Dict[str, Any], bool]]] = [None] * len(contents)
+        remaining = self.prefilter_contents(contents)
+        for index in set(range(len(contents))) - set(remaining):
+            results[index] = (contents[index], False)
+        
+        # 每个评估单元是一组内容下标：批量模式下为标签相同的一批内容，否则为单条内容
+        if self.batch_evaluation:
+            batches = self.build_evaluation_batches([contents[i] for i in remaining])
+            units = [[remaining[i] for i in batch] for batch in batches]
+            logger.info(f"批量评估模式: {len(remaining)} 条内容合并为 {len(units)} 个请求")
+        else:
+            units = [[index] for index in remaining]
+        
+        def evaluate_unit(indices: List[int]) -> List[Tuple[Dict[str, Any], bool]]:
+            return self.filter_content_group([contents[i] for i in indices], indices, len(contents))
+        
+        worker_count = min(self.evaluation_worker_count(), len(units))
+        
+        if worker_count > 1:
+            # 并发评估，结果按原始顺序返回；请求速率由AI服务的限流器控制
+            logger.info(f"并发评估内容 (线程数: {worker_count})")
+            with ThreadPoolExecutor(max_workers=worker_count, thread_name_prefix="ContentFilter") as executor:
+                unit_results = list(executor.map(evaluate_unit, units))
+        else:
+            unit_results = (evaluate_unit(indices) for indices in units)
+        
+        for indices, outputs in zip(units, unit_results):
+            for index, output in zip(indices, outputs):
+                results[index] = output
+        
+        for evaluated_content, keep in results:
+            if keep:
                 kept_contents.append(evaluated_content)
             else:
-                # Check if discard was due to an evaluation error recorded by evaluate_content
-                eval_data = evaluated_content.get("evaluation", {})
-                if isinstance(eval_data, dict) and "error" in eval_data:
-                     logger.warning(f"决定: 丢弃内容 #{index+1} (原因: {eval_data['error']})")
-                else:
-                     logger.info(f"决定: 丢弃内容 #{index+1} (原因: 过滤器规则)")
                 discarded_contents.append(evaluated_content)
         
         logger.info(f"过滤完成: 共 {len(contents)} 条内容, 保留 {len(kept_contents)} 条, 丢弃 {len(discarded_contents)} 条")
@@ -635,6 +1157,17 @@ class ContentFilter:
             if error_count > 0:
                 logger.info(f"因评估错误丢弃数: {error_count}")
             
+            self.ai_service.log_stream_stats()
+            if self.correction_retries > 0:
+                logger.info(f"格式修正重试数: {self.correction_retries} (结构化输出模式: {self.ai_service.structured_output})")
+            
+            prefilter_count = sum(1 for c in discarded_contents if c.get("discard_reason", "").startswith("prefilter"))
+            if prefilter_count > 0:
+                logger.info(f"词法预过滤丢弃数: {prefilter_count}")
+            classifier_count = sum(1 for c in discarded_contents if c.get("discard_reason") == REASON_CLASSIFIER_DISCARD)
+            if classifier_count > 0:
+                logger.info(f"本地分类器丢弃数（节省的AI调用）: {classifier_count}")
+            
             # 记录丢弃内容的标题
             if discarded_contents:
                 logger.info(f"\n============ 被丢弃的内容 ============")
@@ -645,6 +1178,11 @@ class ContentFilter:
                     if isinstance(eval_data, dict):
                         if "error" in eval_data:
                             reason = f"评估错误: {eval_data['error']}"
+                        elif "classifier" in eval_data:
+                            reason = f"本地分类器: 丢弃概率 {eval_data['classifier'].get('discard_probability', 0):.3f}"
+                        elif "prefilter" in eval_data:
+                            prefilter = eval_data["prefilter"]
+                            reason = f"词法预过滤: {prefilter.get('reason')} (得分: {prefilter.get('score')}, 反向标签: {prefilter.get('matched_tags')})"
                         else:
                             # Attempt to reconstruct reason from valid evaluation data if available
                             try:
@@ -0,0 +1,89 @@
+import json
+from typing import Optional
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+class JsonStreamScanner:
+    """在流式响应中增量查找第一个完整的JSON对象（或数组）
+
+    按括号层级扫描逐步到达的文本，忽略字符串中的括号和 <think></think> 中的思考过程。
+    括号闭合且内容可以被解析为JSON时即认为完整，调用方可以据此提前结束流式请求。
+    """
+
+    def __init__(self, opening: str = "{"):
+        """初始化扫描器
+
+        Args:
+            opening: 要查找的JSON起始字符，"{" 表示对象，"[" 表示数组
+        """
+        self.opening = opening
+        self.closing = "}" if opening == "{" else "]"
+        self.text = ""
+        self.end: Optional[int] = None  # 完整JSON结束的位置（不含）
+        self._pos = 0
+        self._start = -1
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    def feed(self, chunk: str) -> bool:
+        """追加一段文本并继续扫描
+
+        Returns:
+            是否已经得到完整的JSON
+        """
+        if self.complete:
+            return True
+        self.text += chunk
+        text = self.text
+        i = self._pos
+        while i < len(text):
+            if self._start == -1:
+                if text.startswith("<", i) and THINK_OPEN.startswith(text[i:i + len(THINK_OPEN)]):
+                    if len(text) - i < len(THINK_OPEN):
+                        break  # 可能是尚未到达完整的 <think> 标记
+                    close = text.find(THINK_CLOSE, i + len(THINK_OPEN))
+                    if close == -1:
+                        break  # 思考过程尚未结束
+                    i = close + len(THINK_CLOSE)
+                    continue
+                if text[i] == self.opening:
+                    self._start, self._depth = i, 1
+                i += 1
+                continue
+
+            char = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == self.opening:
+                self._depth += 1
+            elif char == self.closing:
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        json.loads(text[self._start:i + 1])
+                        self.end = i + 1
+                        self._pos = i + 1
+                        return True
+                    except ValueError:
+                        # 括号配对但不是合法JSON（如说明文字中的括号），继续查找下一个
+                        self._start = -1
+            i += 1
+        self._pos = i
+        return False
+
+    def result_text(self) -> str:
+        """到完整JSON结束为止的响应文本；尚未完整时返回已收到的全部文本"""
+        return self.text[:self.end] if self.complete else self.text
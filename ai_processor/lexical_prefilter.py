@@ -0,0 +1,163 @@
+import math
+import logging
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple
+
+from ai_processor.text_features import tokenize, article_text, is_cjk_token
+
+logger = logging.getLogger("lexical_prefilter")
+
+# 预过滤的丢弃原因，写入 discarded_articles.reason
+REASON_NO_LABEL_MATCH = "prefilter_no_label_match"
+REASON_NEGATIVE_MATCH = "prefilter_negative_match"
+
+# 英文等按单词切分的标签至少有这么多字符时，也匹配以其开头的词（如 "tech" 匹配 "technology"）
+PREFIX_MATCH_MIN_LENGTH = 3
+
+def _scripts(tokens) -> set:
+    return {"cjk" if is_cjk_token(token) else "latin" for token in tokens}
+
+def _dominant_script(tokens: List[str]) -> Optional[str]:
+    """文章的主要文字，中文文章中夹杂的英文词和数字不影响判断"""
+    if not tokens:
+        return None
+    cjk_count = sum(1 for token in tokens if is_cjk_token(token))
+    return "cjk" if cjk_count * 2 >= len(tokens) else "latin"
+
+def _contains_sequence(tokens: List[str], sequence: List[str]) -> bool:
+    if not sequence or len(sequence) > len(tokens):
+        return False
+    size = len(sequence)
+    return any(tokens[i:i + size] == sequence for i in range(len(tokens) - size + 1))
+
+class LexicalPrefilter:
+    """AI评估前的本地词法预过滤
+
+    以Feed标签为查询词，对一批文章计算BM25得分（IDF和平均文档长度取自这批文章本身）。
+    只丢弃明显不相关的文章，其余文章仍交给AI评估：
+      - 与标签没有任何共同词汇（得分不超过 min_score）的文章；
+      - 标题中完整出现反向标签、且标题中没有出现任何兴趣标签的文章。
+    标签与文章的主要文字不同（如中文标签、英文文章）时无法比较词汇，这类文章不做预过滤。
+    """
+
+    def __init__(self, min_score: float = 0.0, drop_negative_matches: bool = True, k1: float = 1.2, b: float = 0.75):
+        """初始化预过滤器
+
+        Args:
+            min_score: BM25得分不超过此值的文章被丢弃，0表示只丢弃与标签没有共同词汇的文章
+            drop_negative_matches: 是否丢弃标题中明显出现反向标签的文章
+            k1: BM25词频饱和参数
+            b: BM25文档长度归一化参数
+        """
+        self.min_score = float(min_score)
+        self.drop_negative_matches = drop_negative_matches
+        self.k1 = k1
+        self.b = b
+
+    def _matching_terms(self, term: str, vocabulary) -> List[str]:
+        """文章词汇中与查询词匹配的词项"""
+        if is_cjk_token(term) or len(term) < PREFIX_MATCH_MIN_LENGTH:
+            return [term] if term in vocabulary else []
+        return [token for token in vocabulary if token.startswith(term)]
+
+    def score(self, contents: List[Dict[str, Any]], labels: List[str]) -> List[Optional[float]]:
+        """计算每篇文章相对于标签的BM25得分
+
+        Args:
+            contents: 新闻内容列表
+            labels: 作为查询的标签
+
+        Returns:
+            与contents一一对应的得分，文章与标签文字不同、无法比较时为None
+        """
+        query = set()
+        for label in labels:
+            query.update(tokenize(label))
+        documents = [tokenize(article_text(content)) for content in contents]
+        if not query or not documents:
+            return [None] * len(contents)
+
+        term_counts = [Counter(tokens) for tokens in documents]
+        average_length = sum(len(tokens) for tokens in documents) / len(documents) or 1.0
+        query_scripts = _scripts(query)
+
+        # 每篇文章中与各查询词匹配的词频之和
+        matched_tf = [{term: sum(counts[token] for token in self._matching_terms(term, counts)) for term in query}
+                      for counts in term_counts]
+        document_frequency = {term: sum(1 for tf in matched_tf if tf[term]) for term in query}
+        count = len(documents)
+        idf = {term: math.log(1 + (count - df + 0.5) / (df + 0.5)) for term, df in document_frequency.items()}
+
+        scores: List[Optional[float]] = []
+        for tokens, tf in zip(documents, matched_tf):
+            if _dominant_script(tokens) not in query_scripts:
+                scores.append(None)
+                continue
+            length_norm = self.k1 * (1 - self.b + self.b * len(tokens) / average_length)
+            scores.append(sum(idf[term] * f * (self.k1 + 1) / (f + length_norm) for term, f in tf.items() if f))
+        return scores
+
+    def _title_matches(self, title_tokens: List[str], labels: List[str]) -> List[str]:
+        return [label for label in labels if _contains_sequence(title_tokens, tokenize(label))]
+
+    def check(self, contents: List[Dict[str, Any]], feed_labels: List[str],
+              negative_labels: Optional[List[str]] = None) -> List[Optional[Dict[str, Any]]]:
+        """对一批标签相同的文章进行预过滤
+
+        Args:
+            contents: 新闻内容列表
+            feed_labels: 兴趣标签
+            negative_labels: 反向标签
+
+        Returns:
+            与contents一一对应的结果：需要丢弃的文章为包含 reason、score 和 matched_tags 的字典，
+            其余为None
+        """
+        scores = self.score(contents, feed_labels)
+        results: List[Optional[Dict[str, Any]]] = []
+        for content, score in zip(contents, scores):
+            title_tokens = tokenize(content.get("title", ""))
+            if self.drop_negative_matches and negative_labels:
+                negative_tags = self._title_matches(title_tokens, negative_labels)
+                if negative_tags and not self._title_matches(title_tokens, feed_labels):
+                    results.append({"reason": REASON_NEGATIVE_MATCH, "score": score, "matched_tags": negative_tags})
+                    continue
+            if score is not None and score <= self.min_score:
+                results.append({"reason": REASON_NO_LABEL_MATCH, "score": score, "matched_tags": []})
+                continue
+            results.append(None)
+        return results
+
+    def split(self, contents: List[Dict[str, Any]]) -> Tuple[List[int], List[int]]:
+        """按标签分组预过滤文章，被丢弃的文章记录 keep、discard_reason 和 prefilter 信息
+
+        Args:
+            contents: 新闻内容列表，每个内容包括feed_labels和negative_labels
+
+        Returns:
+            需要AI评估的下标列表和被预过滤丢弃的下标列表
+        """
+        groups: Dict[Tuple, List[int]] = {}
+        for index, content in enumerate(contents):
+            key = (tuple(content.get("feed_labels", []) or []), tuple(content.get("negative_labels", []) or []))
+            groups.setdefault(key, []).append(index)
+
+        rejected = set()
+        for (feed_labels, negative_labels), indices in groups.items():
+            if not feed_labels:
+                continue
+            group = [contents[i] for i in indices]
+            for index, result in zip(indices, self.check(group, list(feed_labels), list(negative_labels))):
+                if result is None:
+                    continue
+                content = contents[index]
+                content.update({
+                    "evaluation": {"prefilter": result},
+                    "keep": False,
+                    "discard_reason": result["reason"]
+                })
+                rejected.add(index)
+                logger.info(f"预过滤丢弃 ({result['reason']}): {content.get('title', '无标题')}")
+
+        remaining = [i for i in range(len(contents)) if i not in rejected]
+        return remaining, sorted(rejected)
@@ -0,0 +1,149 @@
+import math
+import re
+from collections import Counter
+from typing import List, Dict, Any, Tuple
+from ai_processor.call_metrics import estimate_tokens
+from ai_processor.text_features import tokenize
+
+# 提示词中各部分文章内容的默认token预算，可在 ai_settings.prompt_budgets 中覆盖
+DEFAULT_PROMPT_BUDGETS = {
+    "evaluate_summary": 250,     # 评估提示词中的摘要
+    "evaluate_content": 800,     # 评估提示词中的全文
+    "combined_content": 1600,    # 合并评估模式（同时生成简报）提示词中的全文
+    "summarize_content": 1600    # 生成简报提示词中的全文
+}
+
+def get_prompt_budgets(config: Dict[str, Any]) -> Dict[str, int]:
+    """从配置中读取提示词的token预算，缺失的项使用默认值"""
+    budgets = dict(DEFAULT_PROMPT_BUDGETS)
+    budgets.update(config.get("global_settings", {}).get("ai_settings", {}).get("prompt_budgets", {}) or {})
+    return budgets
+
+# 按中英文句末标点和换行切分句子，标点和其后的空白留在句子末尾
+_SENTENCE_RE = re.compile(r"[^。！？!?；;\n]*?(?:[。！？!?；;]+[”’\"')）]*|\.+[”’\"')）]*(?=\s)|\n+|$)\s*")
+
+# 省略部分句子时的标记
+ELLIPSIS = "……"
+
+def split_sentences(text: str) -> List[str]:
+    """将文本切分为句子，拼接所有句子即为原文"""
+    return [sentence for sentence in _SENTENCE_RE.findall(text or "") if sentence]
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """截断文本使其估算的token数不超过预算"""
+    if estimate_tokens(text) <= budget:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
+
+def score_sentences(sentences: List[str], title: str = "") -> List[float]:
+    """按信息量为句子打分
+
+    每个句子的词项向量与全文的TF-IDF向量做点积，再除以句子词项数的平方根，
+    使得包含文章主题词的句子得分高，又不偏向长句；几乎每句都出现的词项（套话、重复的段落）权重接近0。
+    包含标题词项的句子额外加分。重复出现的句子只计一次，不会抬高彼此的得分。
+    """
+    sentence_tokens = [tokenize(sentence) for sentence in sentences]
+    unique_tokens = list({sentence.strip(): tokens for sentence, tokens in zip(sentences, sentence_tokens)}.values())
+    document = Counter(token for tokens in unique_tokens for token in tokens)
+    sentence_frequency = Counter(token for tokens in unique_tokens for token in set(tokens))
+    idf = {token: math.log(len(unique_tokens) / frequency) for token, frequency in sentence_frequency.items()}
+    title_tokens = set(tokenize(title))
+    scores = []
+    for tokens in sentence_tokens:
+        if not tokens:
+            scores.append(0.0)
+            continue
+        counts = Counter(tokens)
+        # 减去句子自身的词频，只奖励与其他句子共有的词项
+        overlap = sum(count * (document[token] - count) * idf[token] for token, count in counts.items())
+        title_bonus = sum(idf[token] for token in counts if token in title_tokens)
+        scores.append((overlap + 2 * title_bonus) / math.sqrt(len(tokens)))
+    return scores
+
+def select_sentences(text: str, budget: int, title: str = "", lead_share: float = 0.4) -> str:
+    """在token预算内选取文章中信息量最大的句子
+
+    文章不超过预算时原样返回。否则先保留开头的导语（最多占预算的 lead_share），
+    再按得分从高到低加入其余的句子，最后按原文顺序拼接，省略的部分以省略号标记。
+
+    Args:
+        text: 文章内容
+        budget: token预算
+        title: 文章标题，包含标题词项的句子优先
+        lead_share: 导语最多占用的预算比例
+
+    Returns:
+        预算内的文章内容
+    """
+    if estimate_tokens(text) <= budget:
+        return text
+    sentences = split_sentences(text)
+    costs = [estimate_tokens(sentence) for sentence in sentences]
+    marker_cost = estimate_tokens(ELLIPSIS)
+    # 第一句就超过预算（如没有标点的长文本）时直接截断
+    if costs[0] > budget - marker_cost:
+        return truncate_to_tokens(text, budget - marker_cost) + ELLIPSIS
+
+    # 导语：第一句和之后不超过 lead_share 预算的连续句子
+    selected = {0}
+    used = costs[0]
+    for index in range(1, len(costs)):
+        if used + costs[index] > budget * lead_share:
+            break
+        selected.add(index)
+        used += costs[index]
+
+    scores = score_sentences(sentences, title)
+    seen = {sentence.strip() for index, sentence in enumerate(sentences) if index in selected}
+    for index in sorted(range(len(sentences)), key=lambda index: scores[index], reverse=True):
+        # 跳过已选句子的重复
+        if index in selected or sentences[index].strip() in seen:
+            continue
+        if used + costs[index] + marker_cost <= budget:
+            selected.add(index)
+            seen.add(sentences[index].strip())
+            used += costs[index] + marker_cost
+
+    parts = []
+    for index, sentence in enumerate(sentences):
+        if index in selected:
+            parts.append(sentence)
+        elif not parts or parts[-1] != ELLIPSIS:
+            parts.append(ELLIPSIS)
+    return "".join(parts)
+
+def _normalized(text: str) -> str:
+    return re.sub(r"\W+", "", (text or "").lower())
+
+def summary_duplicates_content(summary: str, content: str, threshold: float = 0.8) -> bool:
+    """摘要是否只是全文开头的重复（很多RSS源的摘要就是正文第一段的截断）"""
+    summary_key = _normalized(summary.rstrip(".…[] "))
+    content_key = _normalized(content)
+    if not summary_key or not content_key:
+        return False
+    if content_key.startswith(summary_key):
+        return True
+    summary_tokens = set(tokenize(summary))
+    if not summary_tokens:
+        return False
+    opening_tokens = set(tokenize(content[:len(summary) * 2]))
+    return len(summary_tokens & opening_tokens) / len(summary_tokens) >= threshold
+
+def fit_article(summary: str, content: str, title: str, summary_budget: int, content_budget: int) -> Tuple[str, str]:
+    """在预算内准备提示词中的摘要和全文
+
+    摘要重复全文开头时不再发送摘要。
+
+    Returns:
+        (摘要, 全文)，摘要可能为空字符串
+    """
+    if content and summary_duplicates_content(summary, content):
+        summary = ""
+    return select_sentences(summary, summary_budget, title), select_sentences(content, content_budget, title)
@@ -0,0 +1,189 @@
+import logging
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger("provider_client")
+
+# 各提供商读取响应的默认超时（秒），可在 ai_settings.request_timeouts 中覆盖
+DEFAULT_REQUEST_TIMEOUTS = {
+    "ollama": 120,
+    "openai": 30,
+    "siliconflow": 60
+}
+
+# 建立连接的超时（秒）
+CONNECT_TIMEOUT = 10
+
+# 健康检查结果的有效期（秒），期间内不重复探测
+HEALTH_CHECK_TTL = 30
+
+class EndpointHealth:
+    """单个端点的健康状态，由每次请求的结果和健康检查更新"""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.healthy: Optional[bool] = None  # None 表示尚未与该端点通信
+        self.last_checked = 0.0
+        self.last_error = ""
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+
+    def record_success(self):
+        self.healthy = True
+        self.last_checked = time.time()
+        self.consecutive_failures = 0
+        self.requests += 1
+
+    def record_failure(self, error: str):
+        self.healthy = False
+        self.last_checked = time.time()
+        self.last_error = error
+        self.consecutive_failures += 1
+        self.requests += 1
+        self.failures += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "endpoint": self.endpoint,
+            "healthy": self.healthy,
+            "last_checked": self.last_checked,
+            "last_error": self.last_error,
+            "consecutive_failures": self.consecutive_failures,
+            "requests": self.requests,
+            "failures": self.failures
+        }
+
+def endpoint_of(url: str) -> str:
+    """URL所属的端点（协议、主机和端口），同一端点的请求共用一个连接池"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+class ProviderClient:
+    """进程内共享的AI提供商HTTP客户端
+
+    每个端点一个保持连接的会话，连接池大小不小于该端点的并发上限，
+    内容过滤和简报生成的请求复用同一批连接，不再为每个提示词重新进行TCP/TLS握手。
+    每次请求的结果都会更新端点的健康状态，健康检查只在状态过期时才实际探测。
+    """
+
+    def __init__(self):
+        self._sessions: Dict[str, Tuple[requests.Session, int]] = {}
+        self._health: Dict[str, EndpointHealth] = {}
+        self._lock = threading.Lock()
+
+    def _session(self, endpoint: str, pool_size: int) -> requests.Session:
+        """获取端点的会话，连接池不够大时重新挂载适配器"""
+        with self._lock:
+            session, current_size = self._sessions.get(endpoint, (None, 0))
+            if session is None or current_size < pool_size:
+                if session is None:
+                    session = requests.Session()
+                # 只重试建立连接失败的情况，请求已发出后的失败由调用方决定是否重试
+                retry = Retry(total=1, connect=1, read=0, status=0, other=0, raise_on_status=False)
+                session.mount(f"{endpoint}/", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry))
+                self._sessions[endpoint] = (session, pool_size)
+                logger.debug(f"AI提供商连接池: {endpoint}, 大小={pool_size}")
+            return session
+
+    def health(self, endpoint: str) -> EndpointHealth:
+        """获取端点的健康状态"""
+        with self._lock:
+            health = self._health.get(endpoint)
+            if health is None:
+                health = EndpointHealth(endpoint)
+                self._health[endpoint] = health
+            return health
+
+    def health_report(self) -> Dict[str, Dict[str, Any]]:
+        """所有端点的健康状态"""
+        with self._lock:
+            return {endpoint: health.to_dict() for endpoint, health in self._health.items()}
+
+    def request(self, method: str, url: str, timeout: Tuple[float, float], pool_size: int = 1, **kwargs) -> requests.Response:
+        """通过端点的共享会话发送请求并更新健康状态
+
+        Args:
+            method: HTTP方法
+            url: 请求URL
+            timeout: (连接超时, 读取超时)
+            pool_size: 端点的并发上限，决定连接池大小
+            **kwargs: 传递给 requests 的其他参数
+
+        Returns:
+            requests.Response 对象；收到任何HTTP响应都视为端点可达
+
+        Raises:
+            requests.RequestException: 连接失败或超时
+        """
+        endpoint = endpoint_of(url)
+        session = self._session(endpoint, max(1, int(pool_size)))
+        health = self.health(endpoint)
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except requests.RequestException as e:
+            health.record_failure(str(e))
+            raise
+        if response.status_code >= 500:
+            health.record_failure(f"HTTP {response.status_code}")
+        else:
+            health.record_success()
+        return response
+
+    def post(self, url: str, timeout: Tuple[float, float], pool_size: int = 1, **kwargs) -> requests.Response:
+        return self.request("POST", url, timeout, pool_size, **kwargs)
+
+    def check_health(self, url: str, max_age: float = HEALTH_CHECK_TTL, timeout: float = 5) -> bool:
+        """检查端点是否可用，最近的请求或检查结果未过期时直接使用
+
+        Args:
+            url: 健康检查使用的URL，如Ollama的 /api/tags
+            max_age: 已知状态的有效期（秒）
+            timeout: 探测请求的超时（秒）
+
+        Returns:
+            端点是否可用
+        """
+        health = self.health(endpoint_of(url))
+        if health.healthy is not None and time.time() - health.last_checked < max_age:
+            return health.healthy
+        try:
+            response = self.request("GET", url, (timeout, timeout))
+            if response.status_code != 200:
+                health.record_failure(f"HTTP {response.status_code}")
+        except requests.RequestException as e:
+            logger.warning(f"无法连接到 {health.endpoint}: {str(e)}")
+        return bool(health.healthy)
+
+    def close(self):
+        """关闭所有会话"""
+        with self._lock:
+            for session, _ in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+_provider_client: Optional[ProviderClient] = None
+_provider_client_lock = threading.Lock()
+
+def get_provider_client() -> ProviderClient:
+    """获取进程内共享的提供商客户端"""
+    global _provider_client
+    with _provider_client_lock:
+        if _provider_client is None:
+            _provider_client = ProviderClient()
+        return _provider_client
+
+def get_request_timeout(ai_settings: Dict[str, Any], provider: str) -> Tuple[float, float]:
+    """读取提供商的请求超时，缺失时使用默认值
+
+    Returns:
+        (连接超时, 读取超时)
+    """
+    read_timeout = (ai_settings.get("request_timeouts") or {}).get(provider, DEFAULT_REQUEST_TIMEOUTS.get(provider, 60))
+    return CONNECT_TIMEOUT, float(read_timeout)
@@ -0,0 +1,209 @@
+import logging
+import random
+import re
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional, Mapping
+
+logger = logging.getLogger("retry_policy")
+
+# AI调用重试和熔断的默认设置，可在 ai_settings.retry_settings 中覆盖
+DEFAULT_RETRY_SETTINGS = {
+    "base_delay": 1.0,          # 第一次重试前的等待时间（秒），之后每次翻倍
+    "max_delay": 30.0,          # 指数退避的最长等待时间（秒）
+    "max_retry_after": 120.0,   # 服务端要求等待的时间超过此值（秒）时不再重试
+    "failure_threshold": 0.5,   # 最近调用的失败率达到此值时熔断
+    "window": 20,               # 计算失败率的最近调用次数
+    "min_calls": 5,             # 最近调用次数不足时不熔断
+    "cooldown": 60.0            # 熔断后经过此时间（秒）才允许试探请求
+}
+
+def get_retry_settings(ai_settings: Dict[str, Any]) -> Dict[str, Any]:
+    """从 ai_settings 中读取重试和熔断设置，缺失的项使用默认值"""
+    settings = dict(DEFAULT_RETRY_SETTINGS)
+    settings.update(ai_settings.get("retry_settings", {}) or {})
+    return settings
+
+# 服务过载或暂时不可用的HTTP状态码，可以重试
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def _parse_duration(value: str) -> Optional[float]:
+    """解析 "1m30s"、"250ms"、"2.5" 这类时长，单位缺省为秒"""
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_PATTERN.findall(value)
+    if not parts or "".join(number + unit for number, unit in parts) != value:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """从响应头中读取服务端要求的等待时间（秒）
+
+    依次查看 Retry-After（秒数或HTTP日期）、retry-after-ms，
+    以及OpenAI兼容接口的 x-ratelimit-reset-requests / x-ratelimit-reset-tokens。
+
+    Returns:
+        等待秒数，响应头中没有相关信息时为None
+    """
+    if not headers:
+        return None
+    value = headers.get("Retry-After")
+    if value:
+        seconds = _parse_duration(value)
+        if seconds is not None:
+            return seconds
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError, IndexError):
+            pass
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    resets = [_parse_duration(headers[name]) for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+              if headers.get(name)]
+    resets = [seconds for seconds in resets if seconds is not None]
+    return max(resets) if resets else None
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """第 attempt 次重试（从0开始）前的等待时间：指数退避，在上限的一半到上限之间随机抖动
+
+    随机抖动使并发的请求不会在同一时刻一起重试。
+    """
+    cap = min(max_delay, base_delay * (2 ** attempt))
+    return random.uniform(cap / 2, cap)
+
+class CircuitBreaker:
+    """单个AI提供商的熔断器，由同一进程中的所有AiService共享
+
+    记录最近 window 次调用的成败，失败率达到阈值后进入 open 状态，所有调用立即失败；
+    经过 cooldown 秒后进入 half_open 状态，只放行一个试探请求，成功则恢复 closed，失败则重新熔断。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: float = 0.5, window: int = 20, min_calls: int = 5, cooldown: float = 60.0):
+        self.failure_threshold = float(failure_threshold)
+        self.window = max(1, int(window))
+        self.min_calls = max(1, int(min_calls))
+        self.cooldown = max(0.0, float(cooldown))
+        self._outcomes = deque(maxlen=self.window)  # True 表示失败
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.last_error = ""
+        self.open_count = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, retry_settings: Dict[str, Any]) -> "CircuitBreaker":
+        return cls(
+            retry_settings.get("failure_threshold", 0.5),
+            retry_settings.get("window", 20),
+            retry_settings.get("min_calls", 5),
+            retry_settings.get("cooldown", 60.0)
+        )
+
+    def _refresh(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def retry_in(self) -> float:
+        """熔断状态下距离允许试探请求的秒数，未熔断时为0"""
+        with self._lock:
+            self._refresh()
+            if self._state != self.OPEN:
+                return 0.0
+            return max(0.0, self.cooldown - (time.monotonic() - self._opened_at))
+
+    def allow(self) -> bool:
+        """是否允许发出请求；half_open 状态下同一时间只允许一个试探请求"""
+        with self._lock:
+            self._refresh()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("AI提供商恢复正常，熔断结束")
+            self._state = self.CLOSED
+            self._trial_in_flight = False
+            self._outcomes.append(False)
+
+    def record_failure(self, error: str = ""):
+        with self._lock:
+            self.last_error = error
+            self._outcomes.append(True)
+            if self._state == self.HALF_OPEN:
+                self._open()
+                return
+            failures = sum(self._outcomes)
+            if (self._state == self.CLOSED and len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) >= self.failure_threshold):
+                self._open()
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._trial_in_flight = False
+        self.open_count += 1
+        # 恢复后重新统计失败率
+        self._outcomes.clear()
+        logger.warning(f"AI提供商失败率过高，熔断 {self.cooldown:.0f} 秒: {self.last_error}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "retry_in": round(self.retry_in(), 1),
+            "open_count": self.open_count,
+            "last_error": self.last_error
+        }
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(scope: str, retry_settings: Dict[str, Any]) -> CircuitBreaker:
+    """获取同一服务端共享的熔断器，设置发生变化时重新创建
+
+    Args:
+        scope: 共享范围，托管API为提供商名称，Ollama为提供商和主机（或端点池）
+        retry_settings: 重试和熔断设置
+    """
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(scope)
+        candidate = CircuitBreaker.from_settings(retry_settings)
+        if breaker is None or (breaker.failure_threshold, breaker.window, breaker.min_calls, breaker.cooldown) != \
+                (candidate.failure_threshold, candidate.window, candidate.min_calls, candidate.cooldown):
+            breaker = candidate
+            _circuit_breakers[scope] = breaker
+        return breaker
+
+def get_circuit_states() -> Dict[str, Dict[str, Any]]:
+    """所有熔断器的状态，按共享范围（提供商或Ollama主机）区分"""
+    with _circuit_breakers_lock:
+        breakers = dict(_circuit_breakers)
+    return {provider: breaker.to_dict() for provider, breaker in breakers.items()}
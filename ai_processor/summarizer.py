@@ -3,11 +3,17 @@ import re
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 from ai_processor.ai_utils import AiService, AiException
+from ai_processor.ai_cache import SummaryCache
+from ai_processor.call_metrics import PURPOSE_SUMMARIZE, PURPOSE_TITLE
+from ai_processor.prompt_budget import get_prompt_budgets, select_sentences
 from core.localization import get_current_language
 
 # 配置日志
 logger = logging.getLogger("summarizer")
 
+# 连续这么多条内容生成简报失败时，认为AI服务存在问题并中断流程
+MAX_CONSECUTIVE_SUMMARY_FAILURES = 3
+
 class NewsSummarizer:
     """新闻内容简报生成器，用于将新闻内容转换为简洁完整的概要"""
     
@@ -31,6 +37,14 @@ class NewsSummarizer:
         # 简报风格设置
         self.brief_style = self.summarize_settings.get("style", "informative")
         
+        # 简报缓存，同一篇文章在多个任务和多次运行中只生成一次简报
+        self.summary_cache = None
+        if self.summarize_settings.get("summary_cache", True):
+            try:
+                self.summary_cache = SummaryCache(max_entries=self.summarize_settings.get("summary_cache_max_entries", 5000))
+            except Exception as e:
+                logger.warning(f"初始化简报缓存失败，将不使用缓存: {str(e)}")
+        
         # 直接使用core.localization中的语言设置，确保与UI一致
         self.language = get_current_language()
         
@@ -63,6 +77,7 @@ class NewsSummarizer:
         logger.info(f"开始为 {len(contents)} 条内容生成简报概要")
         
         summarized_contents = []
+        consecutive_failures = 0
         for index, content in enumerate(contents):
             try:
                 title = content.get("title", "无标题")
@@ -71,21 +86,50 @@ class NewsSummarizer:
                 # 生成简报
                 summarized_content = self.generate_summary(content)
                 summarized_contents.append(summarized_content)
+                consecutive_failures = 0
                 
             except Exception as e:
                 logger.error(f"生成简报时出错: {str(e)}")
                 # 如果是连续的多个错误，可能是AI服务问题，应该中断流程
-                if index > 0 and index % 3 == 0 and len(summarized_contents) == 0:
+                consecutive_failures += 1
+                if consecutive_failures >= MAX_CONSECUTIVE_SUMMARY_FAILURES:
                     raise AiException(f"连续多条内容生成简报失败，可能是AI服务存在问题: {str(e)}")
-                # 将错误信息添加到内容中
-                content["error"] = str(e)
-                content["news_brief"] = f"[生成简报失败: {str(e)}]"
-                content["summary_method"] = "error"
-                summarized_contents.append(content)
+                summarized_contents.append(self.mark_summary_error(content, e))
         
         logger.info(f"简报生成完成: {len(summarized_contents)}/{len(contents)} 成功")
+        self.log_cache_stats()
         return summarized_contents
     
+    def cache_stats(self) -> Dict[str, Any]:
+        """返回简报缓存的命中统计，未启用缓存时返回None"""
+        return self.summary_cache.stats() if self.summary_cache else None
+    
+    def log_cache_stats(self):
+        """记录简报缓存的命中统计"""
+        stats = self.cache_stats()
+        if stats:
+            logger.info(f"简报缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, 命中率 {stats['hit_rate']*100:.1f}%")
+    
+    def _summary_cache_key(self, content: Dict[str, Any]) -> str:
+        """根据内容哈希、语言、简报风格和模型构造简报缓存键"""
+        return self.summary_cache.make_key(content, self.language, self.brief_style,
+                                           self.ai_service.model_id(PURPOSE_SUMMARIZE))
+    
+    def mark_summary_error(self, content: Dict[str, Any], error: Exception) -> Dict[str, Any]:
+        """将简报生成失败的信息添加到内容中，使其仍可出现在简报邮件里
+        
+        Args:
+            content: 新闻内容
+            error: 生成简报时出现的异常
+            
+        Returns:
+            标记了错误的内容
+        """
+        content["error"] = str(error)
+        content["news_brief"] = f"[生成简报失败: {str(error)}]"
+        content["summary_method"] = "error"
+        return content
+    
     def generate_summary(self, content: Dict[str, Any]) -> Dict[str, Any]:
         """为单个新闻内容生成简报概要
         
@@ -100,10 +144,35 @@ class NewsSummarizer:
         """
         title = content.get("title", "")
         article_content = content.get("content", "")
+        combined_brief = content.pop("combined_brief", None)
+        
+        cache_key = self._summary_cache_key(content) if self.summary_cache else None
+        
+        # 合并评估模式下评估时已经生成了简报，直接使用
+        if combined_brief and self.apply_combined_brief(content, combined_brief):
+            logger.info(f"使用评估时一并生成的简报，跳过AI调用: {content['title']}")
+            self._store_summary(cache_key, content)
+            return content
         
-        # 处理标题过长的情况
+        # 命中缓存时直接使用保存的标题和简报
+        if self.summary_cache:
+            cached = self.summary_cache.get(cache_key)
+            if cached:
+                if cached["title"] and cached["title"] != title:
+                    content["original_title"] = title
+                    content["title"] = cached["title"]
+                content["news_brief"] = cached["news_brief"]
+                content["summary_method"] = cached["summary_method"]
+                logger.info(f"简报缓存命中，跳过AI调用: {content['title']}")
+                self.ai_service.record_cache_hit(PURPOSE_SUMMARIZE)
+                return content
+        
+        # 处理标题过长的情况；AI简化失败时标题被直接截断，这样的结果不写入缓存
+        degraded = False
         if len(title) > 70:
-            title = self._summarize_long_title(title)
+            short_title = self._summarize_long_title(title)
+            degraded = short_title is None
+            title = title[:67] + "..." if degraded else short_title
             content["original_title"] = content.get("title", "")
             content["title"] = title
             logger.info(f"标题过长已简化为: {title}")
@@ -117,6 +186,8 @@ class NewsSummarizer:
             logger.warning(f"内容太短 ({len(article_content)} 字符)，直接使用原内容作为简报")
             content["news_brief"] = article_content or "无内容可显示"
             content["summary_method"] = "original"
+            if not degraded:
+                self._store_summary(cache_key, content)
             return content
         
         # 使用AI生成简报
@@ -133,16 +204,83 @@ class NewsSummarizer:
         # 记录完整的简报内容
         logger.info(f"生成的简报内容: \n{news_brief}")
         
+        if not degraded:
+            self._store_summary(cache_key, content)
         return content
     
-    def _summarize_long_title(self, title: str) -> str:
+    def build_combined_requirements(self, content: Dict[str, Any]) -> Optional[str]:
+        """构建合并评估模式下对简报的要求，附加在内容评估提示词中
+        
+        Args:
+            content: 新闻内容
+            
+        Returns:
+            简报要求文本；内容太短、直接使用原文作为简报时返回None
+        """
+        article_content = content.get("content", "")
+        if not article_content or len(article_content) < 100:
+            return None
+        
+        title = content.get("title", "")
+        output_language = "中文" if self.language == "zh" else "英文（English）"
+        length = "200字左右，最长不超过500字" if self.language == "zh" else "不超过300个英文单词"
+        
+        title_requirement = ""
+        if not self._is_language_match(title, self.language):
+            title_requirement = f"将标题翻译成{output_language}，控制在70个字符以内"
+        elif len(title) > 70:
+            title_requirement = "将过长的标题简化到70个字符以内，同时保持原意"
+        
+        requirements = f"""## 简报要求
+除评估结果外，请在同一个JSON对象中增加以下字段：
+- "brief"：用{output_language}撰写的{self._style_description()}新闻简报，{length}。无论原文是什么语言，简报必须使用{output_language}。简报应帮助读者快速理解文章的主要内容，包含核心信息和要点；所有内容必须基于原文，严禁添加原文未提及的信息；注意理清人物、组织、事件之间的关系，仔细核对数据。不要包含日期、来源、链接等元数据，不要以“摘要：”等词语开头。"""
+        if title_requirement:
+            requirements += f"""
+- "title"：{title_requirement}。只输出标题本身。"""
+        return requirements
+    
+    def apply_combined_brief(self, content: Dict[str, Any], brief_data: Dict[str, Any]) -> bool:
+        """使用合并评估模式返回的简报和标题
+        
+        Args:
+            content: 新闻内容
+            brief_data: 评估响应中的 brief 和 title 字段
+            
+        Returns:
+            简报有效并已写入内容时返回True，否则返回False（改为单独生成简报）
+        """
+        brief = str(brief_data.get("brief") or "").strip()
+        if len(brief) < 5:
+            logger.warning(f"合并评估返回的简报无效 ({len(brief)} 字符)，将单独生成简报")
+            return False
+        
+        # 需要翻译或简化的标题随简报一起返回，没有返回时过长的标题直接截断
+        title = content.get("title", "")
+        new_title = str(brief_data.get("title") or "").strip() or title
+        if len(new_title) > 70:
+            new_title = new_title[:67] + "..."
+        if new_title != title:
+            if "original_title" not in content:
+                content["original_title"] = title
+            content["title"] = new_title
+        
+        content["news_brief"] = brief
+        content["summary_method"] = "ai"
+        return True
+    
+    def _store_summary(self, cache_key: Optional[str], content: Dict[str, Any]):
+        """将生成的标题和简报写入缓存"""
+        if self.summary_cache and cache_key:
+            self.summary_cache.put(cache_key, content.get("title", ""), content.get("news_brief", ""), content.get("summary_method", ""))
+    
+    def _summarize_long_title(self, title: str) -> Optional[str]:
         """对过长的标题进行简化摘要
         
         Args:
             title: 原始标题
             
         Returns:
-            简化后的标题
+            简化后的标题；AI简化失败时返回None，由调用方截断标题
         """
         if len(title) <= 70:
             return title
@@ -162,7 +300,7 @@ class NewsSummarizer:
                 prompt += "\n请用英文输出简化后的标题。"
 
             # 调用AI
-            response = self.ai_service.call_ai(prompt, max_retries=2)
+            response = self.ai_service.call_ai(prompt, max_retries=2, purpose=PURPOSE_TITLE)
             
             # 清除可能的思考过程
             cleaned_response = self._clean_thinking_process(response)
@@ -179,14 +317,13 @@ class NewsSummarizer:
                 
             # 验证简化标题不为空
             if not short_title:
-                return title[:67] + "..."
+                return None
                 
             return short_title
             
         except Exception as e:
             logger.error(f"简化标题时出错: {str(e)}")
-            # 如果AI简化失败，使用简单截断
-            return title[:67] + "..."
+            return None
     
     def _is_language_match(self, text: str, target_language: str) -> bool:
         """检测文本是否主要使用指定的语言
@@ -290,7 +427,7 @@ class NewsSummarizer:
         logger.info(f"Sending prompt to AI (preview): {prompt_preview}")
         
         # 调用AI
-        response = self.ai_service.call_ai(prompt, max_retries=2)
+        response = self.ai_service.call_ai(prompt, max_retries=2, purpose=PURPOSE_SUMMARIZE)
         
         # 清除可能的思考过程
         cleaned_response = self._clean_thinking_process(response)
@@ -351,6 +488,16 @@ class NewsSummarizer:
             
         return brief.strip()
     
+    def _style_description(self, language: str = "zh") -> str:
+        """简报风格的描述，language为提示词使用的语言"""
+        if self.brief_style == "informative":
+            return "客观、信息丰富的" if language == "zh" else "objective and informative"
+        elif self.brief_style == "concise":
+            return "简明扼要的" if language == "zh" else "concise"
+        elif self.brief_style == "conversational":
+            return "通俗易懂的" if language == "zh" else "conversational"
+        return ""
+    
     def _build_summary_prompt(self, title: str, content: str) -> str:
         """构建用于生成简报的提示词
         
@@ -361,9 +508,8 @@ class NewsSummarizer:
         Returns:
             提示词
         """
-        # 限制内容长度，避免超过AI上下文限制
-        if len(content) > 6000:
-            content = content[:6000] + "..."
+        # 内容超过token预算时保留导语和信息量最大的句子，避免超过AI上下文限制
+        content = select_sentences(content, get_prompt_budgets(self.config)["summarize_content"], title)
         
         # Double check the language setting before building prompt
         logger.info(f"Building prompt with language setting: {self.language}")
@@ -373,13 +519,7 @@ class NewsSummarizer:
         logger.info(f"Title '{title[:30]}...' matches language {self.language}: {title_matches_language}")
         
         # 根据简报风格调整提示词
-        style_description = ""
-        if self.brief_style == "informative":
-            style_description = "客观、信息丰富的" if self.language == "zh" else "objective and informative"
-        elif self.brief_style == "concise":
-            style_description = "简明扼要的" if self.language == "zh" else "concise"
-        elif self.brief_style == "conversational":
-            style_description = "通俗易懂的" if self.language == "zh" else "conversational"
+        style_description = self._style_description(self.language)
         
         # 确定输出语言
         output_language = "中文" if self.language == "zh" else "English"
@@ -0,0 +1,50 @@
+import re
+from typing import List, Dict, Any
+
+# 连续的中日韩字符按字切分为二元组，其他文字按单词切分
+_TOKEN_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+|[a-z0-9]+")
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+
+def tokenize(text: str) -> List[str]:
+    """将文本切分为词项：英文等按单词（小写），中日韩文字按相邻两字组成的二元组
+
+    Args:
+        text: 已清理HTML的文本
+
+    Returns:
+        按原文顺序排列的词项列表
+    """
+    tokens = []
+    for match in _TOKEN_RE.finditer((text or "").lower()):
+        run = match.group(0)
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+def is_cjk_token(token: str) -> bool:
+    """词项是否由中日韩文字组成"""
+    return bool(_CJK_RE.match(token))
+
+def shingles(tokens: List[str], size: int = 2) -> List[str]:
+    """由相邻词项组成的片段，保留词序信息，词项少于size时返回原词项"""
+    if len(tokens) < size:
+        return list(tokens)
+    return [" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)]
+
+def article_text(content: Dict[str, Any], max_chars: int = 3000) -> str:
+    """拼接文章的标题、摘要和正文，用于计算文本特征
+
+    Args:
+        content: 新闻内容
+        max_chars: 正文最多使用的字符数，转载稿件的差异通常不在开头部分
+
+    Returns:
+        拼接后的文本
+    """
+    parts = [content.get("title", ""), content.get("summary", ""), (content.get("content", "") or "")[:max_chars]]
+    return "\n".join(part for part in parts if part)
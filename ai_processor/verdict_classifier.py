@@ -0,0 +1,313 @@
+import os
+import json
+import math
+import time
+import zlib
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+
+from core.db_connection import get_connection_manager
+from ai_processor.ai_cache import default_cache_path, hash_text
+from ai_processor.text_features import tokenize, shingles, article_text
+
+logger = logging.getLogger("verdict_classifier")
+
+# 本地分类器的丢弃原因，写入 discarded_articles.reason
+REASON_CLASSIFIER_DISCARD = "classifier_discard"
+
+def label_set_key(feed_labels: List[str], negative_labels: List[str]) -> str:
+    """标签集合的键，同一组兴趣标签和反向标签共用一个模型"""
+    return hash_text(
+        json.dumps(sorted(feed_labels or []), ensure_ascii=False),
+        json.dumps(sorted(negative_labels or []), ensure_ascii=False)
+    )
+
+class VerdictStore:
+    """AI过滤结论的持久化存储，作为本地分类器的训练数据
+
+    每个标签集合下每篇文章只保留最新的一条结论，保存用于提取特征的文本、
+    保留/丢弃结论和完整的评估结果。
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        """初始化结论存储
+
+        Args:
+            db_path: 数据库路径，默认为 data/ai_cache.db
+        """
+        self.db_path = db_path or default_cache_path()
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._connections = get_connection_manager(self.db_path)
+        self._create_tables()
+
+    def _create_tables(self):
+        conn = self._connections.get_connection()
+        with conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS filter_verdicts (
+                label_key TEXT,
+                article_id TEXT,
+                labels TEXT,            -- 兴趣标签和反向标签JSON，用于报告
+                text TEXT,              -- 提取特征使用的文本
+                keep INTEGER,
+                evaluation TEXT,        -- 评估结果JSON
+                created_at REAL,
+                PRIMARY KEY (label_key, article_id)
+            )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_filter_verdicts_created ON filter_verdicts(label_key, created_at)")
+
+    def add(self, label_key: str, article_id: str, labels: Dict[str, Any], text: str,
+            keep: bool, evaluation: Dict[str, Any]):
+        """保存一条结论"""
+        try:
+            conn = self._connections.get_connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO filter_verdicts (label_key, article_id, labels, text, keep, evaluation, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (label_key, article_id, json.dumps(labels, ensure_ascii=False), text, int(bool(keep)),
+                     json.dumps(evaluation, ensure_ascii=False), time.time())
+                )
+        except Exception as e:
+            logger.warning(f"保存过滤结论失败: {e}")
+
+    def load(self, label_key: str, limit: int) -> List[Tuple[str, str, bool]]:
+        """读取标签集合下最近的结论
+
+        Returns:
+            (article_id, text, keep) 列表
+        """
+        conn = self._connections.get_connection()
+        rows = conn.execute(
+            "SELECT article_id, text, keep FROM filter_verdicts WHERE label_key = ? ORDER BY created_at DESC LIMIT ?",
+            (label_key, int(limit))
+        ).fetchall()
+        return [(row[0], row[1], bool(row[2])) for row in rows]
+
+    def label_sets(self) -> List[Tuple[str, Dict[str, Any], int]]:
+        """列出所有标签集合及其结论数
+
+        Returns:
+            (label_key, labels, count) 列表
+        """
+        conn = self._connections.get_connection()
+        rows = conn.execute(
+            "SELECT label_key, MAX(labels), COUNT(*) FROM filter_verdicts GROUP BY label_key ORDER BY COUNT(*) DESC"
+        ).fetchall()
+        return [(row[0], json.loads(row[1] or "{}"), row[2]) for row in rows]
+
+    def prune(self, label_key: str, keep_latest: int) -> int:
+        """只保留标签集合下最近的 keep_latest 条结论
+
+        Returns:
+            删除的条目数
+        """
+        conn = self._connections.get_connection()
+        with conn:
+            cursor = conn.execute(
+                "DELETE FROM filter_verdicts WHERE label_key = ? AND article_id NOT IN "
+                "(SELECT article_id FROM filter_verdicts WHERE label_key = ? ORDER BY created_at DESC LIMIT ?)",
+                (label_key, label_key, int(keep_latest))
+            )
+        return cursor.rowcount
+
+    def close(self):
+        """关闭数据库连接"""
+        self._connections.close_all()
+
+class HashedNaiveBayes:
+    """基于哈希词项和词片段的二分类朴素贝叶斯（特征按出现与否计数）
+
+    特征哈希到固定大小的空间，模型只是两张计数表，训练和预测都只需遍历文章的特征。
+    """
+
+    def __init__(self, feature_bits: int = 18, alpha: float = 1.0):
+        self.mask = (1 << feature_bits) - 1
+        self.alpha = alpha
+        self.class_docs = [0, 0]
+        self.class_totals = [0, 0]
+        self.feature_counts: List[Dict[int, int]] = [{}, {}]
+        self.vocabulary = set()
+
+    def features(self, text: str) -> set:
+        """文章文本的哈希特征集合：词项及相邻两个词项组成的片段"""
+        tokens = tokenize(text)
+        return {zlib.crc32(feature.encode("utf-8")) & self.mask for feature in tokens + shingles(tokens)}
+
+    def fit(self, texts: List[str], labels: List[bool]) -> "HashedNaiveBayes":
+        for text, label in zip(texts, labels):
+            target = int(bool(label))
+            counts = self.feature_counts[target]
+            features = self.features(text)
+            for feature in features:
+                counts[feature] = counts.get(feature, 0) + 1
+            self.vocabulary.update(features)
+            self.class_docs[target] += 1
+            self.class_totals[target] += len(features)
+        return self
+
+    def predict_proba(self, text: str) -> float:
+        """返回保留（True类）的概率"""
+        total_docs = sum(self.class_docs)
+        if not total_docs or not all(self.class_docs):
+            # 只见过一种结论时没有判别能力
+            return self.class_docs[1] / total_docs if total_docs else 0.5
+
+        features = self.features(text)
+        vocabulary_size = len(self.vocabulary) + 1
+        log_probs = []
+        for target in (0, 1):
+            counts = self.feature_counts[target]
+            denominator = math.log(self.class_totals[target] + self.alpha * vocabulary_size)
+            log_prob = math.log(self.class_docs[target] / total_docs)
+            log_prob += sum(math.log(counts.get(feature, 0) + self.alpha) - denominator for feature in features)
+            log_probs.append(log_prob)
+        difference = max(-50.0, min(50.0, log_probs[0] - log_probs[1]))
+        return 1.0 / (1.0 + math.exp(difference))
+
+def _is_holdout(article_id: str, folds: int = 5) -> bool:
+    """按文章ID的哈希固定划分留出集，重新训练时同一篇文章始终在同一侧"""
+    return zlib.crc32(str(article_id).encode("utf-8")) % folds == 0
+
+class VerdictClassifier:
+    """由AI过滤结论训练的本地保留/丢弃分类器
+
+    每个标签集合单独训练一个模型。模型先在留出集上与AI结论比较，
+    只有在留出集上置信丢弃的判断与AI足够一致时，才允许跳过AI直接丢弃文章。
+    保留的文章仍需AI评估，因为邮件排序需要AI给出的重要性等评级。
+    """
+
+    def __init__(self, store: VerdictStore, confidence: float = 0.97, min_samples: int = 200,
+                 min_agreement: float = 0.95, max_samples: int = 2000, retrain_every: int = 50):
+        """初始化分类器
+
+        Args:
+            store: 结论存储
+            confidence: 丢弃概率不低于此值时才跳过AI
+            min_samples: 标签集合至少有这么多条结论时才训练模型
+            min_agreement: 留出集上置信丢弃的判断与AI结论的一致率不低于此值时才启用跳过
+            max_samples: 训练使用的最近结论数，更早的结论会被清理
+            retrain_every: 新增这么多条结论后重新训练
+        """
+        self.store = store
+        self.confidence = float(confidence)
+        self.min_samples = int(min_samples)
+        self.min_agreement = float(min_agreement)
+        self.max_samples = int(max_samples)
+        self.retrain_every = max(1, int(retrain_every))
+        self._models: Dict[str, Tuple[Optional[HashedNaiveBayes], Dict[str, Any]]] = {}
+        self._new_verdicts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, store: VerdictStore, filter_settings: Dict[str, Any]) -> "VerdictClassifier":
+        return cls(
+            store,
+            confidence=filter_settings.get("classifier_confidence", 0.97),
+            min_samples=filter_settings.get("classifier_min_samples", 200),
+            min_agreement=filter_settings.get("classifier_min_agreement", 0.95),
+            max_samples=filter_settings.get("classifier_max_samples", 2000)
+        )
+
+    def _label_key(self, content: Dict[str, Any]) -> str:
+        return label_set_key(content.get("feed_labels", []), content.get("negative_labels", []))
+
+    def record(self, content: Dict[str, Any]):
+        """保存AI对文章的结论"""
+        evaluation = content.get("evaluation", {})
+        if not isinstance(evaluation, dict) or "interest_match" not in evaluation:
+            return
+        label_key = self._label_key(content)
+        self.store.add(
+            label_key,
+            content.get("article_id") or content.get("link", ""),
+            {"feed_labels": content.get("feed_labels", []), "negative_labels": content.get("negative_labels", [])},
+            article_text(content, max_chars=1000),
+            content.get("keep", False),
+            evaluation
+        )
+        with self._lock:
+            self._new_verdicts[label_key] = self._new_verdicts.get(label_key, 0) + 1
+
+    def train(self, label_key: str) -> Tuple[Optional[HashedNaiveBayes], Dict[str, Any]]:
+        """训练标签集合的模型并在留出集上评估
+
+        Returns:
+            (模型, 报告)；结论不足时模型为None
+        """
+        start_time = time.time()
+        self.store.prune(label_key, self.max_samples)
+        samples = self.store.load(label_key, self.max_samples)
+        report: Dict[str, Any] = {"label_key": label_key, "samples": len(samples), "enabled": False}
+        if len(samples) < self.min_samples:
+            return None, report
+
+        train = [sample for sample in samples if not _is_holdout(sample[0])]
+        holdout = [sample for sample in samples if _is_holdout(sample[0])]
+        model = HashedNaiveBayes().fit([text for _, text, _ in train], [keep for _, _, keep in train])
+
+        correct = confident = confident_correct = 0
+        for _, text, keep in holdout:
+            probability = model.predict_proba(text)
+            correct += (probability >= 0.5) == keep
+            if 1.0 - probability >= self.confidence:
+                confident += 1
+                confident_correct += not keep
+        confident_agreement = confident_correct / confident if confident else 0.0
+        report.update({
+            "holdout": len(holdout),
+            "agreement": correct / len(holdout) if holdout else 0.0,
+            "skipped_share": confident / len(holdout) if holdout else 0.0,
+            "skipped_agreement": confident_agreement,
+            "missed_keeps": confident - confident_correct,
+            "enabled": bool(holdout) and confident > 0 and confident_agreement >= self.min_agreement
+        })
+
+        # 评估完成后用全部结论重新训练
+        model = HashedNaiveBayes().fit([text for _, text, _ in samples], [keep for _, _, keep in samples])
+        report["train_seconds"] = time.time() - start_time
+        return model, report
+
+    def _model(self, label_key: str) -> Tuple[Optional[HashedNaiveBayes], Dict[str, Any]]:
+        with self._lock:
+            cached = self._models.get(label_key)
+            if cached is not None and self._new_verdicts.get(label_key, 0) < self.retrain_every:
+                return cached
+            self._new_verdicts[label_key] = 0
+            model, report = self.train(label_key)
+            self._models[label_key] = (model, report)
+        if model is not None:
+            logger.info(self.format_report(report))
+        return model, report
+
+    def should_discard(self, content: Dict[str, Any]) -> Optional[float]:
+        """判断是否可以不经AI直接丢弃文章
+
+        Returns:
+            可以置信丢弃时返回丢弃概率，否则返回None
+        """
+        model, report = self._model(self._label_key(content))
+        if model is None or not report.get("enabled"):
+            return None
+        discard_probability = 1.0 - model.predict_proba(article_text(content, max_chars=1000))
+        return discard_probability if discard_probability >= self.confidence else None
+
+    def format_report(self, report: Dict[str, Any]) -> str:
+        """将留出集报告格式化为日志文本"""
+        if "holdout" not in report:
+            return f"本地分类器: 标签集合 {report['label_key'][:8]} 只有 {report['samples']} 条结论，未训练"
+        return (f"本地分类器: 标签集合 {report['label_key'][:8]}, 结论 {report['samples']} 条, 留出集 {report['holdout']} 条, "
+                f"整体一致率 {report['agreement']:.1%}, 可跳过AI {report['skipped_share']:.1%}, "
+                f"跳过部分一致率 {report['skipped_agreement']:.1%} (误丢弃 {report['missed_keeps']} 条), "
+                f"{'已启用' if report['enabled'] else '未启用'}跳过, 训练耗时 {report.get('train_seconds', 0):.2f}秒")
+
+    def agreement_report(self) -> List[Dict[str, Any]]:
+        """为存储中的每个标签集合训练模型并返回留出集报告"""
+        reports = []
+        for label_key, labels, _ in self.store.label_sets():
+            _, report = self.train(label_key)
+            report.update(labels)
+            reports.append(report)
+        return reports
@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import threading
+import logging
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+class SQLiteConnectionManager:
+    """
+    Hands out one long-lived SQLite connection per thread for a database file.
+
+    Connections run in WAL mode so readers (GUI, unsubscribe handler) no longer
+    block the scheduler's writes, and each connection keeps its own cache of
+    compiled statements, so repeated queries skip the prepare step.
+    """
+
+    def __init__(self, db_path, busy_timeout_ms=5000, cache_size_kb=8192, cached_statements=256):
+        """
+        Args:
+            db_path (str): Path to the SQLite database
+            busy_timeout_ms (int): How long a connection waits for a lock before failing
+            cache_size_kb (int): Page cache size per connection, in KiB
+            cached_statements (int): Number of compiled statements kept per connection
+        """
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kb = cache_size_kb
+        self.cached_statements = cached_statements
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._generation = 0
+        # thread ident -> (thread, connection), used to close connections of finished threads
+        self._connections: Dict[int, Tuple[threading.Thread, sqlite3.Connection]] = {}
+
+    def get_connection(self):
+        """
+        Get the connection of the calling thread, opening it on first use.
+
+        Returns:
+            sqlite3.Connection: Connection owned by the calling thread
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.generation == self._generation:
+            return conn
+
+        conn = self._open()
+        with self._lock:
+            self._close_finished_threads()
+            ident = threading.get_ident()
+            previous = self._connections.pop(ident, None)
+            if previous is not None and previous[1] is not conn:
+                previous[1].close()
+            self._connections[ident] = (threading.current_thread(), conn)
+            self._local.generation = self._generation
+        self._local.conn = conn
+        return conn
+
+    def _open(self):
+        """Open a connection and apply the performance pragmas."""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,  # Only used by its owning thread, but closed from close_all()
+            cached_statements=self.cached_statements
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        logger.debug(f"Opened SQLite connection to {self.db_path} for thread {threading.current_thread().name}")
+        return conn
+
+    def _close_finished_threads(self):
+        """Close connections whose owning thread has exited (caller holds the lock)."""
+        for ident, (thread, conn) in list(self._connections.items()):
+            if not thread.is_alive():
+                conn.close()
+                del self._connections[ident]
+
+    def close_all(self):
+        """Close every connection. Threads transparently reconnect on their next query."""
+        with self._lock:
+            for _, conn in self._connections.values():
+                try:
+                    conn.close()
+                except Exception as e:
+                    logger.warning(f"Error closing SQLite connection: {e}")
+            self._connections.clear()
+            self._generation += 1
+
+_managers: Dict[str, SQLiteConnectionManager] = {}
+_managers_lock = threading.Lock()
+
+def get_connection_manager(db_path):
+    """
+    Get the shared connection manager of a database file.
+
+    Args:
+        db_path (str): Path to the SQLite database
+
+    Returns:
+        SQLiteConnectionManager: Manager shared by every caller using the same file
+    """
+    key = os.path.abspath(db_path)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = SQLiteConnectionManager(db_path)
+            _managers[key] = manager
+        return manager
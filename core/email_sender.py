@@ -320,6 +320,8 @@ class EmailSender:
             .news-item .content { margin: 10px 0; }
             .news-item .link { text-decoration: none; color: #3498db; font-weight: bold; }
             .news-item .link:hover { text-decoration: underline; }
+            .news-item .duplicates { font-size: 12px; color: #7f8c8d; margin-top: 6px; }
+            .news-item .duplicates a { color: #3498db; text-decoration: none; }
             .footer { text-align: center; font-size: 12px; color: #7f8c8d; margin-top: 30px; padding: 10px; border-top: 1px solid #eee; }
             .footer a { color: #3498db; text-decoration: none; } /* Style for unsubscribe link */
             .footer a:hover { text-decoration: underline; } /* Hover style for unsubscribe link */
@@ -408,6 +410,16 @@ class EmailSender:
             for tag in tags:
                 categories_html += f'<span class="category">{tag}</span>'
             
+            # 近似重复合并后，列出转载同一新闻的其他来源
+            duplicates_html = ""
+            duplicate_sources = content.get("duplicate_sources", [])
+            if duplicate_sources:
+                duplicate_links = ", ".join(
+                    f'<a href="{dup.get("link", "#")}" target="_blank">{dup.get("source") or dup.get("title") or dup.get("link")}</a>'
+                    for dup in duplicate_sources
+                )
+                duplicates_html = f'<div class="duplicates">{get_text("also_reported_by")}: {duplicate_links}</div>'
+            
             html += f"""
             <div class="news-item">
                 <h3>{title} {categories_html}</h3>
@@ -418,6 +430,7 @@ class EmailSender:
                 </div>
                 <div class="content">{news_brief}</div>
                 <a href="{link}" class="link" target="_blank">{get_text("read_original")}</a>
+                {duplicates_html}
             </div>
             """
         
@@ -0,0 +1,91 @@
+import logging
+from typing import Dict, Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger("http_client")
+
+# urllib3 会根据已安装的解压库（brotli / zstandard）自动扩展支持的编码
+ACCEPT_ENCODING = make_headers(accept_encoding=True)["accept-encoding"]
+
+FEED_ACCEPT_HEADER = ("application/rss+xml, application/atom+xml, application/rdf+xml, "
+                      "application/xml;q=0.9, text/xml;q=0.9, text/html;q=0.5, */*;q=0.1")
+
+class HttpClient:
+    """共享的HTTP传输层，为Feed下载提供连接池、压缩和统一的超时设置"""
+
+    def __init__(self, user_agent: str = "NeuroFeed RSS Reader/1.0", pool_size: int = 8,
+                 connect_timeout: float = 10, read_timeout: float = 30, max_retries: int = 2):
+        """初始化HTTP客户端
+
+        Args:
+            user_agent: 请求头中的User-Agent字段
+            pool_size: 每个主机保持的最大连接数，应与获取并发数一致
+            connect_timeout: 建立连接的超时时间（秒）
+            read_timeout: 读取响应的超时时间（秒）
+            max_retries: 连接错误或网关错误时的重试次数
+        """
+        self.pool_size = max(1, int(pool_size))
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,  # 读取超时不重试，避免慢速Feed拖长整个任务
+            backoff_factor=0.5,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=["GET", "HEAD"],
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=max(10, self.pool_size * 4),  # 缓存的主机连接池数量
+            pool_maxsize=self.pool_size,
+            max_retries=retry
+        )
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "User-Agent": user_agent,
+            "Accept-Encoding": ACCEPT_ENCODING,
+            "Accept": FEED_ACCEPT_HEADER
+        })
+        logger.debug(f"HTTP客户端已初始化: 连接池大小={self.pool_size}, 超时={self.timeout}, 编码={ACCEPT_ENCODING}")
+
+    @classmethod
+    def from_settings(cls, fetch_settings: Dict[str, Any], user_agent: str = "NeuroFeed RSS Reader/1.0") -> "HttpClient":
+        """根据 fetch_settings 创建HTTP客户端"""
+        return cls(
+            user_agent=user_agent,
+            pool_size=fetch_settings.get("max_workers", 8),
+            connect_timeout=fetch_settings.get("connect_timeout", 10),
+            read_timeout=fetch_settings.get("read_timeout", 30)
+        )
+
+    def matches_settings(self, fetch_settings: Dict[str, Any]) -> bool:
+        """连接池大小和超时是否与 fetch_settings 一致"""
+        pool_size = max(1, int(fetch_settings.get("max_workers", 8)))
+        timeout = (fetch_settings.get("connect_timeout", 10), fetch_settings.get("read_timeout", 30))
+        return (self.pool_size, self.timeout) == (pool_size, timeout)
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None, **kwargs) -> requests.Response:
+        """通过共享会话发送GET请求
+
+        Args:
+            url: 请求的URL
+            headers: 额外的请求头（如条件请求头）
+            **kwargs: 传递给 requests 的其他参数，未指定 timeout 时使用默认超时
+
+        Returns:
+            requests.Response 对象
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(url, headers=headers, **kwargs)
+
+    def close(self):
+        """关闭会话并释放连接池"""
+        self.session.close()
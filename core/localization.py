@@ -61,6 +61,7 @@ _translations = {
         "source": "Source",
         "publish_time": "Published",
         "read_original": "Read Original",
+        "also_reported_by": "Also reported by",
         "digest_footer": """This email was automatically generated by NeuroFeed.
 News content is summarized from original sources. The opinions and views expressed in the content do not represent those of NeuroFeed.
 For the full article, please click the "Read Original" link.""",
@@ -397,6 +398,7 @@ For the full article, please click the "Read Original" link.""",
         "source": "来源",
         "publish_time": "发布时间",
         "read_original": "阅读原文",
+        "also_reported_by": "其他来源",
         "digest_footer": """此邮件由NeuroFeed AI总结生成。
 新闻内容均总结自原文，观点和立场不代表NeuroFeed。
 如需阅读完整文章，请点击"阅读原文"链接。""",
@@ -1,37 +1,24 @@
-import sqlite3
 import os
 import datetime
 import re
+import time
 from pathlib import Path
 from core.config_manager import get_general_settings  # Add this import
+from core.db_connection import get_connection_manager
 
-class NewsDBManager:
-    def __init__(self, db_path=None):
-        """
-        Initialize the database manager for storing news articles.
-        
-        Args:
-            db_path (str, optional): Path to the SQLite database. 
-                                    Defaults to data/rss_news.db in the project directory.
-        """
-        if db_path is None:
-            # Use the default path
-            base_dir = Path(__file__).parent.parent
-            db_path = os.path.join(base_dir, 'data', 'rss_news.db')
-            
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        
-        self.db_path = db_path
-        self._create_tables()
-    
-    def _create_tables(self):
-        """Create the necessary tables if they don't exist."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create table to store news articles
-        cursor.execute('''
+def _add_column(cursor, table, column, definition):
+    """Add a column unless it already exists (ALTER TABLE has no IF NOT EXISTS)."""
+    columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
+    if column not in columns:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+# Schema migrations keyed on PRAGMA user_version, applied in order.
+# Each entry is (version, description, list of SQL statements or a callable taking a cursor).
+# Databases created before versioning report version 0; the early steps use IF NOT EXISTS
+# so they upgrade in place. Never edit a released step, append a new one instead.
+SCHEMA_MIGRATIONS = [
+    (1, "base tables", [
+        '''
         CREATE TABLE IF NOT EXISTS news_articles (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             article_id TEXT UNIQUE,  -- Unique identifier for the article (e.g., URL or guid)
@@ -43,10 +30,9 @@ class NewsDBManager:
             content_hash TEXT,       -- Hash of content to check for duplicates
             processed INTEGER DEFAULT 0  -- Flag to mark if article was processed
         )
-        ''')
-        
-        # New table to track discarded articles per task
-        cursor.execute('''
+        ''',
+        # Track discarded articles per task
+        '''
         CREATE TABLE IF NOT EXISTS discarded_articles (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             article_id TEXT,
@@ -54,10 +40,9 @@ class NewsDBManager:
             discarded_date TEXT,
             UNIQUE(article_id, task_id)
         )
-        ''')
-        
-        # Updated table to track sent articles per recipient and task
-        cursor.execute('''
+        ''',
+        # Track sent articles per recipient and task
+        '''
         CREATE TABLE IF NOT EXISTS sent_articles (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             article_id TEXT,
@@ -66,10 +51,145 @@ class NewsDBManager:
             sent_date TEXT,
             UNIQUE(article_id, recipient, task_id)
         )
-        ''')
+        '''
+    ]),
+    (2, "conditional request cache", [
+        # HTTP validators for conditional feed requests per feed and task
+        '''
+        CREATE TABLE IF NOT EXISTS feed_fetch_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            feed_url TEXT,
+            task_id TEXT,            -- Empty string when the feed is fetched outside a task
+            etag TEXT,
+            last_modified TEXT,
+            fingerprint TEXT,        -- Hash of the feed response, used when the server ignores validators
+            updated_date TEXT,
+            UNIQUE(feed_url, task_id)
+        )
+        '''
+    ]),
+    (3, "secondary indexes", [
+        # Per-task lookups (is_article_*_for_task, get_processed_article_ids_for_task).
+        # Lookups by (article_id, recipient) are already served by the UNIQUE index of sent_articles.
+        "CREATE INDEX IF NOT EXISTS idx_sent_articles_task_article ON sent_articles(task_id, article_id)",
+        "CREATE INDEX IF NOT EXISTS idx_discarded_articles_task_article ON discarded_articles(task_id, article_id)",
+        # Range deletes in clean_old_articles
+        "CREATE INDEX IF NOT EXISTS idx_news_articles_retrieved_date ON news_articles(retrieved_date)",
+        "CREATE INDEX IF NOT EXISTS idx_discarded_articles_discarded_date ON discarded_articles(discarded_date)",
+        "CREATE INDEX IF NOT EXISTS idx_sent_articles_sent_date ON sent_articles(sent_date)"
+    ]),
+    (4, "discard reasons", lambda cursor: _add_column(cursor, "discarded_articles", "reason", "TEXT")),
+    (5, "task run metrics", [
+        # AI call accounting per task run, one row per call purpose, provider and model
+        '''
+        CREATE TABLE IF NOT EXISTS task_run_metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id TEXT,
+            run_started TEXT,
+            run_finished TEXT,
+            purpose TEXT,            -- e.g. evaluate, correct, summarize, title
+            provider TEXT,
+            model TEXT,
+            calls INTEGER,
+            failed_calls INTEGER,
+            cache_hits INTEGER,      -- Calls answered from the evaluation or summary cache
+            retries INTEGER,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            estimated_calls INTEGER, -- Calls whose token counts were estimated locally
+            total_latency REAL       -- Seconds, including retries
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_task_run_metrics_task_started ON task_run_metrics(task_id, run_started)"
+    ]),
+]
+
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+class NewsDBManager:
+    def __init__(self, db_path=None):
+        """
+        Initialize the database manager for storing news articles.
         
-        conn.commit()
-        conn.close()
+        Args:
+            db_path (str, optional): Path to the SQLite database. 
+                                    Defaults to data/rss_news.db in the project directory.
+        """
+        if db_path is None:
+            # Use the default path
+            base_dir = Path(__file__).parent.parent
+            db_path = os.path.join(base_dir, 'data', 'rss_news.db')
+            
+        # Ensure directory exists
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        
+        self.db_path = db_path
+        # Long-lived per-thread connections (WAL mode) shared by every manager of this file
+        self._connections = get_connection_manager(db_path)
+        self._create_tables()
+    
+    def _get_connection(self):
+        """Get the calling thread's cached connection to the database."""
+        return self._connections.get_connection()
+    
+    def close(self):
+        """Close all cached connections to the database."""
+        self._connections.close_all()
+    
+    def _create_tables(self):
+        """Create or upgrade the schema by applying pending migrations."""
+        self.apply_migrations()
+    
+    def get_schema_version(self):
+        """
+        Get the schema version of the database (stored in PRAGMA user_version).
+        
+        Returns:
+            int: Current schema version, 0 for a database created before migrations existed
+        """
+        conn = self._get_connection()
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    
+    def apply_migrations(self):
+        """
+        Bring the schema up to date by applying every migration newer than PRAGMA user_version.
+        Each migration runs in its own transaction together with the version bump,
+        so an interrupted upgrade is retried from the last completed step.
+        
+        Returns:
+            int: Schema version after the upgrade
+        """
+        conn = self._get_connection()
+        current_version = self.get_schema_version()
+        
+        for version, description, migration in SCHEMA_MIGRATIONS:
+            if version <= current_version:
+                continue
+            
+            start_time = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process may have applied this step while we waited for the lock
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                    conn.rollback()
+                    continue
+                
+                cursor = conn.cursor()
+                if callable(migration):
+                    migration(cursor)
+                else:
+                    for statement in migration:
+                        cursor.execute(statement)
+                cursor.execute(f"PRAGMA user_version = {int(version)}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            
+            current_version = version
+            print(f"Database schema migrated to version {version} ({description}) in {time.time() - start_time:.2f}s")
+        
+        return current_version
     
     def normalize_article_id(self, article_id):
         """
@@ -151,32 +271,80 @@ class NewsDBManager:
             # 规范化article_id
             article_id = self.normalize_article_id(article_id)
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                
+                # Check if article already exists
+                cursor.execute("SELECT id FROM news_articles WHERE article_id = ?", (article_id,))
+                if cursor.fetchone():
+                    return False  # Article already exists
+                
+                # Get current date in ISO format
+                now = datetime.datetime.now().isoformat()
+                
+                # Insert the article
+                cursor.execute('''
+                INSERT INTO news_articles 
+                (article_id, title, link, source, published_date, retrieved_date, content_hash, processed)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+                ''', (article_id, title, link, source, published_date, now, content_hash))
             
-            # Check if article already exists
-            cursor.execute("SELECT id FROM news_articles WHERE article_id = ?", (article_id,))
-            if cursor.fetchone():
-                conn.close()
-                return False  # Article already exists
-            
-            # Get current date in ISO format
-            now = datetime.datetime.now().isoformat()
-            
-            # Insert the article
-            cursor.execute('''
-            INSERT INTO news_articles 
-            (article_id, title, link, source, published_date, retrieved_date, content_hash, processed)
-            VALUES (?, ?, ?, ?, ?, ?, ?, 0)
-            ''', (article_id, title, link, source, published_date, now, content_hash))
-            
-            conn.commit()
-            conn.close()
             return True
         except Exception as e:
             print(f"Error adding article to database: {e}")
             return False
     
+    def add_news_articles(self, articles):
+        """
+        Add a batch of news articles to the database in a single transaction.
+        
+        Args:
+            articles (list): Dictionaries with the keys accepted by add_news_article
+                             (article_id, title, link, source, published_date, content_hash)
+        
+        Returns:
+            list: Normalized IDs of the articles that were newly added, in input order
+        """
+        records = {}
+        for article in articles:
+            article_id = self.normalize_article_id(article.get("article_id"))
+            if article_id and article_id not in records:
+                records[article_id] = article
+        if not records:
+            return []
+        
+        try:
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                
+                # Find which articles already exist before inserting
+                article_ids = list(records)
+                existing_ids = set()
+                chunk_size = 500
+                for start in range(0, len(article_ids), chunk_size):
+                    chunk = article_ids[start:start + chunk_size]
+                    placeholders = ", ".join("?" * len(chunk))
+                    cursor.execute(f"SELECT article_id FROM news_articles WHERE article_id IN ({placeholders})", chunk)
+                    existing_ids.update(row[0] for row in cursor.fetchall())
+                
+                now = datetime.datetime.now().isoformat()
+                cursor.executemany('''
+                INSERT OR IGNORE INTO news_articles 
+                (article_id, title, link, source, published_date, retrieved_date, content_hash, processed)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+                ''', [
+                    (article_id, article.get("title"), article.get("link"), article.get("source"),
+                     article.get("published_date"), now, article.get("content_hash"))
+                    for article_id, article in records.items() if article_id not in existing_ids
+                ])
+            
+            return [article_id for article_id in article_ids if article_id not in existing_ids]
+        except Exception as e:
+            print(f"Error adding articles to database in batch: {e}")
+            return []
+    
     def clean_old_articles(self, days=None):
         """
         Remove articles older than specified number of days.
@@ -194,22 +362,21 @@ class NewsDBManager:
                 general_settings = get_general_settings()
                 days = general_settings.get("db_retention_days", 30)  # Default to 30 days if not set
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Calculate cutoff date - 修复timedelta错误
-            cutoff_date = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat()
-            
-            # Delete old articles
-            cursor.execute("DELETE FROM news_articles WHERE retrieved_date < ?", (cutoff_date,))
-            deleted_count = cursor.rowcount
-            
-            # Also clean up the discarded and sent articles tables
-            cursor.execute("DELETE FROM discarded_articles WHERE discarded_date < ?", (cutoff_date,))
-            cursor.execute("DELETE FROM sent_articles WHERE sent_date < ?", (cutoff_date,))
-            
-            conn.commit()
-            conn.close()
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                
+                # Calculate cutoff date - 修复timedelta错误
+                cutoff_date = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat()
+                
+                # Delete old articles
+                cursor.execute("DELETE FROM news_articles WHERE retrieved_date < ?", (cutoff_date,))
+                deleted_count = cursor.rowcount
+                
+                # Also clean up the discarded and sent articles tables
+                cursor.execute("DELETE FROM discarded_articles WHERE discarded_date < ?", (cutoff_date,))
+                cursor.execute("DELETE FROM sent_articles WHERE sent_date < ?", (cutoff_date,))
+                cursor.execute("DELETE FROM task_run_metrics WHERE run_started < ?", (cutoff_date,))
             
             return deleted_count
         except Exception as e:
@@ -229,13 +396,13 @@ class NewsDBManager:
         # 规范化article_id
         article_id = self.normalize_article_id(article_id)
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT id FROM news_articles WHERE article_id = ?", (article_id,))
-        result = cursor.fetchone() is not None
+        conn = self._get_connection()
+        with conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT id FROM news_articles WHERE article_id = ?", (article_id,))
+            result = cursor.fetchone() is not None
         
-        conn.close()
         return result
     
     def mark_as_processed(self, article_id):
@@ -252,21 +419,19 @@ class NewsDBManager:
             # 规范化article_id
             article_id = self.normalize_article_id(article_id)
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # 检查文章是否存在
-            cursor.execute("SELECT id FROM news_articles WHERE article_id = ?", (article_id,))
-            if not cursor.fetchone():
-                print(f"Warning: Trying to mark non-existent article as processed: {article_id}")
-                conn.close()
-                return False
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
                 
-            cursor.execute("UPDATE news_articles SET processed = 1 WHERE article_id = ?", (article_id,))
-            result = cursor.rowcount > 0
+                # 检查文章是否存在
+                cursor.execute("SELECT id FROM news_articles WHERE article_id = ?", (article_id,))
+                if not cursor.fetchone():
+                    print(f"Warning: Trying to mark non-existent article as processed: {article_id}")
+                    return False
+                    
+                cursor.execute("UPDATE news_articles SET processed = 1 WHERE article_id = ?", (article_id,))
+                result = cursor.rowcount > 0
             
-            conn.commit()
-            conn.close()
             return result
         except Exception as e:
             print(f"Error marking article as processed: {e}")
@@ -286,13 +451,12 @@ class NewsDBManager:
             # 规范化article_id
             article_id = self.normalize_article_id(article_id)
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT processed FROM news_articles WHERE article_id = ?", (article_id,))
-            result = cursor.fetchone()
-            
-            conn.close()
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("SELECT processed FROM news_articles WHERE article_id = ?", (article_id,))
+                result = cursor.fetchone()
             
             # If the article exists and processed = 1
             processed = result is not None and result[0] == 1
@@ -309,13 +473,12 @@ class NewsDBManager:
             list: List of processed article IDs
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT article_id FROM news_articles WHERE processed = 1")
-            results = cursor.fetchall()
-            
-            conn.close()
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("SELECT article_id FROM news_articles WHERE processed = 1")
+                results = cursor.fetchall()
             
             # Return list of article_ids
             return [row[0] for row in results]
@@ -324,13 +487,15 @@ class NewsDBManager:
             return []
         
     # New methods for task-specific article tracking
-    def mark_as_discarded_for_task(self, article_id, task_id):
+    def mark_as_discarded_for_task(self, article_id, task_id, reason=None):
         """
         Mark an article as discarded for a specific task.
         
         Args:
             article_id (str): Unique identifier for the article
             task_id (str): ID of the task that discarded the article
+            reason (str, optional): Why the article was discarded, e.g. "ai_evaluation"
+                or a lexical prefilter reason
             
         Returns:
             bool: True if successful, False otherwise
@@ -339,19 +504,18 @@ class NewsDBManager:
             # 规范化article_id
             article_id = self.normalize_article_id(article_id)
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            now = datetime.datetime.now().isoformat()
-            
-            # Insert or replace (in case it was already marked)
-            cursor.execute('''
-            INSERT OR REPLACE INTO discarded_articles (article_id, task_id, discarded_date)
-            VALUES (?, ?, ?)
-            ''', (article_id, task_id, now))
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                
+                now = datetime.datetime.now().isoformat()
+                
+                # Insert or replace (in case it was already marked)
+                cursor.execute('''
+                INSERT OR REPLACE INTO discarded_articles (article_id, task_id, discarded_date, reason)
+                VALUES (?, ?, ?, ?)
+                ''', (article_id, task_id, now, reason))
             
-            conn.commit()
-            conn.close()
             return True
         except Exception as e:
             print(f"Error marking article as discarded for task: {e}")
@@ -372,17 +536,17 @@ class NewsDBManager:
             # 规范化article_id
             article_id = self.normalize_article_id(article_id)
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-            SELECT id FROM discarded_articles 
-            WHERE article_id = ? AND task_id = ?
-            ''', (article_id, task_id))
-            
-            result = cursor.fetchone() is not None
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                SELECT id FROM discarded_articles 
+                WHERE article_id = ? AND task_id = ?
+                ''', (article_id, task_id))
+                
+                result = cursor.fetchone() is not None
             
-            conn.close()
             return result
         except Exception as e:
             print(f"Error checking if article was discarded for task: {e}")
@@ -405,19 +569,18 @@ class NewsDBManager:
             # 规范化article_id
             article_id = self.normalize_article_id(article_id)
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            now = datetime.datetime.now().isoformat()
-            
-            # Insert or replace (in case it was already marked)
-            cursor.execute('''
-            INSERT OR REPLACE INTO sent_articles (article_id, recipient, task_id, sent_date)
-            VALUES (?, ?, ?, ?)
-            ''', (article_id, recipient, task_id, now))
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                
+                now = datetime.datetime.now().isoformat()
+                
+                # Insert or replace (in case it was already marked)
+                cursor.execute('''
+                INSERT OR REPLACE INTO sent_articles (article_id, recipient, task_id, sent_date)
+                VALUES (?, ?, ?, ?)
+                ''', (article_id, recipient, task_id, now))
             
-            conn.commit()
-            conn.close()
             return True
         except Exception as e:
             print(f"Error marking article as sent to recipient for task {task_id}: {e}")
@@ -438,17 +601,17 @@ class NewsDBManager:
             # 规范化article_id
             article_id = self.normalize_article_id(article_id)
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-            SELECT id FROM sent_articles 
-            WHERE article_id = ? AND recipient = ?
-            ''', (article_id, recipient))
-            
-            result = cursor.fetchone() is not None
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                SELECT id FROM sent_articles 
+                WHERE article_id = ? AND recipient = ?
+                ''', (article_id, recipient))
+                
+                result = cursor.fetchone() is not None
             
-            conn.close()
             return result
         except Exception as e:
             print(f"Error checking if article was sent to recipient: {e}")
@@ -470,23 +633,95 @@ class NewsDBManager:
             # 规范化article_id
             article_id = self.normalize_article_id(article_id)
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-            SELECT id FROM sent_articles 
-            WHERE article_id = ? AND task_id = ?
-            LIMIT 1
-            ''', (article_id, task_id))
-            
-            result = cursor.fetchone() is not None
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                SELECT id FROM sent_articles 
+                WHERE article_id = ? AND task_id = ?
+                LIMIT 1
+                ''', (article_id, task_id))
+                
+                result = cursor.fetchone() is not None
             
-            conn.close()
             return result
         except Exception as e:
             print(f"Error checking if article was sent for task {task_id}: {e}")
             return False
     
+    def get_processed_article_ids_for_task(self, task_id):
+        """
+        Load the IDs of all articles that were discarded or sent for a task.
+        Lets callers check many articles against in-memory sets instead of
+        querying the database once per article.
+        
+        Args:
+            task_id (str): ID of the task
+            
+        Returns:
+            tuple: (set of discarded article IDs, set of sent article IDs)
+        """
+        try:
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("SELECT article_id FROM discarded_articles WHERE task_id = ?", (task_id,))
+                discarded_ids = {row[0] for row in cursor.fetchall()}
+                
+                cursor.execute("SELECT DISTINCT article_id FROM sent_articles WHERE task_id = ?", (task_id,))
+                sent_ids = {row[0] for row in cursor.fetchall()}
+            
+            return discarded_ids, sent_ids
+        except Exception as e:
+            print(f"Error loading processed articles for task {task_id}: {e}")
+            return set(), set()
+    
+    def get_processed_articles_in_batch(self, article_ids, task_id):
+        """
+        Check a batch of articles against the discarded and sent tables of a task.
+        
+        Args:
+            article_ids (list): Article identifiers to check
+            task_id (str): ID of the task
+            
+        Returns:
+            tuple: (set of discarded article IDs, set of sent article IDs), using normalized IDs
+        """
+        normalized_ids = list({self.normalize_article_id(article_id) for article_id in article_ids})
+        discarded_ids, sent_ids = set(), set()
+        if not normalized_ids:
+            return discarded_ids, sent_ids
+        
+        try:
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                
+                # Stay well below SQLite's limit on bound parameters per statement
+                chunk_size = 500
+                for start in range(0, len(normalized_ids), chunk_size):
+                    chunk = normalized_ids[start:start + chunk_size]
+                    placeholders = ", ".join("?" * len(chunk))
+                    
+                    cursor.execute(f'''
+                    SELECT article_id FROM discarded_articles
+                    WHERE task_id = ? AND article_id IN ({placeholders})
+                    ''', (task_id, *chunk))
+                    discarded_ids.update(row[0] for row in cursor.fetchall())
+                    
+                    cursor.execute(f'''
+                    SELECT DISTINCT article_id FROM sent_articles
+                    WHERE task_id = ? AND article_id IN ({placeholders})
+                    ''', (task_id, *chunk))
+                    sent_ids.update(row[0] for row in cursor.fetchall())
+            
+            return discarded_ids, sent_ids
+        except Exception as e:
+            print(f"Error checking processed articles in batch for task {task_id}: {e}")
+            return set(), set()
+    
     def is_article_sent_to_all_recipients(self, article_id, recipients):
         """
         Check if an article was sent to all specified recipients.
@@ -506,6 +741,167 @@ class NewsDBManager:
                 return False
         return True
     
+    # Methods for conditional feed requests (ETag / Last-Modified)
+    def get_feed_cache(self, feed_url, task_id=None):
+        """
+        Get the stored HTTP validators of a feed for a specific task.
+        
+        Args:
+            feed_url (str): URL of the feed
+            task_id (str, optional): ID of the task fetching the feed
+            
+        Returns:
+            dict: Dictionary with etag, last_modified and fingerprint, or None if nothing is stored
+        """
+        try:
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                SELECT etag, last_modified, fingerprint FROM feed_fetch_cache
+                WHERE feed_url = ? AND task_id = ?
+                ''', (feed_url, task_id or ""))
+                row = cursor.fetchone()
+            
+            if row is None:
+                return None
+            return {"etag": row[0], "last_modified": row[1], "fingerprint": row[2]}
+        except Exception as e:
+            print(f"Error getting feed cache for {feed_url}: {e}")
+            return None
+    
+    def update_feed_cache(self, feed_url, task_id=None, etag=None, last_modified=None, fingerprint=None):
+        """
+        Store the HTTP validators of a feed for a specific task.
+        Passing no validators resets the entry, so the next request downloads the full feed.
+        
+        Args:
+            feed_url (str): URL of the feed
+            task_id (str, optional): ID of the task fetching the feed
+            etag (str, optional): ETag header returned by the server
+            last_modified (str, optional): Last-Modified header returned by the server
+            fingerprint (str, optional): Hash of the feed response
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                
+                now = datetime.datetime.now().isoformat()
+                
+                cursor.execute('''
+                INSERT OR REPLACE INTO feed_fetch_cache (feed_url, task_id, etag, last_modified, fingerprint, updated_date)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ''', (feed_url, task_id or "", etag, last_modified, fingerprint, now))
+            
+            return True
+        except Exception as e:
+            print(f"Error updating feed cache for {feed_url}: {e}")
+            return False
+    
+    def clear_feed_cache(self, task_id=None):
+        """
+        Remove stored HTTP validators, forcing full downloads on the next run.
+        
+        Args:
+            task_id (str, optional): Only clear validators of this task. Clears everything if None.
+            
+        Returns:
+            int: Number of entries removed
+        """
+        try:
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                
+                if task_id is None:
+                    cursor.execute("DELETE FROM feed_fetch_cache")
+                else:
+                    cursor.execute("DELETE FROM feed_fetch_cache WHERE task_id = ?", (task_id,))
+                removed = cursor.rowcount
+            
+            return removed
+        except Exception as e:
+            print(f"Error clearing feed cache: {e}")
+            return 0
+    
+    # Methods for AI call accounting per task run
+    def save_run_metrics(self, task_id, run_started, run_finished, breakdown):
+        """
+        Store the AI call breakdown of a task run.
+        
+        Args:
+            task_id (str): ID of the task
+            run_started (str): ISO timestamp of the run start
+            run_finished (str): ISO timestamp of the run end
+            breakdown (list): Dicts with purpose, provider, model, calls, failed_calls, cache_hits,
+                              retries, prompt_tokens, completion_tokens, estimated_calls and total_latency
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                INSERT INTO task_run_metrics (task_id, run_started, run_finished, purpose, provider, model, calls,
+                    failed_calls, cache_hits, retries, prompt_tokens, completion_tokens, estimated_calls, total_latency)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', [(task_id, run_started, run_finished, row["purpose"], row["provider"], row["model"], row["calls"],
+                       row["failed_calls"], row["cache_hits"], row["retries"], row["prompt_tokens"],
+                       row["completion_tokens"], row["estimated_calls"], row["total_latency"]) for row in breakdown])
+            return True
+        except Exception as e:
+            print(f"Error saving run metrics for task {task_id}: {e}")
+            return False
+    
+    def get_run_metrics(self, task_id=None, limit=10):
+        """
+        Get the AI call breakdowns of the most recent task runs.
+        
+        Args:
+            task_id (str, optional): Only return runs of this task
+            limit (int): Maximum number of runs to return
+            
+        Returns:
+            list: One dict per run (newest first) with task_id, run_started, run_finished and rows,
+                  the per-purpose breakdown
+        """
+        try:
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                condition = "WHERE task_id = ?" if task_id is not None else ""
+                params = (task_id,) if task_id is not None else ()
+                cursor.execute(f'''
+                SELECT task_id, run_started, run_finished, purpose, provider, model, calls, failed_calls, cache_hits,
+                    retries, prompt_tokens, completion_tokens, estimated_calls, total_latency
+                FROM task_run_metrics
+                WHERE (task_id, run_started) IN (
+                    SELECT DISTINCT task_id, run_started FROM task_run_metrics {condition}
+                    ORDER BY run_started DESC LIMIT ?
+                )
+                ORDER BY run_started DESC, total_latency DESC
+                ''', params + (limit,))
+                rows = cursor.fetchall()
+            
+            runs = {}
+            fields = ["purpose", "provider", "model", "calls", "failed_calls", "cache_hits", "retries",
+                      "prompt_tokens", "completion_tokens", "estimated_calls", "total_latency"]
+            for row in rows:
+                run = runs.setdefault((row[0], row[1]), {"task_id": row[0], "run_started": row[1],
+                                                         "run_finished": row[2], "rows": []})
+                run["rows"].append(dict(zip(fields, row[3:])))
+            return list(runs.values())
+        except Exception as e:
+            print(f"Error getting run metrics: {e}")
+            return []
+    
     def migrate_normalize_article_ids(self):
         """
         迁移数据库中的所有article_id到规范化格式
@@ -515,76 +911,74 @@ class NewsDBManager:
             dict: 包含迁移统计信息的字典
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            stats = {
-                'news_articles': 0,
-                'discarded_articles': 0,
-                'sent_articles': 0,
-                'duplicates_removed': 0,
-                'errors': 0
-            }
-            
-            # 处理主文章表
-            cursor.execute("SELECT id, article_id FROM news_articles")
-            articles = cursor.fetchall()
-            for id, article_id in articles:
-                normalized_id = self.normalize_article_id(article_id)
-                if (normalized_id != article_id):
-                    try:
-                        # 检查规范化后的ID是否已存在
-                        cursor.execute("SELECT id FROM news_articles WHERE article_id = ?", (normalized_id,))
-                        existing = cursor.fetchone()
-                        
-                        if existing:
-                            # 如果已存在规范化的ID，则合并记录并删除当前记录
-                            # 将旧记录的processed状态转移到新记录
-                            cursor.execute("SELECT processed FROM news_articles WHERE id = ?", (id,))
-                            is_processed = cursor.fetchone()[0]
-                            if is_processed:
-                                cursor.execute("UPDATE news_articles SET processed = 1 WHERE article_id = ?", (normalized_id,))
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                stats = {
+                    'news_articles': 0,
+                    'discarded_articles': 0,
+                    'sent_articles': 0,
+                    'duplicates_removed': 0,
+                    'errors': 0
+                }
+                
+                # 处理主文章表
+                cursor.execute("SELECT id, article_id FROM news_articles")
+                articles = cursor.fetchall()
+                for id, article_id in articles:
+                    normalized_id = self.normalize_article_id(article_id)
+                    if (normalized_id != article_id):
+                        try:
+                            # 检查规范化后的ID是否已存在
+                            cursor.execute("SELECT id FROM news_articles WHERE article_id = ?", (normalized_id,))
+                            existing = cursor.fetchone()
                             
-                            # 删除旧记录
-                            cursor.execute("DELETE FROM news_articles WHERE id = ?", (id,))
-                            stats['duplicates_removed'] += 1
-                        else:
-                            # 更新为规范化的ID
-                            cursor.execute("UPDATE news_articles SET article_id = ? WHERE id = ?", (normalized_id, id))
-                            stats['news_articles'] += 1
-                    except Exception as e:
-                        print(f"Error migrating article {article_id}: {e}")
-                        stats['errors'] += 1
-            
-            # 处理已丢弃文章表
-            cursor.execute("SELECT id, article_id FROM discarded_articles")
-            discarded = cursor.fetchall()
-            for id, article_id in discarded:
-                normalized_id = self.normalize_article_id(article_id)
-                if (normalized_id != article_id):
-                    try:
-                        cursor.execute("UPDATE discarded_articles SET article_id = ? WHERE id = ?", (normalized_id, id))
-                        stats['discarded_articles'] += 1
-                    except Exception as e:
-                        print(f"Error migrating discarded article {article_id}: {e}")
-                        stats['errors'] += 1
-            
-            # 处理已发送文章表
-            cursor.execute("SELECT id, article_id FROM sent_articles")
-            sent = cursor.fetchall()
-            for id, article_id in sent:
-                normalized_id = self.normalize_article_id(article_id)
-                if (normalized_id != article_id):
-                    try:
-                        cursor.execute("UPDATE sent_articles SET article_id = ? WHERE id = ?", (normalized_id, id))
-                        stats['sent_articles'] += 1
-                    except Exception as e:
-                        print(f"Error migrating sent article {article_id}: {e}")
-                        stats['errors'] += 1
-            
-            # 提交所有更改
-            conn.commit()
-            conn.close()
-            
+                            if existing:
+                                # 如果已存在规范化的ID，则合并记录并删除当前记录
+                                # 将旧记录的processed状态转移到新记录
+                                cursor.execute("SELECT processed FROM news_articles WHERE id = ?", (id,))
+                                is_processed = cursor.fetchone()[0]
+                                if is_processed:
+                                    cursor.execute("UPDATE news_articles SET processed = 1 WHERE article_id = ?", (normalized_id,))
+                                
+                                # 删除旧记录
+                                cursor.execute("DELETE FROM news_articles WHERE id = ?", (id,))
+                                stats['duplicates_removed'] += 1
+                            else:
+                                # 更新为规范化的ID
+                                cursor.execute("UPDATE news_articles SET article_id = ? WHERE id = ?", (normalized_id, id))
+                                stats['news_articles'] += 1
+                        except Exception as e:
+                            print(f"Error migrating article {article_id}: {e}")
+                            stats['errors'] += 1
+                
+                # 处理已丢弃文章表
+                cursor.execute("SELECT id, article_id FROM discarded_articles")
+                discarded = cursor.fetchall()
+                for id, article_id in discarded:
+                    normalized_id = self.normalize_article_id(article_id)
+                    if (normalized_id != article_id):
+                        try:
+                            cursor.execute("UPDATE discarded_articles SET article_id = ? WHERE id = ?", (normalized_id, id))
+                            stats['discarded_articles'] += 1
+                        except Exception as e:
+                            print(f"Error migrating discarded article {article_id}: {e}")
+                            stats['errors'] += 1
+                
+                # 处理已发送文章表
+                cursor.execute("SELECT id, article_id FROM sent_articles")
+                sent = cursor.fetchall()
+                for id, article_id in sent:
+                    normalized_id = self.normalize_article_id(article_id)
+                    if (normalized_id != article_id):
+                        try:
+                            cursor.execute("UPDATE sent_articles SET article_id = ? WHERE id = ?", (normalized_id, id))
+                            stats['sent_articles'] += 1
+                        except Exception as e:
+                            print(f"Error migrating sent article {article_id}: {e}")
+                            stats['errors'] += 1
+            
+            # 提交所有更改 (由 with conn 在块结束时提交)
             total_updated = stats['news_articles'] + stats['discarded_articles'] + stats['sent_articles']
             print(f"数据库迁移完成: {total_updated} 条记录已更新, {stats['duplicates_removed']} 条重复记录已合并, {stats['errors']} 个错误")
             return stats
@@ -3,13 +3,18 @@ import requests
 from datetime import datetime
 import time
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+from typing import List, Dict, Any, Optional, Set, Tuple, Callable
 import hashlib
 from bs4 import BeautifulSoup # Import BeautifulSoup
 import pytz  # 添加时区支持
 from .news_db_manager import NewsDBManager
 from .config_manager import load_config
 from .wechat_parser import WeChatParser
+from .http_client import HttpClient
 # Import the normalization function
 from .news_db_manager import NewsDBManager
 import re # Add re import for whitespace normalization
@@ -18,6 +23,52 @@ import re # Add re import for whitespace normalization
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("rss_parser")
 
+# 并发获取的默认设置，可在 global_settings.fetch_settings 中覆盖
+DEFAULT_FETCH_SETTINGS = {
+    "concurrent_fetch": True,   # 是否并发获取多个Feed
+    "max_workers": 8,           # 全局并发数
+    "per_host_limit": 2,        # 同一主机的最大并发请求数
+    "per_host_delay": 0.5,      # 同一主机相邻请求的最小间隔（秒）
+    "connect_timeout": 10,      # 建立连接超时（秒）
+    "read_timeout": 30          # 读取响应超时（秒）
+}
+
+def get_fetch_settings(config: Dict[str, Any]) -> Dict[str, Any]:
+    """从配置中读取Feed获取设置，缺失的项使用默认值"""
+    settings = dict(DEFAULT_FETCH_SETTINGS)
+    settings.update(config.get("global_settings", {}).get("fetch_settings", {}) or {})
+    return settings
+
+class HostThrottle:
+    """按主机限制并发请求数，并保证同一主机的相邻请求之间保持最小间隔"""
+
+    def __init__(self, per_host_limit: int = 2, min_interval: float = 0.5):
+        self.per_host_limit = max(1, int(per_host_limit))
+        self.min_interval = max(0.0, float(min_interval))
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._next_slot: Dict[str, float] = {}
+
+    @contextmanager
+    def slot(self, url: str):
+        """占用目标主机的一个请求名额，必要时等待到允许的请求时间"""
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host_limit)
+                self._semaphores[host] = semaphore
+
+        with semaphore:
+            with self._lock:
+                now = time.monotonic()
+                start_at = max(now, self._next_slot.get(host, now))
+                self._next_slot[host] = start_at + self.min_interval
+            wait = start_at - now
+            if wait > 0:
+                time.sleep(wait)
+            yield
+
 class RssParser:
     """RSS Feed解析器，用于获取和处理RSS Feed的内容"""
     
@@ -28,15 +79,17 @@ class RssParser:
             user_agent: 请求头中的User-Agent字段
         """
         self.user_agent = user_agent
-        self.session = requests.Session()
-        self.session.headers.update({"User-Agent": user_agent})
         self.db_manager = NewsDBManager()
         # Get the normalization function instance
         self.normalize_article_id = self.db_manager.normalize_article_id
-        self.wechat_parser = WeChatParser()  # Initialize the WeChat parser
         
         # 从配置加载是否跳过已处理文章的设置（初始值）
         config = load_config()
+        
+        # 所有Feed下载共用一个带连接池的HTTP客户端，连接池大小与获取并发数一致
+        self.http_client = HttpClient.from_settings(get_fetch_settings(config), user_agent)
+        self.session = self.http_client.session
+        self.wechat_parser = WeChatParser(self.http_client)  # Initialize the WeChat parser
         # 修复：更正配置路径访问方式
         self.skip_processed = config.get("global_settings", {}).get("general_settings", {}).get("skip_processed_articles", False)
         logger.info(f"初始化时 - 跳过已处理文章: {'是' if self.skip_processed else '否'}")
@@ -46,6 +99,9 @@ class RssParser:
         general_settings = config.get("global_settings", {}).get("general_settings", {})
         self.assume_utc = False  # 修正：无时区信息的日期不应假定为UTC
         logger.info(f"无时区信息时将保留原始时间（假定为本地时间）")
+        
+        # 从配置加载并发获取设置
+        self.fetch_settings = get_fetch_settings(config)
     
     def refresh_settings(self):
         """刷新配置设置，确保使用最新的配置值"""
@@ -65,12 +121,27 @@ class RssParser:
             
             logger.info(f"无时区信息时将保留原始时间（假定为本地时间）")
             
+            # 刷新并发获取设置，并发数或超时变化时重建HTTP客户端
+            self.fetch_settings = get_fetch_settings(config)
+            self._update_http_client()
+            
             # 通过显式返回布尔值避免任何转换问题
             return self.skip_processed is True
         except Exception as e:
             logger.error(f"刷新设置时出错: {e}")
             return False
     
+    def _update_http_client(self):
+        """获取设置中的并发数或超时与HTTP客户端不一致时重建客户端，使连接池大小与并发数一致"""
+        if self.http_client.matches_settings(self.fetch_settings):
+            return
+        old_client = self.http_client
+        self.http_client = HttpClient.from_settings(self.fetch_settings, self.user_agent)
+        self.session = self.http_client.session
+        self.wechat_parser.http_client = self.http_client
+        old_client.close()
+        logger.info(f"获取设置已变化，HTTP客户端已重建: 连接池大小={self.http_client.pool_size}, 超时={self.http_client.timeout}")
+    
     def _convert_to_local_time(self, dt: datetime) -> datetime:
         """
         只对有时区信息的日期进行转换，没有时区信息的保持原样
@@ -140,7 +211,9 @@ class RssParser:
             # Return original content if cleaning fails
             return html_content
     
-    def fetch_feed(self, feed_url: str, items_count: int = 10, task_id: str = None, recipients: List[str] = None) -> Dict[str, Any]:
+    def fetch_feed(self, feed_url: str, items_count: int = 10, task_id: str = None, recipients: List[str] = None,
+                   processed_ids: Optional[Tuple[Set[str], Set[str]]] = None,
+                   article_sink: Optional[List[Dict[str, Any]]] = None, refresh: bool = True) -> Dict[str, Any]:
         """获取RSS Feed内容
         
         Args:
@@ -148,10 +221,14 @@ class RssParser:
             items_count: 要获取的条目数量
             task_id: 当前执行的任务ID（用于跳过被该任务丢弃或已发送的文章）
             recipients: 当前任务的收件人列表（用于检查是否所有人都收到过）
+            processed_ids: 预加载的 (已丢弃ID集合, 已发送ID集合)；为空时按需从数据库加载
+            article_sink: 用于收集待入库文章记录的列表；提供时由调用方统一批量写入，否则在本Feed结束时写入
+            refresh: 是否在获取前刷新配置；批量获取时由 fetch_multiple_feeds 统一刷新一次
         """
         try:
-            # 每次获取Feed前刷新配置
-            self.refresh_settings()
+            # 单独获取Feed前刷新配置
+            if refresh:
+                self.refresh_settings()
             
             logger.info(f"\n============ 开始获取Feed ============")
             logger.info(f"Feed URL: {feed_url}")
@@ -163,6 +240,11 @@ class RssParser:
                 logger.info(f"当前收件人: {recipients}")
             start_time = time.time()
             
+            # 一次性加载该任务已丢弃/已发送的文章ID，条目检查只需查询内存集合
+            if self.skip_processed and task_id and processed_ids is None:
+                processed_ids = self.db_manager.get_processed_article_ids_for_task(task_id)
+            discarded_ids, sent_ids = processed_ids if processed_ids is not None else (set(), set())
+            
             # Check if this is a WeChat source that needs special handling
             is_wechat_source = "WXS_" in feed_url or "weixin" in feed_url
             
@@ -177,6 +259,7 @@ class RssParser:
                 
                 # Process WeChat items and store them in the database
                 processed_entries = []
+                article_records = []
                 skipped_count = 0
                 total_entries = len(wechat_result["items"])
                 
@@ -198,10 +281,10 @@ class RssParser:
                     
                     if self.skip_processed and task_id: # Ensure task_id is available for checks
                         # Check using the consistently generated article_id
-                        if self.db_manager.is_article_discarded_for_task(article_id, task_id):
+                        if article_id in discarded_ids:
                             skip_article = True
                             skip_reason = f"在任务 {task_id} 中被丢弃过"
-                        elif self.db_manager.is_article_sent_for_task(article_id, task_id):
+                        elif article_id in sent_ids:
                             skip_article = True
                             skip_reason = f"在任务 {task_id} 中已发送过"
                     
@@ -214,20 +297,22 @@ class RssParser:
                     content = entry.get('content', '')
                     content_hash = hashlib.md5(content.encode()).hexdigest() if content else None
                     
-                    # Store in database using the generated article_id
-                    self.db_manager.add_news_article(
-                        article_id=article_id, # Use the generated ID
-                        title=title,
-                        link=original_link, # Store original link for display
-                        source=entry.get('source', '微信公众号'),
-                        published_date=entry.get('published', datetime.now().isoformat()),
-                        content_hash=content_hash
-                    )
+                    # Queue for storage using the generated article_id
+                    article_records.append({
+                        "article_id": article_id, # Use the generated ID
+                        "title": title,
+                        "link": original_link, # Store original link for display
+                        "source": entry.get('source', '微信公众号'),
+                        "published_date": entry.get('published', datetime.now().isoformat()),
+                        "content_hash": content_hash
+                    })
                     
                     # Add article_id to entry
                     entry["article_id"] = article_id
                     processed_entries.append(entry)
                 
+                self._store_articles(article_records, article_sink)
+                
                 elapsed_time = time.time() - start_time
                 logger.info(f"\n============ WeChat Feed获取完成 ============")
                 logger.info(f"Feed URL: {feed_url}")
@@ -249,9 +334,44 @@ class RssParser:
                     }
                 }
             
-            # 使用feedparser解析RSS Feed
+            # 启用跳过已处理文章时，使用条件请求 (ETag / Last-Modified) 避免重复下载未变化的Feed
+            use_conditional = bool(self.skip_processed and task_id)
+            feed_cache = self.db_manager.get_feed_cache(feed_url, task_id) if use_conditional else None
+            etag = feed_cache.get("etag") if feed_cache else None
+            last_modified = feed_cache.get("last_modified") if feed_cache else None
+            if etag or last_modified:
+                logger.info(f"发送条件请求: ETag={etag}, Last-Modified={last_modified}")
+            
+            request_headers = {}
+            if etag:
+                request_headers["If-None-Match"] = etag
+            if last_modified:
+                request_headers["If-Modified-Since"] = last_modified
+            
+            # 通过共享的HTTP客户端下载Feed（连接复用、压缩传输）
+            logger.info(f"下载RSS Feed: {feed_url}")
+            response = self.http_client.get(feed_url, headers=request_headers)
+            
+            if use_conditional and response.status_code == 304:
+                logger.info(f"Feed未变化 (304 Not Modified)，没有新条目: {feed_url}")
+                return self._not_modified_result(feed_url, start_time)
+            
+            response.raise_for_status()
+            logger.info(f"下载完成: {len(response.content)} 字节, 编码: {response.headers.get('Content-Encoding', '无')}")
+            
+            # 服务器不支持条件请求时，通过响应指纹判断Feed是否变化，未变化则跳过解析
+            fingerprint = hashlib.md5(response.content).hexdigest() if use_conditional else None
+            if fingerprint and feed_cache and feed_cache.get("fingerprint") == fingerprint:
+                logger.info(f"Feed指纹未变化，没有新条目: {feed_url}")
+                return self._not_modified_result(feed_url, start_time)
+            
+            # 使用feedparser解析下载的内容
             logger.info(f"解析RSS Feed: {feed_url}")
-            feed = feedparser.parse(feed_url)
+            feed = feedparser.parse(response.content, response_headers={
+                "content-location": response.url,
+                "content-type": response.headers.get("Content-Type", ""),
+                "content-language": response.headers.get("Content-Language", "")
+            })
             
             # 检查Feed是否有效
             if not feed:
@@ -286,6 +406,7 @@ class RssParser:
             logger.info(f"\n============ 处理Feed条目 ============")
             
             processed_entries = []
+            article_records = []
             skipped_count = 0
             entry_index = 0
             
@@ -318,10 +439,10 @@ class RssParser:
                 
                 if self.skip_processed and task_id: # Ensure task_id is available for checks
                     # Check using the normalized article_id
-                    if self.db_manager.is_article_discarded_for_task(article_id, task_id):
+                    if article_id in discarded_ids:
                         skip_article = True
                         skip_reason = f"在任务 {task_id} 中被丢弃过"
-                    elif self.db_manager.is_article_sent_for_task(article_id, task_id):
+                    elif article_id in sent_ids:
                         skip_article = True
                         skip_reason = f"在任务 {task_id} 中已发送过"
                 
@@ -389,15 +510,30 @@ class RssParser:
                 if content_to_hash:
                     content_hash = hashlib.md5(content_to_hash.encode('utf-8')).hexdigest()
                 
-                # Store in database using the normalized article_id
-                self.db_manager.add_news_article(
-                    article_id=article_id, # Use the normalized ID
-                    title=entry.title,
-                    link=original_link, # Store original link
-                    source=feed.feed.title if hasattr(feed, 'feed') and hasattr(feed.feed, 'title') else feed_url,
-                    published_date=published_date,
-                    content_hash=content_hash # Use hash of cleaned content
-                )
+                # Queue for storage using the normalized article_id
+                article_records.append({
+                    "article_id": article_id, # Use the normalized ID
+                    "title": title,
+                    "link": original_link, # Store original link
+                    "source": processed_entry["source"],
+                    "published_date": published_date,
+                    "content_hash": content_hash # Use hash of cleaned content
+                })
+            
+            self._store_articles(article_records, article_sink)
+            
+            # 新的验证信息随结果返回，由调用方在任务成功完成后通过 save_feed_caches 保存；
+            # 只有遍历完所有条目时才使用新的验证信息，否则下次仍需完整获取以处理剩余条目
+            feed_cache_update = None
+            if use_conditional:
+                if entry_index >= total_entries:
+                    feed_cache_update = {
+                        "etag": response.headers.get('ETag'),
+                        "last_modified": response.headers.get('Last-Modified'),
+                        "fingerprint": fingerprint
+                    }
+                elif feed_cache:
+                    feed_cache_update = {}
             
             # 如果启用了跳过文章功能，记录详细的统计信息
             if self.skip_processed:
@@ -417,7 +553,7 @@ class RssParser:
             logger.info(f"获取条目数: {len(processed_entries)}")
             logger.info(f"耗时: {elapsed_time:.2f}秒")
             
-            return {
+            result = {
                 "status": "success",
                 "items": processed_entries,
                 "feed_info": {
@@ -431,6 +567,9 @@ class RssParser:
                     "skipped": skipped_count
                 }
             }
+            if feed_cache_update is not None:
+                result["feed_cache"] = feed_cache_update
+            return result
         
         except Exception as e:
             import traceback
@@ -445,31 +584,131 @@ class RssParser:
                 "items": []
             }
 
-    def fetch_multiple_feeds(self, feed_configs: List[Dict[str, Any]], task_id: str = None, recipients: List[str] = None) -> Dict[str, Dict[str, Any]]:
+    def save_feed_caches(self, feed_results: Dict[str, Dict[str, Any]], task_id: str):
+        """保存Feed结果中的条件请求验证信息
+        
+        应在任务的内容全部处理并送达后调用；任务失败时不保存，下次运行重新获取完整的Feed。
+        空的验证信息表示清除该Feed已保存的验证信息。
+        
+        Args:
+            feed_results: fetch_multiple_feeds 返回的URL到Feed结果的映射
+            task_id: 任务ID
+        """
+        for feed_url, result in feed_results.items():
+            if "feed_cache" in result:
+                self.db_manager.update_feed_cache(feed_url, task_id, **result["feed_cache"])
+    
+    def _store_articles(self, article_records: List[Dict[str, Any]], article_sink: Optional[List[Dict[str, Any]]] = None):
+        """保存文章记录：提供收集列表时交由调用方批量写入，否则立即在一个事务中写入"""
+        if not article_records:
+            return
+        if article_sink is not None:
+            article_sink.extend(article_records)
+            return
+        new_ids = self.db_manager.add_news_articles(article_records)
+        logger.info(f"文章入库: {len(new_ids)} 条新文章, {len(article_records) - len(new_ids)} 条已存在")
+    
+    def _not_modified_result(self, feed_url: str, start_time: float) -> Dict[str, Any]:
+        """构建Feed未变化时的结果（没有新条目）"""
+        elapsed_time = time.time() - start_time
+        logger.info(f"\n============ Feed获取完成 (未变化) ============")
+        logger.info(f"Feed URL: {feed_url}")
+        logger.info(f"耗时: {elapsed_time:.2f}秒")
+        return {
+            "status": "success",
+            "items": [],
+            "feed_info": {
+                "title": "未知",
+                "description": "无描述",
+                "link": feed_url
+            },
+            "stats": {
+                "total_available": 0,
+                "processed": 0,
+                "skipped": 0,
+                "not_modified": True
+            }
+        }
+    
+    def fetch_multiple_feeds(self, feed_configs: List[Dict[str, Any]], task_id: str = None, recipients: List[str] = None,
+                             on_result: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> Dict[str, Dict[str, Any]]:
         """批量获取多个RSS Feed
         
+        启用并发获取时，使用有界线程池同时获取多个Feed，并按主机限制并发数和请求间隔；
+        总耗时大致取决于最慢的主机，而不是所有Feed耗时之和。
+        
         Args:
             feed_configs: 包含Feed URL和配置的字典列表
                 每个字典应包含'url'和'items_count'
             task_id: 当前执行的任务ID
             recipients: 当前任务的收件人列表
+            on_result: 可选回调，每个Feed获取完成时立即以 (url, result) 调用，
+                供流水线在其余Feed仍在下载时开始处理已获取的内容
                 
         Returns:
-            URL到Feed结果的映射字典
+            URL到Feed结果的映射字典（顺序与feed_configs一致）
         """
-        results = {}
-        
+        jobs = []
+        seen_urls = set()
         for config in feed_configs:
             url = config.get('url')
-            items_count = config.get('items_count', 10)
-            
-            if not url:
+            if not url or url in seen_urls:
                 continue
-                
-            result = self.fetch_feed(url, items_count, task_id, recipients)
-            results[url] = result
-            
-            # 添加一个小延迟，避免过快请求
-            time.sleep(0.5)
+            seen_urls.add(url)
+            jobs.append((url, config.get('items_count', 10)))
+        
+        if not jobs:
+            return {}
+        
+        # 每次批量获取只刷新一次配置，工作线程启动前按最新的并发数调整HTTP客户端
+        self.refresh_settings()
+        settings = self.fetch_settings
+        max_workers = max(1, int(settings.get("max_workers", 1)))
+        throttle = HostThrottle(settings.get("per_host_limit", 2), settings.get("per_host_delay", 0.5))
+        
+        # 每次运行只加载一次该任务已处理的文章ID，所有Feed共享
+        processed_ids = None
+        if self.skip_processed and task_id:
+            processed_ids = self.db_manager.get_processed_article_ids_for_task(task_id)
+            logger.info(f"已加载任务 {task_id} 的已处理文章: 丢弃 {len(processed_ids[0])} 条, 已发送 {len(processed_ids[1])} 条")
+        
+        # 所有Feed的文章记录先收集起来，最后在一个事务中写入数据库
+        article_sink = []
+        
+        def fetch_job(url: str, items_count: int) -> Dict[str, Any]:
+            with throttle.slot(url):
+                return self.fetch_feed(url, items_count, task_id, recipients, processed_ids, article_sink, refresh=False)
+        
+        start_time = time.time()
+        results = {}
+        
+        if not settings.get("concurrent_fetch", True) or max_workers == 1 or len(jobs) == 1:
+            logger.info(f"顺序获取 {len(jobs)} 个Feed")
+            for url, items_count in jobs:
+                results[url] = fetch_job(url, items_count)
+                if on_result:
+                    on_result(url, results[url])
+        else:
+            worker_count = min(max_workers, len(jobs))
+            logger.info(f"并发获取 {len(jobs)} 个Feed (线程数: {worker_count}, 每主机并发: {throttle.per_host_limit})")
+            with ThreadPoolExecutor(max_workers=worker_count, thread_name_prefix="FeedFetch") as executor:
+                futures = {executor.submit(fetch_job, url, items_count): url for url, items_count in jobs}
+                for future in as_completed(futures):
+                    url = futures[future]
+                    try:
+                        results[url] = future.result()
+                    except Exception as e:
+                        logger.error(f"获取Feed时线程出错: {url} - {e}")
+                        results[url] = {
+                            "status": "fail",
+                            "error": str(e),
+                            "items": []
+                        }
+                    if on_result:
+                        on_result(url, results[url])
+        
+        logger.info(f"{len(jobs)} 个Feed获取完成，总耗时: {time.time() - start_time:.2f}秒")
+        self._store_articles(article_sink)
         
-        return results
+        # 按原始配置顺序返回结果
+        return {url: results[url] for url, _ in jobs}
@@ -4,11 +4,17 @@ import threading
 import logging
 import queue
 import sys
+import math
 from datetime import datetime, timedelta
 from core.config_manager import load_config, save_config, get_tasks, save_task
 from core.rss_parser import RssParser
+from core.task_pipeline import TaskPipeline, get_pipeline_settings
 from ai_processor.filter import ContentFilter
 from ai_processor.summarizer import NewsSummarizer
+from ai_processor.ai_utils import AiService, AiException, CircuitOpenError, get_warmup_settings, uses_ollama
+from ai_processor.retry_policy import get_circuit_states
+from ai_processor.call_metrics import RunMetrics, PURPOSE_EVALUATE
+from ai_processor.dedup import NearDuplicateCollapser, get_dedup_settings
 from typing import Dict, List, Any
 from core.email_sender import EmailSender, EmailSendError
 from .news_db_manager import NewsDBManager
@@ -27,6 +33,7 @@ task_queue = queue.Queue()
 task_processing_thread = None
 is_task_running = False
 task_lock = threading.Lock()  # For thread-safe operations on shared variables
+last_run_metrics = {}  # 每个任务最近一次运行的AI调用计量
 
 def execute_task(task_id=None):
     """将任务放入队列而不是直接执行"""
@@ -137,6 +144,69 @@ def ensure_processor_running():
             # 增加一个健康检查，即使线程状态为alive，也打印更多信息以便调试
             logger.info(f"队列信息 - 大小: {task_queue.qsize()}, 当前任务状态: {'执行中' if is_task_running else '空闲'}")
 
+def defer_task(task_id, delay_seconds):
+    """推迟任务：在指定时间后执行一次，同一任务已有推迟的执行时不重复添加"""
+    tag = f"deferred-{task_id}"
+    if schedule.get_jobs(tag):
+        logger.info(f"任务 {task_id} 已有推迟的执行，不再重复推迟")
+        return
+    minutes = max(1, math.ceil(delay_seconds / 60))
+    
+    def deferred_task():
+        execute_task(task_id)
+        return schedule.CancelJob
+    
+    schedule.every(minutes).minutes.do(deferred_task).tag(tag)
+    logger.info(f"任务 {task_id} 推迟 {minutes} 分钟后执行")
+
+def warm_up_ai(task_id):
+    """在任务运行前预热AI模型，在单独的线程中执行以免阻塞调度器"""
+    def run_warm_up():
+        config = load_config()
+        ai_settings = config.get("global_settings", {}).get("ai_settings", {})
+        if not get_warmup_settings(ai_settings).get("enabled"):
+            return
+        logger.info(f"为任务 {task_id} 预热AI模型")
+        try:
+            warmed = AiService(config).warm_up()
+            logger.info(f"任务 {task_id} 的AI模型预热完成，预热了 {warmed} 个模型")
+        except AiException as e:
+            logger.warning(f"任务 {task_id} 的AI模型预热失败: {str(e)}")
+    
+    threading.Thread(target=run_warm_up, name=f"warmup-{task_id}", daemon=True).start()
+
+def _schedule_warm_up(task, day_index, time_str, lead_minutes):
+    """在任务每次计划运行前 lead_minutes 分钟安排模型预热，可能落在前一天"""
+    day_names = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+    try:
+        run_time = datetime.strptime(time_str, "%H:%M")
+    except ValueError:
+        logger.warning(f"任务 {task.name} 的运行时间 {time_str} 无法解析，跳过模型预热")
+        return
+    warm_time = run_time - timedelta(minutes=lead_minutes)
+    warm_day = day_index if warm_time.day == run_time.day else (day_index - 1) % 7
+    
+    def create_warm_up_job(task_id):
+        return lambda: warm_up_ai(task_id)
+    
+    getattr(schedule.every(), day_names[warm_day]).at(warm_time.strftime("%H:%M")).do(
+        create_warm_up_job(task.task_id)).tag("warmup", f"warmup-{task.task_id}")
+
+def _finish_run_metrics(run_metrics, db_manager, task_name):
+    """记录、保存并公布一次任务运行的AI调用计量"""
+    run_metrics.finish()
+    summary = run_metrics.summary()
+    if not summary["by_purpose"]:
+        return
+    logger.info(f"\n============ AI调用计量 ============")
+    logger.info(f"任务: {task_name}")
+    for line in run_metrics.format_report().splitlines():
+        logger.info(line)
+    db_manager.save_run_metrics(run_metrics.task_id, run_metrics.started_at, run_metrics.finished_at,
+                                run_metrics.breakdown())
+    with task_lock:
+        last_run_metrics[run_metrics.task_id] = summary
+
 def _execute_task(task_id=None):
     """实际执行任务的函数 (被process_task_queue调用)"""
     logger.info(f"\n=====================================================")
@@ -232,9 +302,14 @@ def _execute_task(task_id=None):
     is_skipping = rss_parser.refresh_settings()
     logger.info(f"任务执行器 - 跳过已处理文章: {'是' if is_skipping else '否'}")
     
+    pipeline_settings = get_pipeline_settings(config)
+    logger.info(f"任务执行器 - 流水线模式: {'是' if pipeline_settings.get('enabled') else '否'}")
+    dedup_settings = get_dedup_settings(config)
+    logger.info(f"任务执行器 - 近似重复合并: {'是' if dedup_settings.get('enabled') else '否'}")
+    
     try:
-        content_filter = ContentFilter(config)
         summarizer = NewsSummarizer(config)
+        content_filter = ContentFilter(config, summarizer)
         update_progress_safely(get_text("initializing_services") if get_text("initializing_services") != "initializing_services" else "初始化服务完成...", 20)
     except Exception as e:
         status_manager.update_task(task_state_id,
@@ -247,11 +322,22 @@ def _execute_task(task_id=None):
     # 逐个处理任务
     total_tasks = len(tasks)
     for task_index, task in enumerate(tasks):
+        # 本次运行的AI调用计量，内容过滤和简报生成共用
+        run_metrics = RunMetrics(task.task_id)
+        content_filter.ai_service.metrics = run_metrics
+        summarizer.ai_service.metrics = run_metrics
         try:
             # 修改进度计算逻辑，确保进度不会倒退
             new_progress = max(20 + (task_index / total_tasks * 60), current_progress)  # 20%-80%
             update_progress_safely(f"处理任务: {task.name}", int(new_progress))
             
+            # AI提供商熔断时不再获取和评估内容，等熔断冷却结束后再执行
+            if content_filter.ai_service.circuit_open(PURPOSE_EVALUATE):
+                logger.warning(f"AI服务处于熔断状态，推迟任务 {task.name}")
+                status_manager.update_task(task_state_id, message=f"AI服务不可用，任务 {task.name} 已推迟")
+                defer_task(task.task_id, content_filter.ai_service.circuit_retry_in(PURPOSE_EVALUATE))
+                continue
+            
             logger.info(f"\n=====================================================")
             logger.info(f"开始处理任务: {task.name} (ID: {task.task_id})")
             logger.info(f"=====================================================\n")
@@ -296,7 +382,14 @@ def _execute_task(task_id=None):
             # 批量获取RSS feed - 现在传递task_id和recipients
             logger.info(f"\n============ 开始获取Feed内容 ============")
             logger.info(f"准备获取 {len(feed_configs)} 个RSS源")
-            feed_results = rss_parser.fetch_multiple_feeds(feed_configs, task.task_id, task.recipients)
+            pipeline_result = None
+            if pipeline_settings.get("enabled"):
+                # 流水线模式：获取Feed的同时对已获取的内容进行过滤和生成简报
+                pipeline = TaskPipeline(rss_parser, content_filter, summarizer, pipeline_settings, dedup_settings)
+                pipeline_result = pipeline.run(task, feed_configs)
+                feed_results = pipeline_result["feed_results"]
+            else:
+                feed_results = rss_parser.fetch_multiple_feeds(feed_configs, task.task_id, task.recipients)
             
             # 更新feed状态和收集统计信息
             total_items = 0
@@ -334,34 +427,51 @@ def _execute_task(task_id=None):
             update_progress_safely(get_text("fetching_rss_content") if get_text("fetching_rss_content") != "fetching_rss_content" else "正在获取RSS内容...", max(int(new_progress + 15), current_progress))
             all_contents = []
             logger.info(f"\n============ 整合内容 ============")
-            for feed_url, result in feed_results.items():
-                if result["status"] == "success":
-                    items = result.get("items", [])
-                    
-                    # 为每个条目添加feed特定标签
-                    feed_labels = task.get_feed_labels(feed_url)
-                    # 新增：添加获取反向标签
-                    negative_labels = task.get_feed_negative_labels(feed_url)
-                    logger.info(f"从 {feed_url} 添加 {len(items)} 条内容，标签: {feed_labels}, 反向标签: {negative_labels}")
-                    
-                    for i, item in enumerate(items):
-                        item["feed_url"] = feed_url
-                        item["feed_labels"] = feed_labels
-                        # 新增：添加反向标签到条目
-                        item["negative_labels"] = negative_labels
-                        # 新增：添加任务对象，这样filter可以在需要时获取最新的配置
-                        item["task"] = task
-                        title = item.get("title", "无标题")
-                        # 只记录前3个条目的详细信息，避免日志过多
-                        if i < 3:
-                            logger.info(f"  - 条目 #{i+1}: {title}")
-                    
-                    all_contents.extend(items)
+            if pipeline_result is not None:
+                # 流水线已为条目添加了Feed标签和任务对象
+                all_contents = pipeline_result["contents"]
+                logger.info(f"流水线已整合 {len(all_contents)} 条内容")
+            else:
+                for feed_url, result in feed_results.items():
+                    if result["status"] == "success":
+                        items = result.get("items", [])
+                        
+                        # 为每个条目添加feed特定标签
+                        feed_labels = task.get_feed_labels(feed_url)
+                        # 新增：添加获取反向标签
+                        negative_labels = task.get_feed_negative_labels(feed_url)
+                        logger.info(f"从 {feed_url} 添加 {len(items)} 条内容，标签: {feed_labels}, 反向标签: {negative_labels}")
+                        
+                        for i, item in enumerate(items):
+                            item["feed_url"] = feed_url
+                            item["feed_labels"] = feed_labels
+                            # 新增：添加反向标签到条目
+                            item["negative_labels"] = negative_labels
+                            # 新增：添加任务对象，这样filter可以在需要时获取最新的配置
+                            item["task"] = task
+                            title = item.get("title", "无标题")
+                            # 只记录前3个条目的详细信息，避免日志过多
+                            if i < 3:
+                                logger.info(f"  - 条目 #{i+1}: {title}")
+                        
+                        all_contents.extend(items)
             
             if not all_contents:
                 logger.warning(f"任务 {task.name} 未获取到任何内容，跳过过滤步骤")
+                rss_parser.save_feed_caches(feed_results, task.task_id)
                 continue
             
+            # 近似重复的文章（如多个来源转载的同一篇通稿）只评估代表文章
+            if pipeline_result is not None:
+                duplicates = pipeline_result["duplicates"]
+                unique_contents = [c for c in all_contents if "duplicate_of" not in c]
+            elif dedup_settings.get("enabled"):
+                unique_contents, duplicates = NearDuplicateCollapser.from_settings(dedup_settings).collapse(all_contents)
+            else:
+                unique_contents, duplicates = all_contents, []
+            if duplicates:
+                logger.info(f"近似重复合并: {len(duplicates)} 篇文章合并到 {len(unique_contents)} 篇代表文章中")
+            
             # 应用内容过滤器 - 传入所有内容但不再传入全局兴趣标签
             logger.info(f"\n============ 开始内容过滤 ============")
             logger.info(f"待过滤内容总数: {len(all_contents)}")
@@ -372,23 +482,34 @@ def _execute_task(task_id=None):
                                max(int(new_progress + 30), current_progress))
             
             try:
-                kept_contents, discarded_contents = content_filter.filter_content_batch(all_contents)
+                if pipeline_result is not None:
+                    if pipeline_result["error"] is not None:
+                        raise pipeline_result["error"]
+                    kept_contents = pipeline_result["kept_contents"]
+                    discarded_contents = pipeline_result["discarded_contents"]
+                else:
+                    kept_contents, discarded_contents = content_filter.filter_content_batch(unique_contents)
                 update_progress_safely(get_text("generating_content_summary") if get_text("generating_content_summary") != "generating_content_summary" else "正在生成内容摘要...", 
                                    max(int(new_progress + 45), current_progress))
                 
                 # 标记丢弃的内容为已处理 - 使用新的任务特定标记
+                # 被合并的近似重复文章随其代表文章一起标记
                 for content in discarded_contents:
                     if "article_id" in content:
-                        article_id = content["article_id"]
-                        # 标记为在当前任务中被丢弃
-                        success = rss_parser.db_manager.mark_as_discarded_for_task(article_id, task.task_id)
-                        if success:
-                            logger.info(f"已标记文章为在任务 {task.task_id} 中丢弃: {content.get('title', '无标题')} (ID: {article_id})")
-                        else:
-                            logger.warning(f"标记丢弃文章失败: {content.get('title', '无标题')} (ID: {article_id})")
+                        for article_id in [content["article_id"]] + content.get("duplicate_article_ids", []):
+                            # 标记为在当前任务中被丢弃
+                            success = rss_parser.db_manager.mark_as_discarded_for_task(
+                                article_id, task.task_id, content.get("discard_reason", "ai_evaluation"))
+                            if success:
+                                logger.info(f"已标记文章为在任务 {task.task_id} 中丢弃: {content.get('title', '无标题')} (ID: {article_id})")
+                            else:
+                                logger.warning(f"标记丢弃文章失败: {content.get('title', '无标题')} (ID: {article_id})")
             except Exception as e:
                 logger.error(f"AI内容过滤失败: {str(e)}")
                 logger.error("由于AI过滤不可用，任务无法继续")
+                if isinstance(e, CircuitOpenError):
+                    status_manager.update_task(task_state_id, message=f"AI服务不可用，任务 {task.name} 已推迟")
+                    defer_task(task.task_id, content_filter.ai_service.circuit_retry_in(PURPOSE_EVALUATE))
                 continue  # 跳过当前任务
             
             # 记录过滤结果的详细统计
@@ -397,6 +518,8 @@ def _execute_task(task_id=None):
             logger.info(f"总内容数: {len(all_contents)}")
             logger.info(f"保留内容数: {len(kept_contents)} ({len(kept_contents)/len(all_contents)*100:.1f}%)")
             logger.info(f"丢弃内容数: {len(discarded_contents)} ({len(discarded_contents)/len(all_contents)*100:.1f}%)")
+            if duplicates:
+                logger.info(f"合并的重复内容数: {len(duplicates)} ({len(duplicates)/len(all_contents)*100:.1f}%)")
             
             # 按标签统计
             logger.info(f"\n============ 标签匹配统计 ============")
@@ -424,7 +547,11 @@ def _execute_task(task_id=None):
                 
                 try:
                     # 生成简报
-                    summarized_contents = summarizer.generate_summaries(kept_contents)
+                    if pipeline_result is not None:
+                        # 流水线中已为保留的内容生成简报
+                        summarized_contents = kept_contents
+                    else:
+                        summarized_contents = summarizer.generate_summaries(kept_contents)
                     
                     # 记录简报结果
                     ai_summarized = sum(1 for c in summarized_contents if c.get("summary_method") == "ai")
@@ -454,6 +581,9 @@ def _execute_task(task_id=None):
                     logger.error(f"生成新闻简报失败: {str(e)}")
                     logger.error("将使用未生成简报的原始内容继续")
             
+            # 所有内容送达后才保存条件请求的验证信息，否则下次运行重新获取未送达的条目
+            delivered = True
+            
             # 如果有收件人，则发送邮件
             if kept_contents and task.recipients:
                 update_progress_safely(get_text("sending_emails") if get_text("sending_emails") != "sending_emails" else "正在发送邮件...", 
@@ -479,10 +609,10 @@ def _execute_task(task_id=None):
                         if status == "success":
                             for content in kept_contents:
                                 if "article_id" in content:
-                                    article_id = content["article_id"]
-                                    success = rss_parser.db_manager.mark_as_sent_to_recipient(article_id, recipient, task.task_id)
-                                    if not success:
-                                        logger.warning(f"标记文章为已发送给 {recipient} 失败: {content.get('title', '无标题')}")
+                                    for article_id in [content["article_id"]] + content.get("duplicate_article_ids", []):
+                                        success = rss_parser.db_manager.mark_as_sent_to_recipient(article_id, recipient, task.task_id)
+                                        if not success:
+                                            logger.warning(f"标记文章为已发送给 {recipient} 失败: {content.get('title', '无标题')}")
                     
                     # 记录邮件发送结果
                     success_count = sum(1 for r in results.values() if r.get("status") == "success")
@@ -492,6 +622,7 @@ def _execute_task(task_id=None):
                     if success_count == len(task.recipients):
                         logger.info("所有邮件发送成功")
                     else:
+                        delivered = False
                         logger.warning(f"部分邮件发送失败: {len(task.recipients) - success_count} 个失败")
                         for recipient, result in results.items():
                             if result.get("status") != "success":
@@ -499,6 +630,10 @@ def _execute_task(task_id=None):
                                 logger.warning(f"  - {recipient}: {error}")
                 except Exception as e:
                     logger.error(f"邮件发送过程中出错: {str(e)}")
+                    delivered = False
+            
+            if delivered:
+                rss_parser.save_feed_caches(feed_results, task.task_id)
             
             # 更新任务的last_run时间
             task.update_task_run()
@@ -520,6 +655,8 @@ def _execute_task(task_id=None):
             logger.error(f"错误类型: {type(e).__name__}")
             logger.error(f"错误信息: {str(e)}")
             logger.error(f"详细追踪:\n{traceback.format_exc()}")
+        finally:
+            _finish_run_metrics(run_metrics, rss_parser.db_manager, task.name)
     
     # 任务全部完成
     status_manager.update_task(task_state_id,
@@ -535,12 +672,18 @@ def setup_scheduled_tasks():
     """设置所有定时任务"""
     logger.info("设置定时任务")
     
-    # 清除现有任务
-    schedule.clear()
+    # 清除之前设置的定时任务，保留因熔断而推迟的执行（deferred-*）
+    for tag in ("task", "warmup", "unsubscribe"):
+        schedule.clear(tag)
     
     # 加载所有任务
     tasks = get_tasks()
     
+    # 默认提供商或任一模型路由使用Ollama时在每次计划运行前预热模型
+    ai_settings = load_config().get("global_settings", {}).get("ai_settings", {})
+    warmup_settings = get_warmup_settings(ai_settings)
+    warm_up_enabled = warmup_settings.get("enabled") and uses_ollama(ai_settings)
+    
     # 为每个任务设置定时
     task_count = 0
     scheduled_count = 0
@@ -604,8 +747,10 @@ def setup_scheduled_tasks():
                 day_method = day_methods[day_index]
                 
                 logger.info(f"设置任务 {task.name} (ID: {task.task_id}) 在{day_name} {time_str} 执行")
-                day_method.at(time_str).do(create_job(task.task_id))
+                day_method.at(time_str).do(create_job(task.task_id)).tag("task", f"task-{task.task_id}")
                 scheduled_count += 1
+                if warm_up_enabled:
+                    _schedule_warm_up(task, day_index, time_str, warmup_settings.get("lead_minutes", 5))
 
     # --- Add Daily Unsubscribe Check ---
     try:
@@ -614,7 +759,7 @@ def setup_scheduled_tasks():
         if imap_enabled:
             unsubscribe_handler = get_unsubscribe_handler()
             # Schedule to run once daily, e.g., at 3 AM
-            schedule.every().day.at("03:00").do(unsubscribe_handler.check_for_unsubscribes)
+            schedule.every().day.at("03:00").do(unsubscribe_handler.check_for_unsubscribes).tag("unsubscribe")
             logger.info(get_text("unsubscribe_check_scheduled"))
         else:
             logger.info("IMAP server not configured, skipping daily unsubscribe check scheduling.")
@@ -710,11 +855,14 @@ def get_scheduler_status():
     with task_lock:
         queue_size = task_queue.qsize()
         current_running = is_task_running
+        run_metrics_snapshot = dict(last_run_metrics)
     
     status = {
         "active_jobs": len(schedule.get_jobs()),
         "queue_size": queue_size,
         "is_task_running": current_running,
+        "ai_circuits": get_circuit_states(),
+        "last_run_metrics": run_metrics_snapshot,
         "next_jobs": []
     }
     
@@ -0,0 +1,308 @@
+import logging
+import queue
+import threading
+import time
+from typing import List, Dict, Any, Callable, Iterable, Optional
+
+from ai_processor.dedup import NearDuplicateCollapser
+from ai_processor.ai_utils import AiException
+from ai_processor.summarizer import MAX_CONSECUTIVE_SUMMARY_FAILURES
+
+logger = logging.getLogger("task_pipeline")
+
+# 流水线模式的默认设置，可在 global_settings.pipeline_settings 中覆盖
+DEFAULT_PIPELINE_SETTINGS = {
+    "enabled": True,          # 是否以流水线方式执行任务（获取、过滤、生成简报同时进行）
+    "queue_size": 32,         # 相邻阶段之间队列的最大长度
+    "evaluate_workers": None, # AI评估阶段的并发数，未设置时与内容过滤的并发评估线程数一致
+    "summarize_workers": 1    # 简报生成阶段的并发数
+}
+
+def get_pipeline_settings(config: Dict[str, Any]) -> Dict[str, Any]:
+    """从配置中读取流水线设置，缺失的项使用默认值"""
+    settings = dict(DEFAULT_PIPELINE_SETTINGS)
+    settings.update(config.get("global_settings", {}).get("pipeline_settings", {}) or {})
+    return settings
+
+# 阶段结束标记
+_STOP = object()
+
+class _Stage:
+    """流水线中的一个阶段：若干工作线程从输入队列取出条目，处理结果写入输出队列"""
+
+    def __init__(self, name: str, func: Callable[[Any], Iterable[Any]], workers: int,
+                 input_queue: queue.Queue, output_queue: Optional[queue.Queue], pipeline: "TaskPipeline"):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.pipeline = pipeline
+        self.busy_time = 0.0
+        self.processed = 0
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def start(self, downstream_workers: int):
+        """启动工作线程；全部结束后向下游发送与其工作线程数相同的结束标记"""
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"Pipeline-{self.name}-{index + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        def finish():
+            for thread in self._threads:
+                thread.join()
+            if self.output_queue is not None:
+                for _ in range(downstream_workers):
+                    self.output_queue.put(_STOP)
+
+        self._finisher = threading.Thread(target=finish, name=f"Pipeline-{self.name}-finish", daemon=True)
+        self._finisher.start()
+
+    def join(self):
+        self._finisher.join()
+
+    def _work(self):
+        while True:
+            item = self.input_queue.get()
+            if item is _STOP:
+                break
+            # 出现致命错误后继续取出剩余条目，避免上游阻塞在已满的队列上
+            if self.pipeline.error is not None:
+                continue
+
+            start_time = time.time()
+            try:
+                outputs = list(self.func(item) or [])
+            except Exception as e:
+                logger.error(f"流水线阶段 {self.name} 出错: {e}")
+                self.pipeline.fail(e)
+                continue
+            finally:
+                with self._lock:
+                    self.busy_time += time.time() - start_time
+                    self.processed += 1
+
+            if self.output_queue is not None:
+                for output in outputs:
+                    self.output_queue.put(output)
+
+class TaskPipeline:
+    """按阶段流水线执行单个任务：获取 → 整理 → AI评估 → 生成简报 → 汇总
+
+    相邻阶段通过有界队列连接，第一个Feed的文章可以在其余Feed仍在下载时就开始评估，
+    评估通过的文章随即进入简报生成。任务总耗时趋近于最慢阶段的耗时，而不是各阶段耗时之和。
+    邮件仍在流水线结束后一次性发送，每个收件人只收到一封简报。
+    """
+
+    def __init__(self, rss_parser, content_filter, summarizer, settings: Optional[Dict[str, Any]] = None,
+                 dedup_settings: Optional[Dict[str, Any]] = None):
+        """初始化流水线
+
+        Args:
+            rss_parser: RssParser 实例
+            content_filter: ContentFilter 实例
+            summarizer: NewsSummarizer 实例
+            settings: 流水线设置，参见 DEFAULT_PIPELINE_SETTINGS
+            dedup_settings: 近似重复合并设置，参见 DEFAULT_DEDUP_SETTINGS；为None时不合并
+        """
+        self.rss_parser = rss_parser
+        self.content_filter = content_filter
+        self.summarizer = summarizer
+        self.settings = dict(DEFAULT_PIPELINE_SETTINGS)
+        self.settings.update(settings or {})
+        self.dedup_settings = dedup_settings
+
+        self.error: Optional[Exception] = None
+        self._error_lock = threading.Lock()
+
+    def fail(self, error: Exception):
+        """记录第一个致命错误，之后各阶段不再处理新的条目"""
+        with self._error_lock:
+            if self.error is None:
+                self.error = error
+
+    def run(self, task, feed_configs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """执行任务的流水线
+
+        Args:
+            task: 任务对象
+            feed_configs: 包含Feed URL和获取条目数的字典列表
+
+        Returns:
+            包含以下键的字典:
+                feed_results: URL到Feed结果的映射（顺序与feed_configs一致）
+                contents: 获取到的全部内容
+                kept_contents: 保留并已生成简报的内容（按Feed配置顺序排列）
+                discarded_contents: 被丢弃的内容
+                duplicates: 合并到代表文章、未单独评估的近似重复内容
+                error: AI评估或简报生成阶段的致命错误，没有则为None
+                stage_times: 各阶段累计耗时（秒）
+        """
+        self.error = None
+        queue_size = max(1, int(self.settings.get("queue_size", 32)))
+        evaluate_workers = self.settings.get("evaluate_workers")
+        if not evaluate_workers:
+            # 遵循 filter_settings 中的并发评估设置和AI提供商的并发上限
+            worker_count = getattr(self.content_filter, "evaluation_worker_count", None)
+            evaluate_workers = worker_count() if worker_count else 1
+        evaluate_workers = max(1, int(evaluate_workers))
+        summarize_workers = max(1, int(self.settings.get("summarize_workers", 1)))
+
+        feed_order = {}
+        for config in feed_configs:
+            feed_order.setdefault(config.get("url"), len(feed_order))
+
+        fetched_queue = queue.Queue(maxsize=queue_size)
+        evaluate_queue = queue.Queue(maxsize=queue_size)
+        summarize_queue = queue.Queue(maxsize=queue_size)
+        render_queue = queue.Queue(maxsize=queue_size)
+
+        contents: List[Dict[str, Any]] = []
+        discarded_contents: List[Dict[str, Any]] = []
+        duplicates: List[Dict[str, Any]] = []
+        collapser = None
+        if self.dedup_settings and self.dedup_settings.get("enabled", True):
+            collapser = NearDuplicateCollapser.from_settings(self.dedup_settings)
+        rendered: List[tuple] = []
+        results_lock = threading.Lock()
+
+        def clean(fetched):
+            """为条目附加Feed标签、反向标签和任务对象，并记录其在简报中的排序位置"""
+            feed_url, result = fetched
+            if result.get("status") != "success":
+                return []
+            items = result.get("items", [])
+            feed_labels = task.get_feed_labels(feed_url)
+            negative_labels = task.get_feed_negative_labels(feed_url)
+            logger.info(f"从 {feed_url} 添加 {len(items)} 条内容到流水线，标签: {feed_labels}, 反向标签: {negative_labels}")
+
+            prepared = []
+            for item_index, item in enumerate(items):
+                item["feed_url"] = feed_url
+                item["feed_labels"] = feed_labels
+                item["negative_labels"] = negative_labels
+                item["task"] = task
+                with results_lock:
+                    contents.append(item)
+                # 与已进入流水线的文章近似重复时，只附加到代表文章上，不再单独评估
+                if collapser is not None and collapser.add(item) is not None:
+                    with results_lock:
+                        duplicates.append(item)
+                    continue
+                prepared.append(((feed_order.get(feed_url, len(feed_order)), item_index), item))
+            
+            # 本地词法预过滤丢弃的内容不进入评估阶段
+            if getattr(self.content_filter, "prefilter", None) is not None:
+                remaining = set(self.content_filter.prefilter_contents([item for _, item in prepared]))
+                with results_lock:
+                    discarded_contents.extend(item for i, (_, item) in enumerate(prepared) if i not in remaining)
+                prepared = [entry for i, entry in enumerate(prepared) if i in remaining]
+            
+            # 批量评估模式下，同一Feed的内容标签相同，按批次整体交给评估阶段
+            if getattr(self.content_filter, "batch_evaluation", False):
+                items = [item for _, item in prepared]
+                return [[prepared[i] for i in batch] for batch in self.content_filter.build_evaluation_batches(items)]
+            return prepared
+
+        evaluated_count = 0
+
+        def evaluate(entry):
+            nonlocal evaluated_count
+            entries = entry if isinstance(entry, list) else [entry]
+            with results_lock:
+                index = evaluated_count
+                evaluated_count += len(entries)
+                total = len(contents)
+            
+            if isinstance(entry, list):
+                outputs = self.content_filter.filter_content_group(
+                    [item for _, item in entries], list(range(index, index + len(entries))), total
+                )
+            else:
+                outputs = [self.content_filter.filter_content(entry[1], index, total)]
+            
+            kept = []
+            for (position, _), (evaluated, keep) in zip(entries, outputs):
+                if keep:
+                    kept.append((position, evaluated))
+                else:
+                    with results_lock:
+                        discarded_contents.append(evaluated)
+            return kept
+
+        consecutive_summary_failures = 0
+
+        def summarize(entry):
+            nonlocal consecutive_summary_failures
+            position, item = entry
+            title = item.get("title", "无标题")
+            logger.info(f"生成简报: {title[:50]}{'...' if len(title) > 50 else ''}")
+            try:
+                summarized = self.summarizer.generate_summary(item)
+                with results_lock:
+                    consecutive_summary_failures = 0
+            except Exception as e:
+                logger.error(f"生成简报时出错: {str(e)}")
+                # 与 generate_summaries 一致：连续多条失败时可能是AI服务存在问题，中断流水线
+                with results_lock:
+                    consecutive_summary_failures += 1
+                    failures = consecutive_summary_failures
+                if failures >= MAX_CONSECUTIVE_SUMMARY_FAILURES:
+                    raise AiException(f"连续多条内容生成简报失败，可能是AI服务存在问题: {str(e)}")
+                summarized = self.summarizer.mark_summary_error(item, e)
+            return [(position, summarized)]
+
+        def render(entry):
+            with results_lock:
+                rendered.append(entry)
+            return []
+
+        stages = [
+            _Stage("clean", clean, 1, fetched_queue, evaluate_queue, self),
+            _Stage("evaluate", evaluate, evaluate_workers, evaluate_queue, summarize_queue, self),
+            _Stage("summarize", summarize, summarize_workers, summarize_queue, render_queue, self),
+            _Stage("render", render, 1, render_queue, None, self)
+        ]
+        for stage, next_stage in zip(stages, stages[1:] + [None]):
+            stage.start(next_stage.workers if next_stage else 0)
+
+        logger.info(f"流水线启动: 评估并发 {evaluate_workers}, 简报并发 {summarize_workers}, 队列长度 {queue_size}")
+        start_time = time.time()
+        try:
+            feed_results = self.rss_parser.fetch_multiple_feeds(
+                feed_configs, task.task_id, task.recipients,
+                on_result=lambda url, result: fetched_queue.put((url, result))
+            )
+        finally:
+            fetched_queue.put(_STOP)
+        fetch_time = time.time() - start_time
+
+        for stage in stages:
+            stage.join()
+        total_time = time.time() - start_time
+
+        rendered.sort(key=lambda entry: entry[0])
+        stage_times = {"fetch": fetch_time}
+        stage_times.update({stage.name: stage.busy_time for stage in stages})
+        if duplicates:
+            logger.info(f"近似重复合并: {len(contents)} 篇文章中有 {len(duplicates)} 篇为重复，未单独评估")
+        logger.info(f"流水线完成，总耗时 {total_time:.2f}秒，各阶段累计耗时: "
+                    + ", ".join(f"{name}={seconds:.2f}秒" for name, seconds in stage_times.items()))
+        log_cache_stats = getattr(self.summarizer, "log_cache_stats", None)
+        if log_cache_stats:
+            log_cache_stats()
+        ai_service = getattr(self.content_filter, "ai_service", None)
+        if ai_service is not None and hasattr(ai_service, "log_stream_stats"):
+            ai_service.log_stream_stats()
+
+        return {
+            "feed_results": feed_results,
+            "contents": contents,
+            "kept_contents": [item for _, item in rendered],
+            "discarded_contents": discarded_contents,
+            "duplicates": duplicates,
+            "error": self.error,
+            "stage_times": stage_times
+        }
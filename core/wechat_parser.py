@@ -1,4 +1,3 @@
-import requests
 import logging
 import hashlib
 from datetime import datetime
@@ -6,6 +5,7 @@ import pytz  # 添加时区支持
 from bs4 import BeautifulSoup
 from typing import Dict, Any, List
 from .config_manager import load_config  # 添加导入
+from .http_client import HttpClient
 import re # Add re import for whitespace normalization
 
 logger = logging.getLogger("wechat_parser")
@@ -13,8 +13,14 @@ logger = logging.getLogger("wechat_parser")
 class WeChatParser:
     """Parser for WeChat public account content, which needs special handling"""
     
-    def __init__(self):
-        """Initialize the WeChat parser"""
+    def __init__(self, http_client: HttpClient = None):
+        """Initialize the WeChat parser
+        
+        Args:
+            http_client: Shared HTTP client used for downloads. A private one is created if omitted.
+        """
+        self.http_client = http_client or HttpClient()
+        
         # Setup warnings filter to suppress XMLParsedAsHTMLWarning
         try:
             from bs4 import XMLParsedAsHTMLWarning
@@ -68,7 +74,7 @@ class WeChatParser:
         try:
             # Download the content
             logger.info(f"Downloading WeChat content from: {feed_url}")
-            response = requests.get(feed_url, timeout=15)
+            response = self.http_client.get(feed_url)
             response.encoding = 'utf-8'  # WeChat often uses UTF-8
             
             # Save the HTML for debugging if needed
@@ -706,7 +706,7 @@ class SettingsWindow(QDialog):
         self.tabs.addTab(general_tab, get_text("general"))
 
     def clear_rss_cache(self):
-        """清除RSS新闻缓存数据库"""
+        """清除RSS新闻缓存数据库，以及AI评估缓存、简报缓存和过滤结论"""
         reply = QMessageBox.question(
             self, 
             get_text("confirm_clear_cache"), 
@@ -720,9 +720,14 @@ class SettingsWindow(QDialog):
                 import sqlite3
                 import os
                 
+                from ai_processor.ai_cache import clear_ai_caches
+                
                 # 数据库文件路径
                 db_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'rss_news.db')
                 
+                # 清除缓存的AI评估、简报和本地分类器使用的过滤结论，避免继续复用旧的结果
+                clear_ai_caches()
+                
                 if os.path.exists(db_path):
                     # 连接数据库
                     conn = sqlite3.connect(db_path)
@@ -882,19 +887,23 @@ class SettingsWindow(QDialog):
         else:
             ai_provider = "siliconflow"
             
-        ai_settings = {
+        # 在现有设置的基础上更新，保留界面中没有的高级设置（如并发上限、速率限制）
+        ai_settings = dict(self.global_settings.get("ai_settings", {}))
+        ai_settings.update({
             "provider": ai_provider,
             "ollama_host": self.ollama_host.text(),
             "ollama_model": self.ollama_model.currentText(),
             "openai_model": self.openai_model.currentText(),
             "siliconflow_model": self.siliconflow_model.currentText(),
-        }
+        })
         
         # 只有当OpenAI密钥不为空时才保存
+        ai_settings.pop("openai_key", None)
         if self.openai_key.text():
             ai_settings["openai_key"] = self.openai_key.text()
             
         # 只有当硅基流动密钥不为空时才保存
+        ai_settings.pop("siliconflow_key", None)
         if self.siliconflow_key.text():
             ai_settings["siliconflow_key"] = self.siliconflow_key.text()
         
@@ -0,0 +1,93 @@
+import unittest
+import tempfile
+import shutil
+import os
+import sys
+import time
+
+# 将项目根目录添加到Python路径中，解决导入问题
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ai_processor.ai_cache import SummaryCache, EvaluationCache, clear_ai_caches
+from ai_processor.verdict_classifier import VerdictStore
+from ai_processor.summarizer import NewsSummarizer
+
+class TestSummaryCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = SummaryCache(os.path.join(self.temp_dir, "ai_cache.db"), max_entries=3)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_lru_eviction(self):
+        for i in range(3):
+            self.cache.put(f"key{i}", f"title{i}", f"brief{i}", "ai")
+            time.sleep(0.01)
+        # Touch key0 so key1 becomes the least recently used entry
+        self.assertEqual(self.cache.get("key0")["news_brief"], "brief0")
+        self.cache.put("key3", "title3", "brief3", "ai")
+
+        self.assertIsNone(self.cache.get("key1"))
+        self.assertIsNotNone(self.cache.get("key0"))
+        self.assertIsNotNone(self.cache.get("key3"))
+        self.assertEqual(self.cache.stats()["hits"], 3)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_clear_ai_caches_removes_all_ai_results(self):
+        db_path = os.path.join(self.temp_dir, "ai_cache.db")
+        evaluations, verdicts = EvaluationCache(db_path), VerdictStore(db_path)
+        self.cache.put("key0", "title0", "brief0", "ai")
+        evaluations.put("key0", {"keep": True}, "a1")
+        verdicts.add("labels", "a1", {}, "text", True, {})
+
+        self.assertEqual(clear_ai_caches(db_path), 3)
+        self.assertIsNone(self.cache.get("key0"))
+        self.assertIsNone(evaluations.get("key0"))
+        self.assertEqual(verdicts.label_sets(), [])
+
+    def test_summarizer_reuses_cached_brief(self):
+        config = {"global_settings": {"ai_settings": {"provider": "openai", "openai_key": "test-key"},
+                                      "summarize_settings": {"summary_cache": False}}}
+        summarizer = NewsSummarizer(config)
+        summarizer.summary_cache = self.cache
+        calls = []
+        def fake_call(prompt, max_retries=1, **kwargs):
+            calls.append(prompt)
+            return "Title: Translated headline\nA brief about the article that is long enough."
+        summarizer.ai_service.call_ai = fake_call
+
+        article = {"title": "原始标题", "content": "正文" * 100}
+        first = summarizer.generate_summary(dict(article))
+        second = summarizer.generate_summary(dict(article))
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(second["news_brief"], first["news_brief"])
+        self.assertEqual(second["title"], first["title"])
+        self.assertEqual(second.get("original_title"), first.get("original_title"))
+
+        # A different style or language is a different brief
+        summarizer.brief_style = "concise"
+        summarizer.generate_summary(dict(article))
+        self.assertEqual(len(calls), 2)
+
+    def test_truncated_title_fallback_is_not_cached(self):
+        config = {"global_settings": {"ai_settings": {"provider": "openai", "openai_key": "test-key"},
+                                      "summarize_settings": {"summary_cache": False}}}
+        summarizer = NewsSummarizer(config)
+        summarizer.summary_cache = self.cache
+        def fake_call(prompt, max_retries=1, purpose=None, **kwargs):
+            if purpose == "title":
+                raise Exception("title model unavailable")
+            return "A brief about the article that is long enough."
+        summarizer.ai_service.call_ai = fake_call
+
+        article = {"title": "A very long headline " * 5, "content": "Body text. " * 20}
+        result = summarizer.generate_summary(dict(article))
+
+        self.assertEqual(result["title"], article["title"][:67] + "...")
+        self.assertIsNone(self.cache.get(summarizer._summary_cache_key(dict(article))))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,262 @@
+import unittest
+import os
+import sys
+import json
+import re
+import time
+import tempfile
+import shutil
+import threading
+
+# 将项目根目录添加到Python路径中，解决导入问题
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ai_processor.ai_utils import TokenBucket
+from ai_processor.ai_cache import EvaluationCache
+from ai_processor.filter import ContentFilter
+from ai_processor.summarizer import NewsSummarizer
+from ai_processor.verdict_classifier import VerdictStore, VerdictClassifier
+
+def make_evaluation(is_match):
+    rating = {"rating": "高", "explanation": "test"}
+    return json.dumps({
+        "interest_match": {"is_match": is_match, "matched_tags": ["tech"] if is_match else [], "explanation": "test"},
+        "negative_match": {"is_match": False, "matched_tags": [], "explanation": "test"},
+        "importance": rating,
+        "timeliness": rating,
+        "interest_level": {"rating": "中" if is_match else "低", "explanation": "test"}
+    }, ensure_ascii=False)
+
+def make_config(**filter_settings):
+    # Tests opt into the evaluation cache and verdict store explicitly so they never touch data/ai_cache.db
+    filter_settings.setdefault("evaluation_cache", False)
+    filter_settings.setdefault("record_verdicts", False)
+    return {
+        "global_settings": {
+            "ai_settings": {
+                "provider": "openai",
+                "openai_key": "test-key",
+                "concurrency_limits": {"openai": 4},
+                "rate_limits_rpm": {"openai": 0}
+            },
+            "filter_settings": filter_settings
+        }
+    }
+
+class FakeProvider:
+    """Replaces the HTTP call of AiService; keeps articles whose title starts with 'keep'"""
+    def __init__(self, delay=0.0, malformed_first=()):
+        self.delay = delay
+        self.malformed_first = set(malformed_first)
+        self.active = 0
+        self.max_active = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt, json_schema=None):
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+        for title in list(self.malformed_first):
+            if title in prompt:
+                self.malformed_first.discard(title)
+                return "not json"
+        # Correction prompts only carry the previous response, answer them with a keep
+        return make_evaluation("标题：keep" in prompt or "未能满足格式要求" in prompt)
+
+class FakeBatchProvider(FakeProvider):
+    """Answers batch prompts with a JSON array; the element for `broken_title` lacks required fields"""
+    def __init__(self, broken_title=None):
+        super().__init__()
+        self.broken_title = broken_title
+        self.batch_calls = 0
+
+    def __call__(self, prompt, json_schema=None):
+        titles = re.findall(r"### 新闻 \d+\n标题：(.*)", prompt)
+        if not titles:
+            return super().__call__(prompt, json_schema)
+        with self._lock:
+            self.calls += 1
+            self.batch_calls += 1
+        elements = []
+        for number, title in enumerate(titles, 1):
+            element = json.loads(make_evaluation(title.startswith("keep")))
+            if title == self.broken_title:
+                del element["importance"]
+            element["index"] = number
+            elements.append(element)
+        # Out of order on purpose, results are matched by index
+        return json.dumps(list(reversed(elements)), ensure_ascii=False)
+
+class TestContentFilter(unittest.TestCase):
+    def make_filter(self, provider, **filter_settings):
+        content_filter = ContentFilter(make_config(**filter_settings))
+        content_filter.ai_service._call_openai = provider
+        return content_filter
+
+    def make_contents(self, count):
+        return [{"title": f"{'keep' if i % 3 else 'drop'}-{i}", "summary": "summary", "feed_labels": ["tech"]}
+                for i in range(count)]
+
+    def test_concurrent_batch_preserves_order(self):
+        provider = FakeProvider(delay=0.05)
+        content_filter = self.make_filter(provider, max_workers=8)
+        contents = self.make_contents(12)
+
+        start_time = time.time()
+        kept, discarded = content_filter.filter_content_batch(contents)
+        elapsed = time.time() - start_time
+
+        self.assertEqual([c["title"] for c in kept], [c["title"] for c in contents if c["title"].startswith("keep")])
+        self.assertEqual([c["title"] for c in discarded], [c["title"] for c in contents if c["title"].startswith("drop")])
+        # Never more requests in flight than the provider limit
+        self.assertLessEqual(provider.max_active, 4)
+        self.assertLess(elapsed, 12 * 0.05)
+
+    def test_correction_retry_in_concurrent_mode(self):
+        provider = FakeProvider(malformed_first=["keep-1"])
+        content_filter = self.make_filter(provider)
+        kept, discarded = content_filter.filter_content_batch(self.make_contents(3))
+
+        self.assertEqual([c["title"] for c in kept], ["keep-1", "keep-2"])
+        self.assertEqual(provider.calls, 4)
+
+    def test_batch_evaluation_with_fallback(self):
+        provider = FakeBatchProvider(broken_title="keep-4")
+        content_filter = self.make_filter(provider, batch_evaluation=True, batch_size=4)
+        contents = self.make_contents(7)
+        contents[6]["feed_labels"] = ["science"]  # Different labels go into a separate batch
+
+        kept, discarded = content_filter.filter_content_batch(contents)
+
+        self.assertEqual([c["title"] for c in kept], ["keep-1", "keep-2", "keep-4", "keep-5"])
+        self.assertEqual([c["title"] for c in discarded], ["drop-0", "drop-3", "drop-6"])
+        # Batches [0-3], [4, 5] and the single "science" article, plus one fallback call for keep-4
+        self.assertEqual(provider.batch_calls, 2)
+        self.assertEqual(provider.calls, 4)
+
+    def test_evaluation_cache_skips_ai_calls(self):
+        temp_dir = tempfile.mkdtemp()
+        cache = EvaluationCache(os.path.join(temp_dir, "ai_cache.db"), ttl_hours=1)
+        try:
+            provider = FakeProvider()
+            content_filter = self.make_filter(provider, max_workers=1)
+            content_filter.evaluation_cache = cache
+
+            contents = self.make_contents(3)
+            for i, content in enumerate(contents):
+                content["article_id"] = f"https://example.com/{i}"
+            content_filter.filter_content_batch([dict(c) for c in contents])
+            self.assertEqual(provider.calls, 3)
+
+            # Same articles and labels: served from the cache
+            kept, _ = content_filter.filter_content_batch([dict(c) for c in contents])
+            self.assertEqual(provider.calls, 3)
+            self.assertEqual([c["title"] for c in kept], ["keep-1", "keep-2"])
+
+            # Different labels or changed content miss the cache
+            changed = [dict(contents[0], feed_labels=["science"]), dict(contents[1], summary="updated")]
+            content_filter.filter_content_batch(changed)
+            self.assertEqual(provider.calls, 5)
+
+            # Expired entries are ignored and purged
+            cache.ttl_seconds = 0
+            time.sleep(0.01)
+            self.assertIsNone(content_filter._get_cached_evaluation(dict(contents[0])))
+            self.assertEqual(cache.purge_expired(), 5)
+        finally:
+            cache.close()
+            shutil.rmtree(temp_dir)
+
+    def test_lexical_prefilter_skips_obvious_non_matches(self):
+        provider = FakeProvider()
+        content_filter = self.make_filter(provider, lexical_prefilter=True)
+        contents = [
+            {"title": "keep-0 new processor", "summary": "The technology company released a processor"},
+            {"title": "drop-1 league results", "summary": "The home team won the match on Sunday"},
+            {"title": "drop-2 football transfer news", "summary": "A tech startup sponsors the club"},
+            {"title": "keep-3 国产芯片发布", "summary": "新一代芯片"}  # Different script, left to the AI
+        ]
+        for content in contents:
+            content.update({"feed_labels": ["tech"], "negative_labels": ["football"]})
+
+        kept, discarded = content_filter.filter_content_batch(contents)
+
+        self.assertEqual([c["title"] for c in kept], ["keep-0 new processor", "keep-3 国产芯片发布"])
+        self.assertEqual([c["discard_reason"] for c in discarded], ["prefilter_no_label_match", "prefilter_negative_match"])
+        self.assertEqual(provider.calls, 2)
+
+    def test_local_classifier_skips_confident_discards(self):
+        temp_dir = tempfile.mkdtemp()
+        store = VerdictStore(os.path.join(temp_dir, "ai_cache.db"))
+        try:
+            provider = FakeProvider()
+            content_filter = self.make_filter(provider, max_workers=1)
+            content_filter.verdict_classifier = VerdictClassifier(store, min_samples=40, min_agreement=0.9)
+
+            def make_articles(start, count):
+                articles = []
+                for i in range(start, start + count):
+                    topic = "new chip and gpu research" if i % 2 else "football league match report"
+                    articles.append({"title": f"{'keep' if i % 2 else 'drop'}-{i} {topic}", "summary": f"{topic} {topic}",
+                                     "article_id": f"https://example.com/{i}", "feed_labels": ["tech"]})
+                return articles
+
+            # The LLM verdicts of the first run become training data
+            content_filter.filter_content_batch(make_articles(0, 60))
+            self.assertEqual(provider.calls, 60)
+
+            content_filter.local_classifier = True
+            kept, discarded = content_filter.filter_content_batch(make_articles(100, 10))
+
+            self.assertEqual(len(kept), 5)
+            self.assertTrue(all(c["discard_reason"] == "classifier_discard" for c in discarded))
+            # Only the articles the model would keep still go to the LLM
+            self.assertEqual(provider.calls, 65)
+            self.assertTrue(content_filter.verdict_classifier.agreement_report()[0]["enabled"])
+        finally:
+            store.close()
+            shutil.rmtree(temp_dir)
+
+    def test_combined_summary_uses_one_call(self):
+        def provider(prompt, json_schema=None):
+            calls.append(prompt)
+            evaluation = json.loads(make_evaluation("标题：keep" in prompt))
+            evaluation.update({"title": "简化后的标题", "brief": "一段足够长的中文新闻简报。"})
+            return json.dumps(evaluation, ensure_ascii=False)
+        calls = []
+        config = make_config(combined_summary=True)
+        config["global_settings"]["summarize_settings"] = {"summary_cache": False}
+        summarizer = NewsSummarizer(config)
+        summarizer.language = "zh"
+        summarizer.ai_service._call_openai = provider
+        content_filter = ContentFilter(config, summarizer)
+        content_filter.ai_service._call_openai = provider
+
+        contents = [{"title": f"{prefix}-{i} English headline", "content": "body " * 50, "feed_labels": ["tech"]}
+                    for i, prefix in enumerate(["keep", "drop"])]
+        kept, discarded = content_filter.filter_content_batch(contents)
+        self.assertIn('"brief"', calls[0])
+        self.assertNotIn("brief", kept[0]["evaluation"])
+        self.assertNotIn("combined_brief", discarded[0])
+
+        summarized = summarizer.generate_summary(kept[0])
+        self.assertEqual(len(calls), 2)  # One per article, no separate summary call
+        self.assertEqual(summarized["news_brief"], "一段足够长的中文新闻简报。")
+        self.assertEqual(summarized["title"], "简化后的标题")
+        self.assertEqual(summarized["original_title"], "keep-0 English headline")
+
+    def test_token_bucket_limits_rate(self):
+        bucket = TokenBucket(rate_per_minute=600, capacity=2)  # 10 per second
+        start_time = time.time()
+        for _ in range(5):
+            bucket.acquire()
+        # Two from the burst, three more at 0.1s each
+        self.assertGreaterEqual(time.time() - start_time, 0.25)
+
+if __name__ == "__main__":
+    unittest.main()
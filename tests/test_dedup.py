@@ -0,0 +1,67 @@
+import unittest
+import os
+import sys
+
+# 将项目根目录添加到Python路径中，解决导入问题
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ai_processor.dedup import NearDuplicateCollapser, SimHashIndex
+
+WIRE_STORY = ("The central bank raised interest rates by a quarter point on Wednesday, citing persistent inflation "
+              "in services and a tight labor market. Officials signaled that further increases remain possible "
+              "if price pressures do not ease over the coming months, while markets had largely expected the move.")
+
+CN_STORY = ("国家统计局周三公布的数据显示，十月份全国居民消费价格同比上涨百分之二点一，涨幅较上月扩大零点三个百分点。"
+            "其中食品价格上涨明显，猪肉价格环比上涨百分之八，服务价格保持稳定，分析人士认为物价总体运行在合理区间。")
+
+class TestNearDuplicateCollapser(unittest.TestCase):
+    def test_collapses_syndicated_copies(self):
+        contents = [
+            {"title": "Central bank raises rates", "summary": WIRE_STORY, "link": "https://a.example.com/1",
+             "source": "Wire A", "article_id": "a1"},
+            {"title": "国家统计局：十月CPI同比上涨2.1%", "summary": CN_STORY, "link": "https://cn.example.com/1",
+             "source": "新闻A", "article_id": "c1"},
+            {"title": "Chip maker unveils new processor", "link": "https://c.example.com/1", "article_id": "x1",
+             "summary": "The company introduced a processor with more cores and lower power draw, aimed at laptops "
+                        "and small servers, with shipments planned for the second half of next year."},
+            {"title": "Central bank raises interest rates", "link": "https://b.example.com/2", "source": "Paper B",
+             "article_id": "a2", "summary": WIRE_STORY.replace("on Wednesday", "Wednesday") + " Reporting by staff."},
+            {"title": "十月CPI同比上涨2.1%", "summary": CN_STORY.replace("数据显示", "数据表明"),
+             "link": "https://cn.example.com/2", "source": "新闻B", "article_id": "c2"},
+        ]
+
+        unique, duplicates = NearDuplicateCollapser().collapse(contents)
+
+        self.assertEqual([c["article_id"] for c in unique], ["a1", "c1", "x1"])
+        self.assertEqual([c["duplicate_of"] for c in duplicates], ["a1", "c1"])
+        self.assertEqual(unique[0]["duplicate_article_ids"], ["a2"])
+        self.assertEqual(unique[0]["duplicate_sources"][0]["link"], "https://b.example.com/2")
+        self.assertNotIn("duplicate_sources", unique[2])
+
+    def test_copies_from_feeds_with_different_labels_are_kept(self):
+        contents = [
+            {"title": "Central bank raises rates", "summary": WIRE_STORY, "article_id": "a1",
+             "feed_labels": ["sports"], "negative_labels": ["finance"]},
+            {"title": "Central bank raises rates", "summary": WIRE_STORY, "article_id": "a2",
+             "feed_labels": ["economy"], "negative_labels": []},
+            {"title": "Central bank raises rates", "summary": WIRE_STORY, "article_id": "a3",
+             "feed_labels": ["economy"], "negative_labels": []},
+        ]
+
+        unique, duplicates = NearDuplicateCollapser().collapse(contents)
+
+        # Each feed's copy is evaluated against its own labels, only same-label copies collapse
+        self.assertEqual([c["article_id"] for c in unique], ["a1", "a2"])
+        self.assertEqual([c["duplicate_of"] for c in duplicates], ["a2"])
+        self.assertNotIn("duplicate_article_ids", unique[0])
+
+    def test_short_texts_are_not_collapsed(self):
+        unique, duplicates = NearDuplicateCollapser().collapse([{"title": "Update"}, {"title": "Update"}])
+        self.assertEqual(len(unique), 2)
+        self.assertEqual(duplicates, [])
+
+    def test_index_finds_fingerprints_within_distance(self):
+        index = SimHashIndex(max_distance=3)
+        index.add(0b1011, "near")
+        index.add((1 << 64) - 1, "far")
+        self.assertEqual(index.query(0b0000), ["near"])
@@ -0,0 +1,43 @@
+import unittest
+import os
+import sys
+
+# 将项目根目录添加到Python路径中，解决导入问题
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.http_client import HttpClient, ACCEPT_ENCODING
+from core.wechat_parser import WeChatParser
+
+class TestHttpClient(unittest.TestCase):
+    def test_session_is_configured_from_fetch_settings(self):
+        client = HttpClient.from_settings({"max_workers": 5, "connect_timeout": 3, "read_timeout": 7}, "Test Agent/1.0")
+        try:
+            adapter = client.session.get_adapter("https://example.com/feed")
+            self.assertIs(client.session.get_adapter("http://example.com/feed"), adapter)
+            self.assertEqual(adapter._pool_maxsize, 5)
+            self.assertEqual(adapter.max_retries.total, 2)
+            self.assertEqual(client.session.headers["User-Agent"], "Test Agent/1.0")
+            self.assertEqual(client.session.headers["Accept-Encoding"], ACCEPT_ENCODING)
+            self.assertIn("gzip", ACCEPT_ENCODING)
+            self.assertEqual(client.timeout, (3, 7))
+        finally:
+            client.close()
+
+    def test_get_uses_default_timeout(self):
+        client = HttpClient(connect_timeout=2, read_timeout=4)
+        calls = []
+        client.session.get = lambda url, headers=None, **kwargs: calls.append((url, headers, kwargs))
+
+        client.get("https://example.com/feed", headers={"If-None-Match": "v1"})
+        client.get("https://example.com/feed", timeout=1)
+
+        self.assertEqual(calls[0], ("https://example.com/feed", {"If-None-Match": "v1"}, {"timeout": (2, 4)}))
+        self.assertEqual(calls[1][2], {"timeout": 1})
+
+    def test_wechat_parser_shares_the_client(self):
+        client = HttpClient()
+        self.assertIs(WeChatParser(client).http_client, client)
+        self.assertIsInstance(WeChatParser().http_client, HttpClient)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,6 +9,7 @@ import datetime
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from core.news_db_manager import NewsDBManager
+from ai_processor.call_metrics import RunMetrics
 
 class TestNewsDBManager(unittest.TestCase):
     def setUp(self):
@@ -18,6 +19,8 @@ class TestNewsDBManager(unittest.TestCase):
         self.db_manager = NewsDBManager(self.db_path)
     
     def tearDown(self):
+        # Close the cached connections so SQLite removes its WAL files
+        self.db_manager.close()
         # Clean up the temporary file
         if os.path.exists(self.db_path):
             os.remove(self.db_path)
@@ -46,6 +49,27 @@ class TestNewsDBManager(unittest.TestCase):
         )
         self.assertFalse(result)
     
+    def test_add_articles_in_batch(self):
+        self.db_manager.add_news_article(
+            article_id="http://example.com/existing",
+            title="Existing",
+            link="http://example.com/existing",
+            source="Test Source"
+        )
+        
+        new_ids = self.db_manager.add_news_articles([
+            {"article_id": "http://example.com/existing", "title": "Existing again"},
+            {"article_id": "http://example.com/new1?utm_source=rss", "title": "New 1", "source": "Test Source"},
+            {"article_id": "http://example.com/new2", "title": "New 2", "content_hash": "abc"},
+            {"article_id": "http://example.com/new1", "title": "Duplicate in batch"},
+        ])
+        
+        # Only the articles that were not stored yet are reported, with normalized IDs
+        self.assertEqual(new_ids, ["http://example.com/new1", "http://example.com/new2"])
+        self.assertTrue(self.db_manager.is_article_exists("http://example.com/new1"))
+        self.assertTrue(self.db_manager.is_article_exists("http://example.com/new2"))
+        self.assertEqual(self.db_manager.add_news_articles([]), [])
+    
     def test_article_exists(self):
         # Add an article
         self.db_manager.add_news_article(
@@ -173,5 +197,115 @@ class TestNewsDBManager(unittest.TestCase):
         self.assertIn("article3", processed)
         self.assertNotIn("article2", processed)
 
+    def test_feed_cache(self):
+        # Nothing stored yet
+        self.assertIsNone(self.db_manager.get_feed_cache("http://example.com/feed", "task1"))
+        
+        # Store validators for one task
+        self.db_manager.update_feed_cache("http://example.com/feed", "task1",
+                                          etag='"abc"', last_modified="Mon, 01 Jan 2024 00:00:00 GMT",
+                                          fingerprint="f1")
+        cache = self.db_manager.get_feed_cache("http://example.com/feed", "task1")
+        self.assertEqual(cache["etag"], '"abc"')
+        self.assertEqual(cache["fingerprint"], "f1")
+        
+        # Validators are kept per task
+        self.assertIsNone(self.db_manager.get_feed_cache("http://example.com/feed", "task2"))
+        
+        # Clearing a task removes its validators
+        self.assertEqual(self.db_manager.clear_feed_cache("task1"), 1)
+        self.assertIsNone(self.db_manager.get_feed_cache("http://example.com/feed", "task1"))
+
+    def test_processed_article_ids_for_task(self):
+        self.db_manager.mark_as_discarded_for_task("http://example.com/a?utm_source=x", "task1")
+        self.db_manager.mark_as_sent_to_recipient("http://example.com/b", "user1@example.com", "task1")
+        self.db_manager.mark_as_sent_to_recipient("http://example.com/b", "user2@example.com", "task1")
+        self.db_manager.mark_as_sent_to_recipient("http://example.com/c", "user1@example.com", "task2")
+        
+        # Whole-task preload
+        discarded, sent = self.db_manager.get_processed_article_ids_for_task("task1")
+        self.assertEqual(discarded, {"http://example.com/a"})
+        self.assertEqual(sent, {"http://example.com/b"})
+        
+        # Batch lookup normalizes the IDs and only returns matches of the task
+        discarded, sent = self.db_manager.get_processed_articles_in_batch(
+            ["http://example.com/a?ref=rss", "http://example.com/b", "http://example.com/c"], "task1")
+        self.assertEqual(discarded, {"http://example.com/a"})
+        self.assertEqual(sent, {"http://example.com/b"})
+
+    def test_run_metrics(self):
+        metrics = RunMetrics("task1")
+        metrics.record_call("ollama", "m", "evaluate", 1200, 150, False, 2.0, 0, True)
+        metrics.record_call("ollama", "m", "correct", 1300, 140, True, 2.5, 1, True)
+        metrics.record_call("ollama", "m", "evaluate", 1100, 160, False, 1.5, 0, True)
+        metrics.record_cache_hit("ollama", "m", "evaluate")
+        metrics.finish()
+        self.assertTrue(self.db_manager.save_run_metrics("task1", metrics.started_at, metrics.finished_at,
+                                                         metrics.breakdown()))
+        
+        runs = self.db_manager.get_run_metrics("task1")
+        self.assertEqual(len(runs), 1)
+        evaluate = next(row for row in runs[0]["rows"] if row["purpose"] == "evaluate")
+        self.assertEqual((evaluate["calls"], evaluate["cache_hits"], evaluate["prompt_tokens"]), (2, 1, 2300))
+        self.assertEqual(metrics.summary()["totals"]["retries"], 1)
+        self.assertEqual(self.db_manager.get_run_metrics("task2"), [])
+
+    def test_connections_are_cached_per_thread(self):
+        import threading
+        
+        conn = self.db_manager._get_connection()
+        self.assertIs(conn, self.db_manager._get_connection())
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        
+        # Other threads get their own connection and can write concurrently
+        other_connections = []
+        def worker(index):
+            other_connections.append(self.db_manager._get_connection())
+            self.db_manager.mark_as_discarded_for_task(f"article{index}", "task1")
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertTrue(all(other is not conn for other in other_connections))
+        discarded, _ = self.db_manager.get_processed_article_ids_for_task("task1")
+        self.assertEqual(len(discarded), 4)
+    
+    def test_schema_migrations(self):
+        import sqlite3
+        from core.news_db_manager import SCHEMA_VERSION
+        
+        self.assertEqual(self.db_manager.get_schema_version(), SCHEMA_VERSION)
+        
+        # A database created before versioning (user_version 0) is upgraded in place
+        legacy_path = os.path.join(self.temp_dir, "legacy_news.db")
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("CREATE TABLE news_articles (id INTEGER PRIMARY KEY AUTOINCREMENT, article_id TEXT UNIQUE, title TEXT, "
+                     "link TEXT, source TEXT, published_date TEXT, retrieved_date TEXT, content_hash TEXT, processed INTEGER DEFAULT 0)")
+        conn.execute("CREATE TABLE sent_articles (id INTEGER PRIMARY KEY AUTOINCREMENT, article_id TEXT, recipient TEXT, "
+                     "task_id TEXT, sent_date TEXT, UNIQUE(article_id, recipient, task_id))")
+        conn.execute("INSERT INTO sent_articles (article_id, recipient, task_id, sent_date) VALUES ('a1', 'r1', 'task1', '2024-01-01')")
+        conn.commit()
+        conn.close()
+        
+        legacy_manager = NewsDBManager(legacy_path)
+        try:
+            self.assertEqual(legacy_manager.get_schema_version(), SCHEMA_VERSION)
+            self.assertTrue(legacy_manager.is_article_sent_for_task("a1", "task1"))
+            
+            indexes = {row[0] for row in legacy_manager._get_connection().execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index'")}
+            self.assertIn("idx_sent_articles_task_article", indexes)
+            self.assertIn("idx_news_articles_retrieved_date", indexes)
+            
+            # Applying again is a no-op
+            self.assertEqual(legacy_manager.apply_migrations(), SCHEMA_VERSION)
+        finally:
+            legacy_manager.close()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(legacy_path + suffix):
+                    os.remove(legacy_path + suffix)
+
 if __name__ == "__main__":
     unittest.main()
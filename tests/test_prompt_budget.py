@@ -0,0 +1,59 @@
+import unittest
+import os
+import sys
+
+# 将项目根目录添加到Python路径中，解决导入问题
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ai_processor.call_metrics import estimate_tokens
+from ai_processor.prompt_budget import split_sentences, select_sentences, summary_duplicates_content, fit_article, ELLIPSIS
+
+LEAD = "The central bank raised interest rates by a quarter point on Wednesday, citing inflation. "
+FILLER = ("Reporters gathered outside the building before noon. Traffic in the capital was light. "
+          "A press conference was streamed online. The statement ran to four pages. "
+          "Several ministers were travelling abroad. Photographers waited near the entrance. ")
+KEY = "The central bank said interest rates could rise again if inflation does not ease. "
+
+class TestPromptBudget(unittest.TestCase):
+    def test_sentences_rejoin_to_original(self):
+        text = "国家统计局周三公布数据。食品价格上涨明显；猪肉价格上涨。\nPrices rose 2.5 percent. Analysts agreed!"
+        self.assertEqual("".join(split_sentences(text)), text)
+        self.assertEqual(split_sentences(text)[0], "国家统计局周三公布数据。")
+
+    def test_keeps_lead_and_informative_sentences_within_budget(self):
+        text = LEAD + FILLER + KEY + FILLER
+        selected = select_sentences(text, 50, "Central bank raises interest rates")
+        self.assertLessEqual(estimate_tokens(selected), 50)
+        self.assertTrue(selected.startswith(LEAD))
+        self.assertIn(KEY.strip(), selected)
+        self.assertIn(ELLIPSIS, selected)
+        # Text within the budget is sent unchanged
+        self.assertEqual(select_sentences(LEAD, 50), LEAD)
+
+    def test_chinese_budget_counts_characters(self):
+        text = "".join(f"第{number}季度的数据显示居民消费价格温和上涨。" for number in range(30))
+        selected = select_sentences(text, 100)
+        self.assertLessEqual(estimate_tokens(selected), 100)
+        # Chinese text costs about a token per character, far fewer characters fit than in English
+        self.assertGreater(len(selected), 60)
+        self.assertLess(len(selected), 100)
+
+    def test_long_unpunctuated_text_is_truncated(self):
+        english = "word " * 20000
+        chinese = "数据" * 16000
+        for text in (english, chinese):
+            selected = select_sentences(text, 800)
+            self.assertLessEqual(estimate_tokens(selected), 800)
+            self.assertTrue(selected.endswith(ELLIPSIS))
+            self.assertTrue(text.startswith(selected[:-len(ELLIPSIS)]))
+
+    def test_summary_repeating_the_opening_is_dropped(self):
+        content = LEAD + KEY + FILLER
+        self.assertTrue(summary_duplicates_content(LEAD.strip() + " [...]", content))
+        self.assertFalse(summary_duplicates_content("A startup released a new phone with a folding screen.", content))
+        self.assertEqual(fit_article(LEAD, content, "", 100, 200), ("", content))
+        # Without content the summary is all there is
+        self.assertEqual(fit_article(LEAD, "", "", 100, 100), (LEAD, ""))
+
+if __name__ == '__main__':
+    unittest.main()
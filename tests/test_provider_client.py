@@ -0,0 +1,363 @@
+import unittest
+import os
+import sys
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 将项目根目录添加到Python路径中，解决导入问题
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ai_processor.ai_utils import AiService, AiException, CircuitOpenError, uses_ollama
+from ai_processor.retry_policy import parse_retry_after
+from ai_processor.call_metrics import RunMetrics
+from ai_processor.provider_client import ProviderClient
+from ai_processor.json_stream import JsonStreamScanner
+from ai_processor.filter import build_evaluation_schema
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    connections = set()
+    formats = []
+    models = []
+    reject_format = False
+    errors = []  # (status, headers[, body]) replies sent before answering normally
+    ports = []   # server port of each generate request
+    keep_alives = []
+    delay = 0.0
+
+    def _reply(self, body):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply(b'{"models": []}')
+
+    def do_POST(self):
+        self.connections.add(self.client_address)
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        self.formats.append(request.get("format"))
+        self.models.append(request.get("model"))
+        self.ports.append(self.server.server_port)
+        self.keep_alives.append((request.get("prompt"), request.get("keep_alive")))
+        time.sleep(self.delay)
+        if self.errors:
+            status, headers, *body = self.errors.pop(0)
+            body = body[0] if body else b""
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if "format" in request and self.reject_format:
+            body = b'{"error": "invalid format"}'
+            self.send_response(400)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if not request.get("stream"):
+            self._reply(json.dumps({"response": "ok", "prompt_eval_count": 7, "eval_count": 1}).encode())
+            return
+        # Streams an evaluation object, then slow trailing chatter
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        pieces = ["<think>{maybe}</think>", '{"keep": ', '"yes }"', "}", " Hope this helps!"] + [" more"] * 20
+        try:
+            for piece in pieces:
+                self.wfile.write((json.dumps({"response": piece, "done": False}) + "\n").encode())
+                self.wfile.flush()
+                if piece.startswith(" "):
+                    time.sleep(0.05)
+            self.wfile.write((json.dumps({"response": "", "done": True}) + "\n").encode())
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+class TestProviderClient(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllamaHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.host = f"http://127.0.0.1:{self.server.server_port}"
+        FakeOllamaHandler.connections.clear()
+        FakeOllamaHandler.formats = []
+        FakeOllamaHandler.models = []
+        FakeOllamaHandler.reject_format = False
+        FakeOllamaHandler.errors = []
+        FakeOllamaHandler.ports = []
+        FakeOllamaHandler.keep_alives = []
+        FakeOllamaHandler.delay = 0.0
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_services_share_keep_alive_connections(self):
+        config = {"global_settings": {"ai_settings": {"provider": "ollama", "ollama_host": self.host, "ollama_model": "m"}}}
+        filter_service, summary_service = AiService(config), AiService(config)
+        self.assertIs(filter_service.client, summary_service.client)
+
+        for i in range(10):
+            (filter_service if i % 2 else summary_service)._call_ollama("prompt")
+
+        self.assertEqual(len(FakeOllamaHandler.connections), 1)
+        self.assertTrue(filter_service.health()["healthy"])
+
+    def test_health_state_tracks_failures(self):
+        client = ProviderClient()
+        self.assertTrue(client.check_health(f"{self.host}/api/tags"))
+
+        closed_host = "http://127.0.0.1:9"
+        self.assertFalse(client.check_health(f"{closed_host}/api/tags"))
+        # A fresh known state is reused without probing again
+        self.assertFalse(client.check_health(f"{closed_host}/api/tags"))
+        self.assertEqual(client.health_report()[closed_host]["consecutive_failures"], 1)
+        self.assertFalse(client.check_health(f"{closed_host}/api/tags", max_age=0))
+        self.assertEqual(client.health_report()[closed_host]["consecutive_failures"], 2)
+        client.close()
+
+    def test_streaming_stops_on_complete_json(self):
+        config = {"global_settings": {"ai_settings": {"provider": "ollama", "ollama_host": self.host,
+                                                      "ollama_model": "m", "streaming": True}}}
+        service = AiService(config)
+
+        start_time = time.time()
+        text = service.call_ai("prompt", stop_on_json="{")
+
+        self.assertEqual(text, '<think>{maybe}</think>{"keep": "yes }"}')
+        self.assertLess(time.time() - start_time, 0.5)  # The trailing chatter takes over a second
+        self.assertTrue(service.last_call_stats["stopped_early"])
+        self.assertIsNotNone(service.last_call_stats["ttft"])
+
+        # Without a JSON target the whole completion is read
+        self.assertIn("more", service.call_ai("prompt"))
+
+    def test_calls_are_accounted_per_purpose(self):
+        config = {"global_settings": {"ai_settings": {"provider": "ollama", "ollama_host": self.host, "ollama_model": "m"}}}
+        service = AiService(config)
+        service.metrics = RunMetrics("task")
+        service.call_ai("prompt", purpose="evaluate")
+        FakeOllamaHandler.errors = [(503, {})]
+        service.retry_settings["base_delay"] = 0.01
+        service.call_ai("prompt", purpose="evaluate")
+        service.record_cache_hit("evaluate")
+
+        # Streamed calls stopped early have no usage from the server and are estimated
+        service.streaming = True
+        service.call_ai("a longer prompt", stop_on_json="{", purpose="summarize")
+
+        evaluate, summarize = sorted(service.metrics.breakdown(), key=lambda group: group["purpose"])
+        self.assertEqual((evaluate["calls"], evaluate["retries"], evaluate["cache_hits"]), (2, 1, 1))
+        self.assertEqual((evaluate["prompt_tokens"], evaluate["completion_tokens"], evaluate["estimated_calls"]), (14, 2, 0))
+        self.assertEqual((summarize["calls"], summarize["estimated_calls"]), (1, 1))
+        self.assertGreater(summarize["completion_tokens"], 0)
+
+    def test_structured_output_schema_and_fallback(self):
+        config = {"global_settings": {"ai_settings": {"provider": "ollama", "ollama_host": self.host, "ollama_model": "m"}}}
+        service = AiService(config)
+        schema = build_evaluation_schema()
+        self.assertEqual(schema["properties"]["importance"]["properties"]["rating"]["enum"], ["极低", "低", "中", "高", "极高"])
+
+        service.call_ai("prompt", json_schema=schema)
+        service.call_ai("prompt")
+        self.assertEqual(FakeOllamaHandler.formats, [schema, None])
+
+        # A server that rejects the schema is retried once in plain mode, later calls skip the schema
+        FakeOllamaHandler.formats = []
+        FakeOllamaHandler.reject_format = True
+        self.assertEqual(service.call_ai("prompt", max_retries=0, json_schema=schema), "ok")
+        self.assertEqual(service.call_ai("prompt", max_retries=0, json_schema=schema), "ok")
+        self.assertEqual(FakeOllamaHandler.formats, [schema, None, None])
+        self.assertEqual(service.structured_output, "off")
+
+    def test_unrelated_bad_request_keeps_structured_output(self):
+        config = {"global_settings": {"ai_settings": {"provider": "ollama", "ollama_host": self.host, "ollama_model": "m"}}}
+        service = AiService(config)
+        schema = build_evaluation_schema()
+        mode = service.structured_output
+
+        FakeOllamaHandler.errors = [(400, {}, b'{"error": "prompt exceeds the context length of 4096 tokens"}')]
+        with self.assertRaises(AiException):
+            service.call_ai("prompt", max_retries=0, json_schema=schema)
+        self.assertEqual(FakeOllamaHandler.formats, [schema])
+        self.assertEqual(service.structured_output, mode)
+
+        service.call_ai("prompt", json_schema=schema)
+        self.assertEqual(FakeOllamaHandler.formats, [schema, schema])
+
+    def test_retry_honours_retry_after_and_breaker_opens(self):
+        retry_settings = {"base_delay": 0.01, "max_delay": 0.02, "min_calls": 3, "window": 4, "cooldown": 0.3}
+        config = {"global_settings": {"ai_settings": {"provider": "ollama", "ollama_host": self.host,
+                                                      "ollama_model": "m", "retry_settings": retry_settings}}}
+        service = AiService(config)
+
+        FakeOllamaHandler.errors = [(429, {"Retry-After": "0.2"})]
+        start_time = time.time()
+        self.assertEqual(service.call_ai("prompt"), "ok")
+        self.assertGreaterEqual(time.time() - start_time, 0.2)
+
+        # Client errors are not retried and do not count towards the breaker
+        FakeOllamaHandler.errors = [(401, {}), (401, {})]
+        with self.assertRaises(AiException):
+            service.call_ai("prompt")
+        self.assertEqual(len(FakeOllamaHandler.errors), 1)
+        FakeOllamaHandler.errors = []
+
+        FakeOllamaHandler.errors = [(503, {})] * 4
+        with self.assertRaises(AiException):
+            service.call_ai("prompt", max_retries=3)
+        self.assertEqual(service.circuit_state()["state"], "open")
+        # Open circuit fails fast without reaching the server
+        FakeOllamaHandler.formats = []
+        with self.assertRaises(CircuitOpenError):
+            service.call_ai("prompt")
+        self.assertEqual(FakeOllamaHandler.formats, [])
+
+        time.sleep(0.3)
+        FakeOllamaHandler.errors = []
+        self.assertEqual(service.call_ai("prompt"), "ok")  # Half-open trial succeeds
+        self.assertEqual(service.circuit_state()["state"], "closed")
+
+    def test_calls_are_routed_by_purpose_with_fallback(self):
+        config = {"global_settings": {"ai_settings": {
+            "provider": "ollama", "ollama_host": self.host, "ollama_model": "big",
+            "retry_settings": {"base_delay": 0.01, "max_delay": 0.01},
+            "model_routes": {"evaluate": [{"provider": "ollama", "model": "small"}],
+                             "summarize": [{"provider": "openai", "model": "gpt-4o-mini"}]}
+        }}}
+        service = AiService(config)
+        # The OpenAI route has no key and is skipped, the default model remains as the fallback
+        self.assertEqual(service.model_id("summarize"), "ollama:big")
+
+        service.call_ai("prompt", purpose="evaluate")
+        service.call_ai("prompt", purpose="correct")
+        service.call_ai("prompt", purpose="title")
+        self.assertEqual(FakeOllamaHandler.models, ["small", "small", "big"])
+
+        FakeOllamaHandler.models = []
+        FakeOllamaHandler.errors = [(503, {}), (503, {})]
+        self.assertEqual(service.call_ai("prompt", purpose="evaluate"), "ok")
+        self.assertEqual(FakeOllamaHandler.models, ["small", "small", "big"])
+
+    def test_endpoint_pool_balances_and_ejects_hosts(self):
+        second = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllamaHandler)
+        threading.Thread(target=second.serve_forever, daemon=True).start()
+        self.addCleanup(second.server_close)
+        self.addCleanup(second.shutdown)
+        hosts = [self.host, {"url": f"http://127.0.0.1:{second.server_port}", "weight": 1}, "http://127.0.0.1:9"]
+        config = {"global_settings": {"ai_settings": {"provider": "ollama", "ollama_hosts": hosts, "ollama_model": "m"}}}
+        filter_service, summary_service = AiService(config), AiService(config)
+        self.assertIs(filter_service.endpoint_pool, summary_service.endpoint_pool)
+        self.assertEqual(filter_service.concurrency_limit, 3)
+        # The unreachable host is ejected by the health check
+        self.assertEqual([endpoint["ejected"] for endpoint in filter_service.health()["endpoints"]], [False, False, True])
+
+        FakeOllamaHandler.delay = 0.2
+        start_time = time.time()
+        threads = [threading.Thread(target=(filter_service if i % 2 else summary_service).call_ai, args=("prompt",))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Two hosts each serving one request at a time finish four requests in two rounds
+        self.assertLess(time.time() - start_time, 0.7)
+        self.assertEqual(sorted(FakeOllamaHandler.ports).count(self.server.server_port), 2)
+        self.assertEqual(sorted(FakeOllamaHandler.ports).count(second.server_port), 2)
+
+    def test_pool_and_pinned_route_keep_separate_limiters(self):
+        second = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllamaHandler)
+        threading.Thread(target=second.serve_forever, daemon=True).start()
+        self.addCleanup(second.server_close)
+        self.addCleanup(second.shutdown)
+        hosts = [self.host, f"http://127.0.0.1:{second.server_port}"]
+        config = {"global_settings": {"ai_settings": {
+            "provider": "ollama", "ollama_hosts": hosts, "ollama_model": "big",
+            "model_routes": {"evaluate": [{"provider": "ollama", "model": "small", "host": self.host}]}
+        }}}
+        pool_service = AiService(config)
+        route_service = pool_service.route_for("evaluate")[0]
+
+        self.assertIsNot(route_service, pool_service)
+        self.assertEqual(pool_service.limiter.concurrency, 2)
+        self.assertEqual(route_service.limiter.concurrency, 1)
+        # Building more services does not replace the limiter the pool service is using
+        other_service = AiService(config)
+        self.assertIs(other_service.limiter, pool_service.limiter)
+        self.assertIs(other_service.route_for("evaluate")[0].limiter, route_service.limiter)
+        self.assertEqual(pool_service.limiter.concurrency, 2)
+
+    def test_routes_share_limits_only_with_the_same_host(self):
+        second = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllamaHandler)
+        threading.Thread(target=second.serve_forever, daemon=True).start()
+        self.addCleanup(second.server_close)
+        self.addCleanup(second.shutdown)
+        retry_settings = {"base_delay": 0.01, "max_delay": 0.01, "min_calls": 2, "window": 2, "cooldown": 60}
+        config = {"global_settings": {"ai_settings": {
+            "provider": "ollama", "ollama_host": self.host, "ollama_model": "big", "retry_settings": retry_settings,
+            "model_routes": {"evaluate": [{"provider": "ollama", "model": "small"}],
+                             "summarize": [{"provider": "ollama", "model": "big",
+                                            "host": f"http://127.0.0.1:{second.server_port}"}]}
+        }}}
+        service = AiService(config)
+        same_host, other_host = service.route_for("evaluate")[0], service.route_for("summarize")[0]
+        self.assertIs(same_host.limiter, service.limiter)
+        self.assertIs(same_host.circuit_breaker, service.circuit_breaker)
+        self.assertIsNot(other_host.limiter, service.limiter)
+        self.assertIsNot(other_host.circuit_breaker, service.circuit_breaker)
+
+        # Failures on the other host open only its own breaker
+        for _ in range(2):
+            other_host.circuit_breaker.record_failure("down")
+        self.assertEqual(other_host.circuit_state()["state"], "open")
+        self.assertEqual(service.circuit_state()["state"], "closed")
+        self.assertEqual(service.call_ai("prompt", purpose="summarize"), "ok")
+        self.assertEqual(FakeOllamaHandler.models, ["big"])
+
+    def test_warm_up_loads_model_and_keeps_it_alive(self):
+        config = {"global_settings": {"ai_settings": {"provider": "ollama", "ollama_host": self.host, "ollama_model": "m",
+                                                      "warmup": {"lead_minutes": 10}}}}
+        service = AiService(config)
+        self.assertEqual(service.warm_up(), 1)
+        service.call_ai("prompt")
+        # The warm-up keeps the model loaded until the run starts, run requests extend it
+        self.assertEqual(FakeOllamaHandler.keep_alives, [("", "25m"), ("prompt", "15m")])
+
+        config["global_settings"]["ai_settings"]["warmup"] = {"enabled": False}
+        self.assertEqual(AiService(config).warm_up(), 0)
+
+    def test_ollama_routes_need_warm_up(self):
+        self.assertTrue(uses_ollama({"provider": "ollama"}))
+        self.assertFalse(uses_ollama({"provider": "openai", "model_routes": {"evaluate": [{"model": "gpt-4o-mini"}]}}))
+        self.assertTrue(uses_ollama({"provider": "siliconflow",
+                                     "model_routes": {"evaluate": [{"provider": "ollama", "model": "qwen2.5:3b"}]}}))
+
+class TestJsonStreamScanner(unittest.TestCase):
+    def test_scanner_waits_for_valid_json(self):
+        scanner = JsonStreamScanner("[")
+        for piece in ["Sure [see below", "] here: <thi", "nk>[1]</think>", '[{"a": "]"},', ' {"b": 2}', "] done"]:
+            if scanner.feed(piece):
+                break
+        self.assertTrue(scanner.complete)
+        self.assertEqual(json.loads(scanner.result_text()[scanner.result_text().index('[{'):]), [{"a": "]"}, {"b": 2}])
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_parse_rate_limit_headers(self):
+        self.assertEqual(parse_retry_after({"Retry-After": "3"}), 3.0)
+        self.assertEqual(parse_retry_after({"retry-after-ms": "250"}), 0.25)
+        self.assertEqual(parse_retry_after({"x-ratelimit-reset-requests": "1m30s", "x-ratelimit-reset-tokens": "250ms"}), 90.0)
+        self.assertIsNone(parse_retry_after({"Content-Type": "application/json"}))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import os
+import sys
+import threading
+import time
+
+# 将项目根目录添加到Python路径中，解决导入问题
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.rss_parser import RssParser, HostThrottle, get_fetch_settings
+from core.http_client import HttpClient
+from core.wechat_parser import WeChatParser
+
+class FakeDBManager:
+    def __init__(self):
+        self.caches = {}
+
+    def update_feed_cache(self, feed_url, task_id=None, etag=None, last_modified=None, fingerprint=None):
+        self.caches[(feed_url, task_id)] = (etag, last_modified, fingerprint)
+
+class TestRssParser(unittest.TestCase):
+    def test_feed_validators_are_saved_only_on_request(self):
+        parser = RssParser.__new__(RssParser)
+        parser.db_manager = FakeDBManager()
+        feed_results = {
+            "https://a.example.com/rss": {"status": "success", "items": [],
+                                          "feed_cache": {"etag": "v1", "last_modified": None, "fingerprint": "f"}},
+            "https://b.example.com/rss": {"status": "success", "items": [], "feed_cache": {}},
+            "https://c.example.com/rss": {"status": "fail", "items": []}
+        }
+
+        parser.save_feed_caches(feed_results, "task1")
+
+        self.assertEqual(parser.db_manager.caches, {
+            ("https://a.example.com/rss", "task1"): ("v1", None, "f"),
+            ("https://b.example.com/rss", "task1"): (None, None, None)
+        })
+
+    def test_http_client_follows_fetch_concurrency(self):
+        parser = RssParser.__new__(RssParser)
+        parser.user_agent = "Test Agent/1.0"
+        parser.http_client = HttpClient(pool_size=2)
+        parser.wechat_parser = WeChatParser(parser.http_client)
+        old_client = parser.http_client
+
+        parser.fetch_settings = get_fetch_settings({"global_settings": {"fetch_settings": {"max_workers": 6}}})
+        parser._update_http_client()
+        self.assertIsNot(parser.http_client, old_client)
+        self.assertEqual(parser.http_client.session.get_adapter("https://example.com")._pool_maxsize, 6)
+        self.assertIs(parser.wechat_parser.http_client, parser.http_client)
+        self.assertIs(parser.session, parser.http_client.session)
+
+        # Unchanged settings keep the client and its open connections
+        client = parser.http_client
+        parser._update_http_client()
+        self.assertIs(parser.http_client, client)
+        client.close()
+
+class TestHostThrottle(unittest.TestCase):
+    def run_requests(self, throttle, urls, duration):
+        lock = threading.Lock()
+        starts, active, peak = [], {}, {}
+        def request(url):
+            with throttle.slot(url):
+                host = url.split("/")[2]
+                with lock:
+                    starts.append((host, time.monotonic()))
+                    active[host] = active.get(host, 0) + 1
+                    peak[host] = max(peak.get(host, 0), active[host])
+                time.sleep(duration)
+                with lock:
+                    active[host] -= 1
+        threads = [threading.Thread(target=request, args=(url,)) for url in urls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return starts, peak
+
+    def test_concurrency_is_limited_per_host(self):
+        throttle = HostThrottle(per_host_limit=2, min_interval=0)
+        urls = ["https://a.example.com/%d" % i for i in range(6)] + ["https://b.example.com/%d" % i for i in range(6)]
+        _, peak = self.run_requests(throttle, urls, duration=0.05)
+
+        self.assertEqual(peak, {"a.example.com": 2, "b.example.com": 2})
+
+    def test_requests_to_a_host_are_spaced(self):
+        throttle = HostThrottle(per_host_limit=4, min_interval=0.05)
+        urls = ["https://a.example.com/%d" % i for i in range(4)] + ["https://b.example.com/0"]
+        starts, _ = self.run_requests(throttle, urls, duration=0)
+
+        times = sorted(started for host, started in starts if host == "a.example.com")
+        gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+        self.assertTrue(all(gap >= 0.045 for gap in gaps), gaps)
+        # Other hosts are not delayed by the spacing
+        other = [started for host, started in starts if host == "b.example.com"][0]
+        self.assertLess(other - times[0], 0.045)
+
+if __name__ == '__main__':
+    unittest.main()
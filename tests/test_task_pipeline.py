@@ -0,0 +1,128 @@
+import unittest
+import os
+import sys
+import threading
+import time
+
+# 将项目根目录添加到Python路径中，解决导入问题
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.task_pipeline import TaskPipeline
+
+class FakeTask:
+    task_id = "task1"
+    recipients = ["reader@example.com"]
+
+    def get_feed_labels(self, feed_url):
+        return ["tech"]
+
+    def get_feed_negative_labels(self, feed_url):
+        return []
+
+class FakeRssParser:
+    """Delivers each feed after a delay, like a slow download"""
+    def __init__(self, feeds, delay):
+        self.feeds = feeds
+        self.delay = delay
+
+    def fetch_multiple_feeds(self, feed_configs, task_id=None, recipients=None, on_result=None):
+        results = {}
+        for config in feed_configs:
+            time.sleep(self.delay)
+            url = config["url"]
+            results[url] = {"status": "success", "items": [{"title": title} for title in self.feeds[url]]}
+            if on_result:
+                on_result(url, results[url])
+        return results
+
+class FakeFilter:
+    def __init__(self, delay, fail_on=None):
+        self.delay = delay
+        self.fail_on = fail_on
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def filter_content(self, content, index=0, total=1):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        if content["title"] == self.fail_on:
+            raise RuntimeError("AI service unavailable")
+        content["keep"] = not content["title"].startswith("drop")
+        return content, content["keep"]
+
+class FakeSummarizer:
+    def __init__(self, delay):
+        self.delay = delay
+
+    def generate_summary(self, content):
+        time.sleep(self.delay)
+        if content["title"] == "broken":
+            raise RuntimeError("summary failed")
+        content["news_brief"] = f"brief of {content['title']}"
+        content["summary_method"] = "ai"
+        return content
+
+    def mark_summary_error(self, content, error):
+        content["summary_method"] = "error"
+        return content
+
+class TestTaskPipeline(unittest.TestCase):
+    def setUp(self):
+        self.feeds = {
+            "https://a.example.com/rss": ["a1", "drop-a2", "a3"],
+            "https://b.example.com/rss": ["b1", "broken"],
+            "https://c.example.com/rss": ["c1", "drop-c2"]
+        }
+        self.feed_configs = [{"url": url, "items_count": 10} for url in self.feeds]
+
+    def test_results_keep_feed_order(self):
+        pipeline = TaskPipeline(FakeRssParser(self.feeds, 0), FakeFilter(0), FakeSummarizer(0),
+                                {"evaluate_workers": 3, "summarize_workers": 2, "queue_size": 2})
+        result = pipeline.run(FakeTask(), self.feed_configs)
+
+        self.assertIsNone(result["error"])
+        self.assertEqual(len(result["contents"]), 7)
+        self.assertEqual([c["title"] for c in result["kept_contents"]], ["a1", "a3", "b1", "broken", "c1"])
+        self.assertEqual(sorted(c["title"] for c in result["discarded_contents"]), ["drop-a2", "drop-c2"])
+        self.assertEqual(result["kept_contents"][3]["summary_method"], "error")
+        self.assertEqual(result["kept_contents"][0]["feed_labels"], ["tech"])
+
+    def test_stages_overlap(self):
+        # Sequential phases would take 3*0.2 + 7*0.05 + 5*0.05 = 1.2s
+        pipeline = TaskPipeline(FakeRssParser(self.feeds, 0.2), FakeFilter(0.05), FakeSummarizer(0.05))
+        start_time = time.time()
+        result = pipeline.run(FakeTask(), self.feed_configs)
+        elapsed = time.time() - start_time
+
+        self.assertEqual(len(result["kept_contents"]), 5)
+        self.assertLess(elapsed, 1.0)
+
+    def test_evaluate_workers_follow_filter_concurrency(self):
+        content_filter = FakeFilter(0.05)
+        content_filter.evaluation_worker_count = lambda: 3
+        pipeline = TaskPipeline(FakeRssParser(self.feeds, 0), content_filter, FakeSummarizer(0))
+        pipeline.run(FakeTask(), self.feed_configs)
+
+        self.assertEqual(content_filter.max_active, 3)
+
+    def test_repeated_summary_failures_abort(self):
+        feeds = {"https://a.example.com/rss": ["broken"] * 5}
+        pipeline = TaskPipeline(FakeRssParser(feeds, 0), FakeFilter(0), FakeSummarizer(0))
+        result = pipeline.run(FakeTask(), [{"url": url, "items_count": 10} for url in feeds])
+
+        self.assertIn("连续多条内容生成简报失败", str(result["error"]))
+
+    def test_evaluation_error_is_reported(self):
+        pipeline = TaskPipeline(FakeRssParser(self.feeds, 0), FakeFilter(0, fail_on="b1"), FakeSummarizer(0),
+                                {"queue_size": 1})
+        result = pipeline.run(FakeTask(), self.feed_configs)
+
+        self.assertIsInstance(result["error"], RuntimeError)
+
+if __name__ == "__main__":
+    unittest.main()